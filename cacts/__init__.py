@@ -1,12 +1,27 @@
 """ Main entry point for cacts"""
 
-from cacts.cacts import main as cacts_main
-from cacts.get_mach_env import print_mach_env
-
 __version__ = "0.2.1"
 
+# The library API. Modules are only imported when first used, so that short
+# commands (e.g., get-mach-env) do not pay for importing the whole driver.
+_API = {
+    "Driver"         : "cacts.cacts",
+    "resolve_config" : "cacts.parse_config",
+    "ResolvedConfig" : "cacts.parse_config",
+    "RunResult"      : "cacts.results",
+    "BuildResult"    : "cacts.results",
+}
+
+def __getattr__(name):
+    if name in _API:
+        import importlib
+        return getattr(importlib.import_module(_API[name]),name)
+    raise AttributeError(f"module 'cacts' has no attribute '{name}'")
+
 def main() -> None:
+    from cacts.cacts import main as cacts_main
     cacts_main()
 
 def get_mach_env() -> None:
+    from cacts.get_mach_env import print_mach_env
     print_mach_env()
@@ -0,0 +1,164 @@
+"""
+Utilities to process build types in batch jobs. A job script is generated
+from the machine settings, submitted to the scheduler, and tracked until
+all build types are done. Each build type runs as a worker (see distributed.py).
+"""
+
+import os
+import time
+import shlex
+import pathlib
+import subprocess
+
+from .utils        import expect, run_cmd, run_cmd_no_fail
+from .distributed  import get_worker_cmd
+
+# Slurm job states after which the job will not run any more
+FINAL_STATES = ["COMPLETED","FAILED","CANCELLED","TIMEOUT","NODE_FAIL","OUT_OF_MEMORY","PREEMPTED","BOOT_FAIL","DEADLINE"]
+
+###############################################################################
+def generate_job_script(script_file, state_files, machine, mode, job_name):
+###############################################################################
+    """
+    Write a slurm job script that processes one build type (i.e., one worker
+    state file) per job array element (mode='array') or per component of a
+    heterogeneous job (mode='hetjob')
+    """
+
+    expect (mode in ["array","hetjob"],
+            f"Unsupported batch mode '{mode}'. Use one of array, hetjob.\n")
+
+    # Each build type gets a whole node
+    resources  = "#SBATCH --nodes=1\n"
+    resources += "#SBATCH --ntasks=1\n"
+    resources += f"#SBATCH --cpus-per-task={max(machine.num_bld_res,machine.num_run_res)}\n"
+    if machine.uses_gpu():
+        resources += f"#SBATCH --gpus-per-node={machine.num_run_res}\n"
+
+    out_dir = pathlib.Path(script_file).parent
+    cmds = [get_worker_cmd(f,"local") for f in state_files]
+
+    text  = "#!/bin/bash\n"
+    text += "# This file was automatically generated by CACTS.\n"
+    text += f"#SBATCH --job-name={job_name}\n"
+    if mode=="array":
+        text += f"#SBATCH --array=0-{len(cmds)-1}\n"
+        text += f"#SBATCH --output={out_dir}/{job_name}-%a.out\n"
+        text += resources + "\n"
+
+        text += "case $SLURM_ARRAY_TASK_ID in\n"
+        for i,cmd in enumerate(cmds):
+            text += f"  {i}) {cmd} ;;\n"
+        text += "esac\n"
+    else:
+        text += f"#SBATCH --output={out_dir}/{job_name}.out\n"
+        text += "\n#SBATCH hetjob\n".join([resources]*len(cmds)) + "\n"
+
+        # The fake scheduler has no srun, so it simply runs the commands
+        text += 'if [ -n "$CACTS_FAKE_SCHEDULER" ]; then\n'
+        text += '  launch () { shift; "$@"; }\n'
+        text += 'else\n'
+        text += '  launch () { group=$1; shift; srun --het-group=$group "$@"; }\n'
+        text += 'fi\n\n'
+        for i,cmd in enumerate(cmds):
+            text += f"launch {i} sh -c {shlex.quote(cmd)} &\n"
+        text += "wait\n"
+
+    pathlib.Path(script_file).write_text(text)
+
+###############################################################################
+class SlurmScheduler(object):
+###############################################################################
+    """
+    Submit and track jobs with sbatch/sacct
+    """
+
+    poll_interval = 30
+
+    def submit(self, script_file, options):
+        out = run_cmd_no_fail(f"sbatch --parsable {options or ''} {script_file}")
+        # Output is 'jobid' or 'jobid;cluster'
+        return out.split(";")[0].strip()
+
+    def get_states(self, job_id):
+        """
+        Return a dict job_step->state for the array elements/components of the job
+        """
+        stat, out, _ = run_cmd(f"sacct -j {job_id} --format=JobID,State --noheader --parsable2 -X")
+        states = {}
+        if stat==0:
+            for line in out.splitlines():
+                step, _, state = line.partition("|")
+                # States can have extra info, as in 'CANCELLED by 123'
+                states[step] = state.split()[0] if state else "UNKNOWN"
+        return states
+
+###############################################################################
+class FakeScheduler(object):
+###############################################################################
+    """
+    A stand-in for slurm, which runs the job script locally. Array elements
+    are run concurrently, each with its SLURM_ARRAY_TASK_ID. Meant for testing.
+    """
+
+    poll_interval = 1
+
+    def __init__(self):
+        self._jobs = {}
+
+    def submit(self, script_file, options):
+        text = pathlib.Path(script_file).read_text()
+        job_id = str(len(self._jobs)+1)
+
+        num_elems = 1
+        for line in text.splitlines():
+            if line.startswith("#SBATCH --array=0-"):
+                num_elems = int(line.split("-")[-1])+1
+
+        procs = {}
+        for i in range(num_elems):
+            env = dict(os.environ,CACTS_FAKE_SCHEDULER="1",SLURM_ARRAY_TASK_ID=str(i),SLURM_JOB_ID=job_id)
+            out_file = pathlib.Path(script_file).with_suffix(f".fake-{i}.out")
+            with out_file.open("w") as out:
+                procs[f"{job_id}_{i}" if num_elems>1 else job_id] = \
+                    subprocess.Popen(["bash",str(script_file)],env=env,stdout=out,stderr=subprocess.STDOUT)
+        self._jobs[job_id] = procs
+
+        return job_id
+
+    def get_states(self, job_id):
+        states = {}
+        for step, proc in self._jobs[job_id].items():
+            rc = proc.poll()
+            states[step] = "RUNNING" if rc is None else ("COMPLETED" if rc==0 else "FAILED")
+        return states
+
+###############################################################################
+def wait_for_job(scheduler, job_id, max_failed_polls=10):
+###############################################################################
+    """
+    Poll the scheduler until all the steps of the job are in a final state,
+    printing state changes along the way. Gives up if the scheduler reports
+    no state (e.g., sacct fails, or does not know the job) max_failed_polls
+    times in a row.
+    """
+
+    last = {}
+    failed_polls = 0
+    while True:
+        states = scheduler.get_states(job_id)
+        for step, state in sorted(states.items()):
+            if last.get(step,None)!=state:
+                print(f"  job {step}: {state}")
+        last = states or last
+
+        if states and all(s in FINAL_STATES for s in states.values()):
+            return states
+
+        failed_polls = 0 if states else failed_polls+1
+        expect (failed_polls<max_failed_polls,
+                f"Could not get the state of batch job {job_id} from the scheduler {failed_polls} times in a row.\n"
+                f"  - last known states: {last or 'none'}\n"
+                "  - note: the job may still be running (cancel it with 'scancel' if needed)\n")
+
+        time.sleep(scheduler.poll_interval)
@@ -0,0 +1,90 @@
+"""
+Helpers for 'cacts bisect': drive git bisect between a good and a bad commit,
+letting a callback decide whether each commit is good, bad, or cannot be
+tested (skipped), and keep a record of the steps.
+"""
+
+import re
+import json
+import pathlib
+
+from .utils import expect, run_cmd, run_cmd_no_fail, is_clean_tree
+
+# The verdicts a step can return, as understood by git bisect
+VERDICTS = ["good", "bad", "skip"]
+
+###############################################################################
+def get_first_bad_commit(output):
+###############################################################################
+    """
+    Return the sha of the first bad commit if the output of a git bisect
+    command says that the bisection is over, or None
+    """
+
+    m = re.search(r'^([0-9a-f]{7,40}) is the first bad commit',output,re.M)
+    return m.group(1) if m else None
+
+###############################################################################
+def git_bisect(repo, args):
+###############################################################################
+    stat, out, err = run_cmd(f"git bisect {args}",from_dir=repo)
+    return stat, out + ("\n"+err if err else "")
+
+###############################################################################
+def run_bisection(repo, good, bad, evaluate, record_file, exclude=None):
+###############################################################################
+    """
+    Bisect the commits between good and bad in repo. evaluate(sha) is called
+    on each commit checked out by git bisect, and must return (verdict,info),
+    with verdict one of VERDICTS, and info a json-friendly dict stored in
+    record_file with the verdict. The repo is restored to its original state
+    at the end. Returns (first_bad_sha,steps), where first_bad_sha is None if
+    the bisection could not conclude (e.g., too many skipped commits).
+    Paths in exclude (e.g., a work dir inside the repo) are not considered
+    local modifications.
+    """
+
+    expect (is_clean_tree(repo,exclude),
+            "Cannot bisect with local modifications in the repo, since commits get checked out.\n"
+            f"  - repo: {repo}\n")
+
+    # Resolve the refs now, since names like HEAD change while bisecting
+    good = run_cmd_no_fail(f"git rev-parse --verify {good}^{{commit}}",from_dir=repo)
+    bad  = run_cmd_no_fail(f"git rev-parse --verify {bad}^{{commit}}",from_dir=repo)
+
+    stat, out = git_bisect(repo,f"start {bad} {good}")
+    expect (stat==0,
+            f"Could not start git bisect.\n  - output: {out}\n")
+
+    steps = []
+    first_bad = get_first_bad_commit(out)
+    try:
+        while first_bad is None:
+            sha = run_cmd_no_fail("git rev-parse HEAD",from_dir=repo)
+            subject = run_cmd_no_fail("git log -1 --format=%s HEAD",from_dir=repo)
+            print("===============================================================================")
+            print(f"Bisect step {len(steps)+1}: {sha[:12]} {subject}")
+            print("===============================================================================")
+
+            verdict, info = evaluate(sha)
+            expect (verdict in VERDICTS,
+                    f"Invalid bisect verdict '{verdict}'. Must be one of {', '.join(VERDICTS)}\n")
+            print(f"Commit {sha[:12]} is {verdict if verdict!='skip' else 'untestable (skipped)'}")
+
+            steps.append(dict(info,sha=sha,subject=subject,verdict=verdict))
+            pathlib.Path(record_file).write_text(json.dumps({"good" : good, "bad" : bad, "steps" : steps},indent=2))
+
+            stat, out = git_bisect(repo,verdict)
+            first_bad = get_first_bad_commit(out)
+            if first_bad is None and stat!=0:
+                # E.g., only skipped commits are left
+                print(out)
+                break
+    finally:
+        log = git_bisect(repo,"log")[1]
+        git_bisect(repo,"reset")
+
+    record = {"good" : good, "bad" : bad, "first_bad" : first_bad, "steps" : steps, "git_bisect_log" : log}
+    pathlib.Path(record_file).write_text(json.dumps(record,indent=2))
+
+    return first_bad, steps
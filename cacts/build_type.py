@@ -1,6 +1,7 @@
 import re
 
-from .utils import expect, expand_variables, evaluate_commands, str_to_bool
+from .utils    import expect, evaluate_commands, str_to_bool
+from .template import expand_variables
 
 ###############################################################################
 class BuildType(object):
@@ -42,6 +43,7 @@ class BuildType(object):
         self.uses_baselines = props.get('uses_baselines',None)
         self.on_by_default  = props.get('on_by_default',None)
         self.coverage = props.get('coverage',False)
+        self.memcheck = props.get('memcheck',False)
         if  self.uses_baselines is None:
             self.uses_baselines = default.get('uses_baselines',True)
         if  self.on_by_default is None:
@@ -57,7 +59,8 @@ class BuildType(object):
                 f"  - input value: {default.get('cmake_args',{})}\n"
                 f"  - input type: {type(default.get('cmake_args',{}))}\n"
                  "  - expected type: dict\n")
-        self.cmake_args = default.get('cmake_args',{})
+        # Copy, since the default settings are shared by all build types
+        self.cmake_args = dict(default.get('cmake_args',{}))
         self.cmake_args.update(props.get('cmake_args',{}))
 
         # Perform substitution of ${..} strings
@@ -0,0 +1,184 @@
+"""
+Caches of results, which allow CACTS to skip work that was already done
+on identical inputs
+"""
+
+import os
+import json
+import hashlib
+import pathlib
+
+from .utils import run_cmd, sha256_file
+
+###############################################################################
+class TestCache(object):
+###############################################################################
+    """
+    Stores, for each test of a build type, the hash of all the inputs of the
+    test the last time it passed. A test whose current hash matches the stored
+    one does not need to run again.
+    """
+
+    def __init__(self, cache_file, build_dir, root_dir, env_setup=None):
+        self._cache_file = pathlib.Path(cache_file)
+        self._build_dir  = pathlib.Path(build_dir)
+        self._root_dir   = pathlib.Path(root_dir)
+        self._env_setup  = env_setup
+
+        self._file_hashes = {}
+        self._shared_libs = {}
+
+        if self._cache_file.exists():
+            self._passed = json.loads(self._cache_file.read_text())
+        else:
+            self._passed = {}
+
+    ###########################################################################
+    def compute_hashes(self, tests):
+    ###########################################################################
+        """
+        Return a dict test_name->hash, for the tests as returned by get_ctest_tests
+        """
+        return {t["name"] : self.hash_test(t) for t in tests}
+
+    ###########################################################################
+    def get_cached_passes(self, hashes):
+    ###########################################################################
+        """
+        Return the names of the tests whose hash matches the one of their last pass
+        """
+        return [name for name,h in hashes.items() if self._passed.get(name)==h]
+
+    ###########################################################################
+    def update(self, hashes, results):
+    ###########################################################################
+        """
+        Record the tests that passed, and forget the ones that failed. Tests that
+        did not run (e.g., because they were cached) are left untouched, while
+        tests that no longer exist are dropped.
+        """
+        self._passed = {n : h for n,h in self._passed.items() if n in hashes}
+        for name,status in results.items():
+            if name not in hashes:
+                continue
+            if status=="passed":
+                self._passed[name] = hashes[name]
+            else:
+                self._passed.pop(name,None)
+
+    ###########################################################################
+    def save(self):
+    ###########################################################################
+        self._cache_file.parent.mkdir(parents=True,exist_ok=True)
+        tmp_file = self._cache_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(self._passed,indent=2,sort_keys=True))
+        os.replace(tmp_file,self._cache_file)
+
+    ###########################################################################
+    def hash_test(self, test):
+    ###########################################################################
+        h = hashlib.sha256()
+        h.update(json.dumps([test["name"],test["command"],test["properties"],self._env_setup],
+                            sort_keys=True).encode())
+
+        # Any file in the command line is an input of the test: the executable,
+        # the input files passed as args, but also the MPI launcher. Files declared
+        # via the REQUIRED_FILES property are inputs as well.
+        files = [arg for arg in test["command"] if os.path.isabs(arg) and os.path.isfile(arg)]
+        required = test["properties"].get("REQUIRED_FILES",[])
+        files += required if isinstance(required,list) else required.split(";")
+
+        for fn in files:
+            h.update(fn.encode())
+            h.update(self.hash_file(fn).encode())
+            if os.access(fn,os.X_OK):
+                for lib in self.get_shared_libs(fn):
+                    h.update(lib.encode())
+                    h.update(self.hash_file(lib).encode())
+
+        return h.hexdigest()
+
+    ###########################################################################
+    def hash_file(self, fn):
+    ###########################################################################
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return "missing"
+
+        key = (fn, st.st_size, st.st_mtime_ns)
+        if key not in self._file_hashes:
+            path = pathlib.Path(fn).resolve()
+            if self._build_dir in path.parents or self._root_dir in path.parents:
+                self._file_hashes[key] = sha256_file(path)
+            else:
+                # Files outside the project (system/MPI/GPU libraries) can be huge,
+                # and are not expected to change in place, so size and mtime suffice
+                self._file_hashes[key] = f"{st.st_size}-{st.st_mtime_ns}"
+
+        return self._file_hashes[key]
+
+    ###########################################################################
+    def get_shared_libs(self, exe):
+    ###########################################################################
+        if exe not in self._shared_libs:
+            libs = []
+            stat, out, _ = run_cmd(f"ldd {exe}",env_setup=self._env_setup)
+            if stat==0:
+                # Lines have the form 'libfoo.so => /path/to/libfoo.so (0x...)'
+                for line in out.splitlines():
+                    if "=>" in line:
+                        lib = line.split("=>")[1].split("(")[0].strip()
+                        if lib and os.path.isabs(lib):
+                            libs.append(lib)
+            self._shared_libs[exe] = sorted(libs)
+
+        return self._shared_libs[exe]
+
+###############################################################################
+class BuildCache(object):
+###############################################################################
+    """
+    Stores the outcome of build types that passed, keyed by a fingerprint of
+    all their inputs (source tree, cmake config, environment, test selection).
+    A build type whose fingerprint is in the cache does not need to run again.
+    """
+
+    # Only keep the most recent entries, to prevent the file from growing forever
+    max_entries = 200
+
+    def __init__(self, cache_file):
+        self._cache_file = pathlib.Path(cache_file)
+
+        if self._cache_file.exists():
+            self._entries = json.loads(self._cache_file.read_text())
+        else:
+            self._entries = {}
+
+    ###########################################################################
+    @staticmethod
+    def fingerprint(**inputs):
+    ###########################################################################
+        return hashlib.sha256(json.dumps(inputs,sort_keys=True,default=str).encode()).hexdigest()
+
+    ###########################################################################
+    def get(self, key):
+    ###########################################################################
+        return self._entries.get(key,None)
+
+    ###########################################################################
+    def add(self, key, record):
+    ###########################################################################
+        self._entries[key] = record
+        if len(self._entries)>self.max_entries:
+            oldest = sorted(self._entries,key=lambda k: self._entries[k]["date"])
+            for k in oldest[:len(self._entries)-self.max_entries]:
+                del self._entries[k]
+
+    ###########################################################################
+    def save(self):
+    ###########################################################################
+        self._cache_file.parent.mkdir(parents=True,exist_ok=True)
+        tmp_file = self._cache_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(self._entries,indent=2,sort_keys=True))
+        os.replace(tmp_file,self._cache_file)
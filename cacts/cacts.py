@@ -1,34 +1,121 @@
 import os
+import re
 import sys
+import copy
 import pathlib
 import concurrent.futures as threading
 import shutil
-import psutil
 import json
 import itertools
 import argparse
+import datetime
+import socket
+import uuid
 
 from .project       import Project
 from .machine       import Machine
 from .build_type    import BuildType
-from .parse_config  import parse_project, parse_machine, parse_builds
-from .utils         import expect, run_cmd, get_current_ref, get_current_sha, is_git_repo, \
-                           check_minimum_python_version, GoodFormatter
-
-check_minimum_python_version(3, 4)
+from .parse_config  import resolve_config, ResolvedConfig
+from .ctest_data    import get_ctest_tests, get_test_results, iter_test_results, get_tag_dir, tests_regex, \
+                           merge_test_xml, replace_test_results, write_ctest_resource_file, get_phase_times
+from .results       import BuildResult, RunResult
+from .cache         import TestCache, BuildCache
+from .history       import TestHistory, partition_by_cost
+from .distributed   import write_worker_state, run_workers, clear_worker_result, read_worker_result
+from .batch         import generate_job_script, SlurmScheduler, FakeScheduler, wait_for_job
+from .changes       import get_changed_files, write_file_api_query, get_affected_tests
+from .plan          import write_plan, read_plan
+from .log_summary   import summarize_log
+from .scratch       import get_scratch_root, get_scratch_trash, remove_dir, has_room, \
+                           setup_scratch_build_dir, sync_back, sync_in_background, \
+                           is_stub, DEFAULT_TREE_SIZE
+from .trash         import move_to_trash, empty_trash_in_background, collect_garbage
+from .retention     import LogArchive, compress_logs_in_place
+from .coverage      import process_coverage, summarize_coverage, write_lcov, write_cobertura, diff_coverage
+from .report        import write_build_report, write_unified_report, JUNIT_FRAGMENT, JSON_FRAGMENT
+from .memcheck      import VALGRIND_OPTIONS, iter_memcheck_results, aggregate_defects, format_defect_report
+from .bisect        import run_bisection
+from .watchdog      import Watchdog, CancelMonitor, save_events, load_events
+from .handoff       import MANIFEST_FILE, TEST_STAGE_SCRIPT, get_test_files, get_max_test_resources, hash_env, \
+                           test_stage_main
+from .utils         import expect, run_cmd, run_cmd_no_fail, get_current_ref, get_current_sha, is_git_repo, \
+                           is_clean_tree, get_tree_hash, get_env_snapshot, get_available_cpu_ids, \
+                           get_tree_size, check_minimum_python_version, GoodFormatter, SharedArea
+
+check_minimum_python_version(3, 8)
+
+# With --fail-fast POLICY, failures in these phases cancel the other build types.
+# None means that the build type failed before configuring.
+FAIL_FAST_PHASES = {
+    "configure" : [None, "configure"],
+    "build"     : [None, "configure", "build"],
+    "any"       : [None, "configure", "build", "test", "memcheck"],
+}
 
 ###############################################################################
 def main():
 ###############################################################################
     from . import __version__  # Import __version__ here to avoid circular import
-    driver = Driver(**vars(parse_command_line(sys.argv, __doc__, __version__)))
 
-    success = driver.run()
+    # Subcommands take the same arguments as the main command
+    if len(sys.argv)>1 and sys.argv[1]=="test-stage":
+        success = test_stage_main(sys.argv[2:])
+    elif len(sys.argv)>1 and sys.argv[1]=="execute":
+        expect (len(sys.argv)==3, f"Usage: {pathlib.Path(sys.argv[0]).name} execute PLAN_FILE\n")
+        driver = Driver.from_plan(sys.argv[2])
+        success = driver.run()
+    elif len(sys.argv)>1 and sys.argv[1]=="bisect":
+        # The status of the last step says nothing about the bisection
+        found = bisect_main(sys.argv[2:], __version__)
+        print("BISECT STATUS: {}".format("FIRST BAD COMMIT FOUND" if found else "INCONCLUSIVE"))
+        sys.exit(0 if found else 1)
+    elif len(sys.argv)>1 and sys.argv[1]=="merge-results":
+        driver = Driver(**vars(parse_command_line(sys.argv[1:], __doc__, __version__)))
+        success = driver.merge_results()
+    else:
+        driver = Driver(**vars(parse_command_line(sys.argv, __doc__, __version__)))
+        success = driver.run()
 
     print("OVERALL STATUS: {}".format("PASS" if success else "FAIL"))
 
     sys.exit(0 if success else 1)
 
+###############################################################################
+def bisect_main(args, version):
+###############################################################################
+    """
+    Entry point of 'cacts bisect'. Returns True if the first bad commit was found.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog=f"{pathlib.Path(sys.argv[0]).name} bisect",
+        description="Find the first commit where the selected tests fail (or get slower than a threshold), "
+                    "using git bisect. Each build type reuses its build tree from one step to the next "
+                    "(see --incremental). All the other options of cacts can be used, e.g. -t and --test-regex.",
+        formatter_class=GoodFormatter
+    )
+    parser.add_argument("--good", required=True, metavar="REF",
+                        help="A commit where the tests pass (or are fast enough)")
+    parser.add_argument("--bad", default="HEAD", metavar="REF",
+                        help="A commit where the tests fail (or are too slow)")
+    parser.add_argument("--max-time", type=float, metavar="SECONDS",
+                        help="Also consider bad the commits where the selected tests take more than SECONDS "
+                             "in total (summed over the build types)")
+    parser.add_argument("--repeat", type=int, default=1, metavar="N",
+                        help="With --max-time, run the tests N times at each commit, and use the fastest run")
+
+    bisect_args, rest = parser.parse_known_args(args)
+    options = vars(parse_command_line([sys.argv[0]]+rest, __doc__, version))
+    expect (not (options["plan"] or options["generate"] or options["skip_config"] or
+                 options["skip_build"] or options["rerun_failed"]),
+            "Cannot bisect with --plan, -g, --skip-config, --skip-build or --rerun-failed.\n")
+    expect (bisect_args.repeat>=1, "--repeat must be at least 1.\n")
+
+    driver = Driver(**dict(options,incremental=True))
+    first_bad = driver.bisect(bisect_args.good,bisect_args.bad,bisect_args.max_time,bisect_args.repeat)
+
+    return first_bad is not None
+
 ###############################################################################
 class Driver(object):
 ###############################################################################
@@ -39,27 +126,74 @@ class Driver(object):
                  work_dir=None, root_dir=None, baseline_dir=None,
                  cmake_args=None, test_regex=None, test_labels=None,
                  config_only=False, build_only=False, skip_config=False, skip_build=False,
-                 generate=False, submit=False, parallel=False, verbose=False):
+                 generate=False, submit=False, parallel=False, verbose=False,
+                 test_cache=False, force_tests=False, build_cache=False, changed_since=None,
+                 rerun_failed=False, retries=0, flaky_retries=2, quarantine=False, shard=None,
+                 launcher=None, hosts=None, batch=None, fake_scheduler=False,
+                 stall_timeout=None, test_timeout_factor=None, fail_fast=None,
+                 gc_max_age=None, gc_max_size=None,
+                 archive_logs=False, archive_max_age=None, archive_max_size=None,
+                 coverage_diff=False, keep_duplicates=False, incremental=False,
+                 plan=None, resolved_config=None):
     ###########################################################################
 
+        # Store the options, so that they can be saved in a plan file
+        self._options = {k : v for k,v in locals().items() if k not in ["self","plan","resolved_config"]}
+
         self._submit        = submit
         self._parallel      = parallel
         self._generate      = generate
         self._baselines_dir = baseline_dir
-        self._cmake_args    = cmake_args
+        self._cmake_args    = cmake_args or []
         self._work_dir      = pathlib.Path(work_dir or os.getcwd()+"/ctest-build").expanduser().absolute()
         self._verbose       = verbose
         self._config_only   = config_only
         self._build_only    = build_only
-        self._skip_config   = skip_config or skip_build # If we skip build, we also skip config
-        self._skip_build    = skip_build
+        self._rerun_failed  = rerun_failed
+        self._retries       = retries
+        self._flaky_retries = flaky_retries
+        self._quarantine    = quarantine
+        self._shard         = None
+        self._launcher      = launcher
+        self._hosts         = hosts.split(",") if hosts else []
+        self._batch         = batch
+        self._fake_scheduler = fake_scheduler
+        self._plan          = plan
+        self._stall_timeout = stall_timeout
+        self._test_timeout_factor = test_timeout_factor
+        self._fail_fast     = fail_fast
+        self._gc_max_age    = gc_max_age
+        self._gc_max_size   = gc_max_size
+        self._archive_logs  = archive_logs
+        self._archive_max_age  = archive_max_age
+        self._archive_max_size = archive_max_size
+        self._coverage_diff = coverage_diff
+        self._keep_duplicates = keep_duplicates
+        self._incremental   = incremental
+        self._run_id        = None # Set while run() is in progress
+        # Incremental builds are often repeated at nearby commits, so a compiler cache pays off
+        self._compiler_launcher = shutil.which("ccache") if incremental else None
+        self._skip_config   = skip_config or skip_build or rerun_failed # If we skip build, we also skip config
+        self._skip_build    = skip_build or rerun_failed # Reruns happen in the existing build
         self._test_regex    = test_regex
-        self._test_labels   = test_labels
+        self._test_labels   = test_labels or []
+        self._test_cache    = test_cache
+        self._force_tests   = force_tests
+        self._build_cache   = build_cache
+        self._changed_since = changed_since
+        if resolved_config is not None:
+            # Default to the root dir and config file the config was resolved with
+            root_dir    = root_dir or resolved_config.project.root_dir
+            config_file = config_file or resolved_config.config_file
         self._root_dir      = pathlib.Path(root_dir or os.getcwd()).expanduser().absolute()
         self._machine       = None
         self._builds        = []
         self._config_file   = pathlib.Path(config_file or self._root_dir / "cacts.yaml")
 
+        # Plans must not depend on the folder they are executed from
+        self._options.update(work_dir=str(self._work_dir),root_dir=str(self._root_dir),
+                             config_file=str(self._config_file))
+
         # Ensure work dir exists
         self._work_dir.mkdir(parents=True,exist_ok=True)
 
@@ -67,14 +201,24 @@ class Driver(object):
         #  Parse the project config file  #
         ###################################
 
-        expect (self._config_file.exists(),
-                f"Could not find/open config file: {self._config_file}\n")
         expect (not (local and machine_name),
                 "Makes no sense to use -m/--machine and -l/--local at the same time")
 
-        self._project = parse_project(self._config_file,self._root_dir)
-        self._machine = parse_machine(self._config_file,self._project,'local' if local else machine_name)
-        self._builds  = parse_builds(self._config_file,self._project,self._machine,self._generate,build_types)
+        if resolved_config is not None:
+            # The config was already parsed and evaluated (e.g., from a plan, or via
+            # resolve_config). Work on copies, since build objects get modified here.
+            self._project, self._machine, builds, _ = copy.deepcopy(resolved_config)
+            if build_types:
+                names = [b.name for b in builds]
+                for name in build_types:
+                    expect (name in names,
+                            f"Build type '{name}' not found in the resolved config.\n"
+                            f" - available build types: {','.join(names)}\n")
+                builds = [b for b in builds if b.name in build_types]
+            self._builds = builds
+        else:
+            self._project, self._machine, self._builds, _ = \
+                resolve_config(self._config_file,self._root_dir,machine_name,build_types,self._generate,local)
 
         ###################################
         #          Sanity Checks          #
@@ -86,6 +230,48 @@ class Driver(object):
                 "Makes no sense to use --build-only and --skip-build together.\n")
         expect (not (self._generate and self._skip_config),
                 "We do not allow to skip config/build phases when generating baselines.\n")
+        expect (not (self._incremental and self._skip_config),
+                "Makes no sense to use --incremental with --skip-config/--skip-build/--rerun-failed.\n")
+        if shard is not None:
+            try:
+                index, num_shards = (int(n) for n in shard.split("/"))
+            except ValueError:
+                print(f"Invalid value for --shard: '{shard}'. Should be I/N, with I and N integers.")
+                raise
+            expect (1<=index<=num_shards,
+                    f"Invalid value for --shard: '{shard}'. Shard index should be between 1 and {num_shards}.\n")
+            expect (not self._generate,
+                    "Cannot shard tests when generating baselines.\n")
+            self._shard = (index,num_shards)
+
+        expect (not (self._batch and self._launcher),
+                "Makes no sense to use --batch and --launcher together.\n")
+        expect (not (self._batch and self._parallel),
+                "Makes no sense to use -p/--parallel with --batch, since each build type gets a whole node.\n")
+        expect (self._batch or not self._fake_scheduler,
+                "Makes no sense to use --fake-scheduler without --batch.\n")
+        expect (not (self._launcher and self._parallel),
+                "Makes no sense to use -p/--parallel with --launcher, since each worker gets a whole node.\n")
+        expect (self._launcher=="ssh" or not self._hosts,
+                "Makes no sense to use --hosts without '--launcher ssh'.\n")
+        expect (self._launcher!="ssh" or self._hosts,
+                "Launcher 'ssh' requires a list of hosts (use --hosts).\n")
+
+        expect (not (self._rerun_failed and (self._generate or self._config_only or self._build_only)),
+                "Makes no sense to use --rerun-failed with -g, --config-only or --build-only.\n")
+        expect (self._rerun_failed or self._retries==0,
+                "Makes no sense to use --retries without --rerun-failed.\n")
+        expect (not (self._generate and self._test_cache),
+                "Cannot use cached test results when generating baselines. Re-run without --test-cache.\n")
+        expect (self._test_cache or not self._force_tests,
+                "Makes no sense to use --force-tests without --test-cache.\n")
+        expect (not (self._generate and self._build_cache),
+                "Cannot use cached build results when generating baselines. Re-run without --build-cache.\n")
+        expect (self._fail_fast in [None]+list(FAIL_FAST_PHASES.keys()),
+                f"Invalid value for --fail-fast: '{self._fail_fast}'. "
+                f"Use one of {', '.join(FAIL_FAST_PHASES.keys())}.\n")
+        expect (not (self._plan and resolved_config is not None),
+                "Makes no sense to use --plan when executing a plan.\n")
 
         # We print some git sha info (as well as store it in baselines) so make sure we are in a git repo
         expect(is_git_repo(self._root_dir),
@@ -102,6 +288,11 @@ class Driver(object):
                     (cdash.get('drop_site',None) and cdash.get('drop_location',None)),
                     "Cannot submit to cdash, since project.cdash.url is not set. Please fix your yaml config file.\n")
 
+        # Compute the changed files once, rather than once per build type
+        if self._changed_since:
+            self._changed_files = get_changed_files(self._root_dir,self._changed_since)
+            print(f"Found {len(self._changed_files)} files changed since {self._changed_since}")
+
         ###################################
         #      Compute baseline info      #
         ###################################
@@ -126,6 +317,14 @@ class Driver(object):
         if self._generate:
             expect(self._baselines_dir is not None, "Cannot generate without -b/--baseline-dir")
 
+        if not self._keep_duplicates:
+            self.remove_duplicate_builds()
+
+        # Drivers created from the resolved config (plans, bisect steps) select the
+        # builds by name, but matrix names are only expanded when parsing the config
+        if build_types:
+            self._options.update(build_types=[b.name for b in self._builds])
+
         ###################################
         #    Set computational resources  #
         ###################################
@@ -156,12 +355,103 @@ class Driver(object):
                 b.testing_res_count = self._machine.num_run_res
                 b.compile_res_count = self._machine.num_bld_res
 
+    ###############################################################################
+    def remove_duplicate_builds(self):
+    ###############################################################################
+        """
+        Only keep the first of the build types whose cmake configuration and
+        environment are identical (e.g., matrix variants whose settings end up
+        being the same), since they would build and test the same thing
+        """
+
+        env = " && ".join(self._machine.env_setup)
+        kept = {}
+        for build in self._builds:
+            key = (self.generate_cmake_config(build),env,build.coverage,build.memcheck)
+            if key in kept:
+                print(f"Skipping build type {build.longname}: its configuration is identical to "
+                      f"the one of {kept[key].longname} (use --keep-duplicates to run both)")
+            else:
+                kept[key] = build
+        self._builds = list(kept.values())
+
+    ###############################################################################
+    @classmethod
+    def from_plan(cls, plan_file):
+    ###############################################################################
+        """
+        Create a driver from a plan file written with --plan, without parsing
+        the config file again. Warns if the commands and resources computed
+        on this node differ from the planned ones.
+        """
+
+        plan = read_plan(plan_file)
+        driver = cls(**plan["options"],resolved_config=ResolvedConfig(plan["project"],plan["machine"],plan["builds"],
+                                                                      plan["config_file"]))
+
+        for name, actions in driver.get_plan_actions().items():
+            planned = plan["actions"].get(name,{})
+            diff = [k for k,v in actions.items() if planned.get(k,None)!=v]
+            if diff:
+                print(f"WARNING: build type {name} differs from the plan in: {', '.join(diff)}")
+
+        return driver
+
+    ###############################################################################
+    def get_plan_actions(self):
+    ###############################################################################
+        """
+        Return a dict build_longname->actions, describing what running each
+        build type will do
+        """
+
+        actions = {}
+        for build in self._builds:
+            cmake_config = self.generate_cmake_config(build)
+            build_dir = self.get_build_dir(build)
+
+            if self._generate:
+                baselines = {"action" : "generate",
+                             "dir"    : str(self._baselines_dir / build.longname),
+                             "files_list" : str(build_dir / self._project.baselines_summary_file)
+                                            if self._project.baselines_summary_file else None}
+            elif self._enable_baselines_tests and build.uses_baselines:
+                baselines = {"action" : "compare",
+                             "dir"    : str(self._baselines_dir / build.longname)}
+            else:
+                baselines = None
+
+            actions[build.longname] = {
+                "build_dir"    : str(build_dir),
+                "phases"       : self.get_phases(build),
+                "cmake_config" : cmake_config,
+                "ctest_cmd"    : self.generate_ctest_cmd(build,cmake_config),
+                "ctest_script" : self.get_ctest_script_text(build,exclude_tests=self.get_quarantined_tests(build)),
+                "resources"    : self.get_taskset_resources(build,for_compile=False),
+                "compile_cpus" : self.get_taskset_resources(build,for_compile=True) if self._parallel else None,
+                "baselines"    : baselines,
+            }
+
+        return actions
+
     ###############################################################################
     def run(self):
     ###############################################################################
+        """
+        Process all the build types. Returns a RunResult, which evaluates to True
+        if all of them passed. Can be interrupted from another thread
+        with cancel().
+        """
 
-        git_ref = get_current_ref ()
-        git_sha = get_current_sha (short=True)
+        if self._plan:
+            write_plan(self._plan,self._options,self._config_file,
+                       self._project,self._machine,self._builds,self.get_plan_actions())
+            print(f"Plan for build types {', '.join(b.longname for b in self._builds)} written to {self._plan}")
+            print(f"Run '{pathlib.Path(sys.argv[0]).name} execute {self._plan}' to execute it")
+            return RunResult()
+
+        git_ref = get_current_ref (repo=self._root_dir)
+        git_sha = get_current_sha (short=True,repo=self._root_dir)
 
         print("###############################################################################")
         action = "Generating baselines" if self._generate else "Running tests"
@@ -171,58 +461,650 @@ class Driver(object):
         print(f"  Active builds: {', '.join(b.name for b in self._builds)}")
         print("###############################################################################")
 
+        self.collect_garbage()
+
+        # The cancel file is specific to this run, so that other runs in the same
+        # work dir (e.g., other shards) are not affected by its cancellation
+        self._run_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.get_cancel_file().parent.mkdir(parents=True,exist_ok=True)
+        try:
+            return self.process_builds(git_sha)
+        finally:
+            if self.get_cancel_file().exists():
+                self.get_cancel_file().unlink()
+            self._run_id = None
+
+    ###############################################################################
+    def process_builds(self, git_sha):
+    ###############################################################################
+        """
+        Process all the build types, and report their results (see run)
+        """
+
         builds_success = {
             build : False
             for build in self._builds}
 
-        num_workers = len(self._builds) if self._parallel else 1
-
-        with threading.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # Short-circuit build types that already passed on identical inputs
+        builds_to_run = self._builds
+        cached_builds = []
+        if self._build_cache:
+            build_cache = BuildCache(self._work_dir / ".cacts" / "build_cache.json")
+            build_keys  = self.get_build_fingerprints()
+            builds_to_run = []
+            for build in self._builds:
+                record = build_cache.get(build_keys.get(build.longname,None))
+                if record is not None:
+                    builds_success[build] = True
+                    log_dir = pathlib.Path(record["log_dir"])
+                    print(f"Build type {build.longname}: cached {record['result']} "
+                          f"(sha={record['git_sha']}, date={record['date']})")
+                    print(f"  logs: {log_dir if log_dir.exists() else 'no longer available'}")
+                    cached_builds.append(build)
+                else:
+                    builds_to_run.append(build)
 
-            future_to_build = {
-                    executor.submit(self.run_build,build) : build
-                    for build in self._builds}
-            for future in threading.as_completed(future_to_build):
-                build = future_to_build[future]
-                builds_success[build] = future.result()
+        if self._batch:
+            builds_success.update(self.run_in_batch_job(builds_to_run))
+        elif self._launcher:
+            builds_success.update(self.run_on_workers(builds_to_run))
+        else:
+            num_workers = len(builds_to_run) if self._parallel else 1
+
+            with threading.ProcessPoolExecutor(max_workers=max(num_workers,1)) as executor:
+
+                future_to_build = {
+                        executor.submit(self.run_build,build) : build
+                        for build in builds_to_run}
+                for future in threading.as_completed(future_to_build):
+                    build = future_to_build[future]
+                    builds_success[build] = future.result()
+            # Leaving the with block also waits for the workers to complete the scratch
+            # syncs they started (see sync_in_background), so the results are in place
+
+        # With --rerun-failed, the tests that run depend on the outcome of the
+        # previous run, which the fingerprint does not capture
+        if self._build_cache and not self._rerun_failed:
+            for build in builds_to_run:
+                if builds_success[build] and build.longname in build_keys:
+                    build_cache.add(build_keys[build.longname],{
+                        "result"  : "PASS",
+                        "build"   : build.longname,
+                        "git_sha" : git_sha,
+                        "date"    : datetime.datetime.now().isoformat(timespec="seconds"),
+                        "log_dir" : str(self.get_build_dir(build) / "Testing")
+                    })
+            build_cache.save()
 
         success = True
         for b,s in builds_success.items():
             success &= s
             if not s:
-                last_submit = self.get_last_ctest_file(b,"Submit")
-                last_test = self.get_last_ctest_file(b,"TestsFailed")
-                last_build  = self.get_last_ctest_file(b,"Build")
-                last_config = self.get_last_ctest_file(b,"Configure")
-                if last_submit is not None:
-                    print(f"Build type {b.longname} failed at submit time. Here's the content of {last_submit}:")
-                    print (last_submit.read_text())
-                if last_test is not None:
-                    print(f"Build type {b.longname} failed at testing time. Here's the content of {last_test}:")
-                    print (last_test.read_text())
-                elif last_build is not None:
-                    print(f"Build type {b.longname} failed at build time. Here's the content of {last_build}:")
-                    print (last_build.read_text())
-                elif last_config is not None:
-                    print(f"Build type {b.longname} failed at config time. Here's the content of {last_config}:")
-                    print (last_config.read_text())
+                build_dir = self.get_build_dir(b)
+                if (build_dir / "cacts_cancelled").exists():
+                    print(f"Build type {b.longname} was cancelled: {(build_dir / 'cacts_cancelled').read_text()}")
+                    if (build_dir / "cacts_output.log").exists():
+                        print(f"  partial log: {build_dir / 'cacts_output.log'}")
                 else:
-                    print(f"Build type {b.longname} failed before configure step.")
+                    self.print_failure_summary(b)
 
-        return success
+        self.print_quarantine_report()
+        self.print_watchdog_report(builds_to_run)
+
+        totals = write_unified_report([self.get_build_dir(b) for b in builds_to_run],
+                                      self._work_dir / "cacts_results.xml",self._work_dir / "cacts_results.json")
+        print(f"Test results: {totals['tests']} tests, {totals['failures']} failed, {totals['skipped']} not run. "
+              f"Reports in {self._work_dir / 'cacts_results.xml'} (JUnit) and {self._work_dir / 'cacts_results.json'}")
+
+        self.archive_logs(builds_to_run,builds_success,git_sha)
+
+        return RunResult({b.longname : self.get_build_result(b,builds_success[b],cached=b in cached_builds)
+                          for b in self._builds})
+
+    ###############################################################################
+    def bisect(self, good, bad, max_time=None, repeat=1):
+    ###############################################################################
+        """
+        Find the first bad commit between good and bad with git bisect. At each
+        commit, all the build types are built (incrementally, if this driver uses
+        --incremental) and tested. A commit is bad if a test fails, or if the
+        tests take more than max_time seconds (the fastest of repeat runs). It is
+        skipped if it cannot be configured or built. The config is the one
+        resolved for this driver, at the starting commit.
+        Returns the sha of the first bad commit, or None.
+        """
+
+        config = ResolvedConfig(self._project,self._machine,self._builds,self._config_file)
+
+        def evaluate(sha):
+            result = Driver(**self._options,resolved_config=config).run()
+            info = {"builds" : {n : {"status" : b.status, "failed_phase" : b.failed_phase,
+                                     "failed_tests" : b.failed_tests}
+                                for n,b in result.builds.items()}}
+
+            if any(b.failed_phase in ["setup","configure","build"] for b in result.builds.values()):
+                return "skip", info
+            if not result:
+                return "bad", info
+            if max_time is None:
+                return "good", info
+
+            # Time the tests again in the same build trees, and keep the fastest run
+            times = [self.get_total_test_time()]
+            for _ in range(repeat-1):
+                options = dict(self._options,incremental=False,skip_build=True)
+                if not Driver(**options,resolved_config=config).run():
+                    return "bad", info
+                times.append(self.get_total_test_time())
+            info["test_time"] = min(times)
+            print(f"Tests took {min(times):.2f} s (threshold: {max_time:.2f} s)")
+
+            return ("bad" if min(times)>max_time else "good"), info
+
+        # Do not consider the work dir content, in case it is inside the repo
+        exclude = [str(self._work_dir)] if self._root_dir in self._work_dir.parents else []
+        record_file = self._work_dir / "cacts_bisect.json"
+        first_bad, steps = run_bisection(self._root_dir,good,bad,evaluate,record_file,exclude=exclude)
+
+        print("===============================================================================")
+        if first_bad is None:
+            print(f"Could not find the first bad commit after {len(steps)} steps")
+        else:
+            _, subject, _ = run_cmd(f"git log -1 --format='%h %s (%an, %ad)' {first_bad}",from_dir=self._root_dir)
+            print(f"First bad commit: {subject}")
+        print(f"Bisect steps recorded in {record_file}")
+        print("===============================================================================")
+
+        return first_bad
+
+    ###############################################################################
+    def get_total_test_time(self):
+    ###############################################################################
+        """
+        Return the sum of the execution times of the tests in the most recent
+        ctest session of all the build types
+        """
+
+        return sum(r["time"] or 0 for b in self._builds
+                   for r in iter_test_results(self.get_build_dir(b)))
+
+    ###############################################################################
+    def get_build_result(self, build, success, cached=False):
+    ###############################################################################
+        """
+        Collect the outcome of a build type from its build dir (see BuildResult)
+        """
+
+        build_dir = self.get_build_dir(build)
+        if cached:
+            return BuildResult(build.longname,"cached",build_dir=build_dir)
+
+        if success:
+            status, failed_phase = "passed", None
+        elif (build_dir / "cacts_cancelled").exists():
+            if not (build_dir / JUNIT_FRAGMENT).exists():
+                # Not started (see run_build): what is in the build dir is from a previous run
+                return BuildResult(build.longname,"cancelled",phases=self.get_phases(build),build_dir=build_dir)
+            status, failed_phase = "cancelled", self.get_failed_phase(build) or "setup"
+        else:
+            status, failed_phase = "failed", self.get_failed_phase(build) or "setup"
+
+        logs = {}
+        if (build_dir / "cacts_output.log").exists():
+            logs["output"] = build_dir / "cacts_output.log"
+        for phase in ["Configure","Build","Test","DynamicAnalysis"]:
+            log = self.get_last_ctest_file(build,phase+"_")
+            if log is not None:
+                logs[phase.lower()] = log
+        for name, fn in [("junit",JUNIT_FRAGMENT),("errors",f"cacts_{failed_phase}_errors.txt"),
+                         ("memcheck","cacts_memcheck_report.txt"),("coverage","cacts_coverage.info")]:
+            if (build_dir / fn).exists():
+                logs[name] = build_dir / fn
+
+        return BuildResult(build.longname,status,failed_phase=failed_phase,
+                           phases=self.get_phases(build),
+                           phase_times=get_phase_times(build_dir) if build_dir.exists() else {},
+                           failed_tests=sorted(n for n,s in get_test_results(build_dir).items() if s=="failed")
+                                        if build_dir.exists() else [],
+                           build_dir=build_dir,logs=logs)
+
+    ###############################################################################
+    def cancel(self, reason="cancelled by the user"):
+    ###############################################################################
+        """
+        Cancel the current run of this driver (e.g., from another thread): running
+        build types are terminated, and the ones not started yet are skipped.
+        Does nothing if the driver is not running.
+        """
+
+        cancel_file = self.get_cancel_file()
+        if cancel_file is not None:
+            cancel_file.write_text(reason)
+
+    ###############################################################################
+    def get_log_archive(self):
+    ###############################################################################
+        return LogArchive(self._work_dir / ".cacts" / "archive")
+
+    ###############################################################################
+    def archive_logs(self, builds, builds_success, git_sha):
+    ###############################################################################
+        """
+        With --archive-logs, store a compressed copy of the logs and results of the
+        build types that ran, and compress their large logs in place. Then prune
+        the archive to fit the --archive-max-age/--archive-max-size budget.
+        """
+
+        archive = self.get_log_archive()
+        if self._archive_logs:
+            def archive_build(build):
+                build_dir = self.get_build_dir(build)
+                if not build_dir.exists():
+                    return None
+                run_dir = archive.add_run(build_dir,{
+                    "build"   : build.longname,
+                    "git_sha" : git_sha,
+                    "result"  : "PASS" if builds_success[build] else "FAIL",
+                })
+                compress_logs_in_place(build_dir)
+                return run_dir
+
+            with threading.ThreadPoolExecutor(max_workers=max(len(builds),1)) as executor:
+                for build, run_dir in zip(builds,executor.map(archive_build,builds)):
+                    if run_dir is not None:
+                        print(f"Build type {build.longname}: logs archived in {run_dir}")
+
+        if self._archive_max_age is not None or self._archive_max_size is not None:
+            removed = archive.prune(self.get_trash_dirs()[0],
+                                    max_age=self._archive_max_age,max_size=self._archive_max_size)
+            if removed:
+                print(f"Pruned {len(removed)} archived runs from {self._work_dir / '.cacts' / 'archive'}")
+
+    ###############################################################################
+    def get_trash_dirs(self):
+    ###############################################################################
+        """
+        Return the trash folders (see trash.py) of the work dir and, if any, of the scratch dir
+        """
+
+        trash_dirs = [self._work_dir / ".cacts" / "trash"]
+        if self._machine.scratch_dir:
+            trash_dirs.append(get_scratch_trash(self._machine.scratch_dir))
+        return trash_dirs
+
+    ###############################################################################
+    def collect_garbage(self):
+    ###############################################################################
+        """
+        Resume the deletion of the trees trashed by previous runs, and trash the
+        build dirs of other build types that exceed the --gc-max-age/--gc-max-size budget
+        """
+
+        if self._gc_max_age is not None or self._gc_max_size is not None:
+            keep = [self.get_build_dir(b) for b in self._builds]
+            collected = collect_garbage(self._work_dir,self.get_trash_dirs()[0],keep,
+                                        max_age=self._gc_max_age,max_size=self._gc_max_size)
+            for d in collected:
+                print(f"Removing unused build dir {d}")
+
+        for trash_dir in self.get_trash_dirs():
+            empty_trash_in_background(trash_dir)
+
+    ###############################################################################
+    def get_failed_phase(self, build):
+    ###############################################################################
+        """
+        Return the last ctest phase (configure, build or test) that started for
+        this build type, according to the logs in its build dir, or None
+        if none did
+        """
+
+        if self.get_last_ctest_file(build,"DynamicAnalysis") is not None:
+            return "memcheck"
+        # The trailing underscore avoids matching LastTestsFailed
+        if self.get_last_ctest_file(build,"TestsFailed") is not None or \
+           self.get_last_ctest_file(build,"Test_") is not None:
+            return "test"
+        elif self.get_last_ctest_file(build,"Build") is not None:
+            return "build"
+        elif self.get_last_ctest_file(build,"Configure") is not None:
+            return "configure"
+
+        return None
+
+    ###############################################################################
+    def get_cancel_file(self):
+    ###############################################################################
+        """
+        The file that signals (to all build types of the current run, on any node)
+        that the run was cancelled, with --fail-fast or cancel(). None if no run
+        is in progress (e.g., when merging results).
+        """
+        if self._run_id is None:
+            return None
+        return self._work_dir / ".cacts" / f"cancel-{self._run_id}"
+
+    ###############################################################################
+    def print_failure_summary(self, build):
+    ###############################################################################
+        """
+        Print a summary of the errors in the log of the phase where the build
+        type failed. The full list of errors is stored in the build dir.
+        """
+
+        build_dir = self.get_build_dir(build)
+
+        for e in load_events(build_dir / "cacts_watchdog.json"):
+            print(f"Build type {build.longname}: the watchdog killed {e['test'] or 'ctest'} ({e['reason']})")
+
+        last_submit = self.get_last_ctest_file(build,"Submit")
+        if last_submit is not None:
+            print(f"Build type {build.longname} failed at submit time.")
+            print(summarize_log(last_submit,"Submit",build_dir / "cacts_submit_errors.txt"))
+
+        phase = self.get_failed_phase(build)
+        if phase is None:
+            print(f"Build type {build.longname} failed before configure step.")
+            return
+        if phase=="memcheck":
+            print(f"Build type {build.longname} failed at memcheck time.")
+            report = build_dir / "cacts_memcheck_report.txt"
+            if report.exists():
+                print(f"  {report.read_text().splitlines()[0]}. Full report in {report}")
+            return
+
+        what = {"test" : "testing", "build" : "build", "configure" : "config"}[phase]
+        phase = phase.capitalize()
+        log_file = self.get_last_ctest_file(build,phase+"_")
+        print(f"Build type {build.longname} failed at {what} time.")
+        if log_file is not None:
+            print(summarize_log(log_file,phase,build_dir / f"cacts_{phase.lower()}_errors.txt"))
+
+    ###############################################################################
+    def run_on_workers(self, builds):
+    ###############################################################################
+        """
+        Process each build type on a separate worker (possibly on another node),
+        using the settings resolved here. Returns a dict build->success.
+        """
+
+        state_files = self.write_worker_states(builds,self._work_dir / ".cacts" / "workers")
+
+        results = run_workers(state_files,self._launcher,self._hosts)
+
+        return {build : results[build.longname] for build in builds}
+
+    ###############################################################################
+    def run_in_batch_job(self, builds):
+    ###############################################################################
+        """
+        Process each build type on a compute node, via a batch job generated from the
+        machine settings. Waits for the job to finish, and returns a dict build->success.
+        """
+
+        if not builds:
+            return {}
+
+        state_dir = self._work_dir / ".cacts" / "batch"
+        state_files = self.write_worker_states(builds,state_dir)
+        for f in state_files.values():
+            clear_worker_result(f)
+
+        job_name = f"cacts-{self._project.name}"
+        script_file = state_dir / f"{job_name}.sh"
+        generate_job_script(script_file,list(state_files.values()),self._machine,self._batch,job_name)
+
+        scheduler = FakeScheduler() if self._fake_scheduler else SlurmScheduler()
+        job_id = scheduler.submit(script_file,self._machine.batch)
+        print(f"Submitted batch job {job_id} ({self._batch} mode, script {script_file})")
+
+        wait_for_job(scheduler,job_id)
+
+        results = {}
+        for build in builds:
+            results[build] = read_worker_result(state_files[build.longname])
+            if results[build] is None:
+                print(f"Build type {build.longname} did not report a result. See the job output in {state_dir}")
+                results[build] = False
+
+        return results
+
+    ###############################################################################
+    def write_worker_states(self, builds, state_dir):
+    ###############################################################################
+        """
+        Store what a worker needs to process each build type. Returns a dict
+        build_longname->state_file
+        """
+
+        # Workers process the build type themselves, with the whole node at their disposal
+        worker = copy.copy(self)
+        worker._launcher = None
+        worker._batch    = None
+
+        state_files = {}
+        for build in builds:
+            state_files[build.longname] = state_dir / f"{build.longname}.pkl"
+            write_worker_state(state_files[build.longname],worker,build)
+
+        return state_files
+
+    ###############################################################################
+    def get_build_fingerprints(self):
+    ###############################################################################
+        """
+        Return a dict build_longname->fingerprint of all the inputs of the build type.
+        The test selection is part of the inputs, so that partial runs (e.g., with
+        --changed-since, or with quarantined tests) do not count as full ones.
+        If the source tree has local modifications, no fingerprint can be computed,
+        and an empty dict is returned.
+        """
+
+        # Do not consider the work dir content, in case it is inside the repo
+        exclude = []
+        if self._root_dir in self._work_dir.parents:
+            exclude.append(str(self._work_dir))
+        if not is_clean_tree(self._root_dir,exclude=exclude):
+            print(f"Root dir {self._root_dir} has local changes. Cannot use cached build results.")
+            return {}
+
+        tree_hash = get_tree_hash(self._root_dir)
+        env = get_env_snapshot(" && ".join(self._machine.env_setup))
+
+        # The tests selected by --changed-since depend on the commit the ref points to
+        changed_since = None
+        if self._changed_since:
+            changed_since = run_cmd_no_fail(f"git rev-parse --verify {self._changed_since}^{{commit}}",
+                                            from_dir=self._root_dir)
+
+        keys = {}
+        for build in self._builds:
+            keys[build.longname] = BuildCache.fingerprint(
+                tree_hash     = tree_hash,
+                cmake_config  = self.generate_cmake_config(build),
+                env           = env,
+                phases        = self.get_phases(build),
+                test_regex    = self._test_regex,
+                test_labels   = self._test_labels,
+                baselines     = self._baselines_dir,
+                skip_config   = self._skip_config,
+                skip_build    = self._skip_build,
+                shard         = self._shard,
+                changed_since = changed_since,
+                quarantined   = sorted(self.get_quarantined_tests(build)),
+                rerun_failed  = self._rerun_failed)
+
+        return keys
 
     ###############################################################################
     def run_build(self,build):
     ###############################################################################
+        """
+        Process a build type. With --fail-fast, a failure (in a phase covered
+        by the policy) cancels the build types that are still running
+        """
+
+        cancel_file = self.get_cancel_file()
+        if cancel_file is not None and cancel_file.exists():
+            print(f"Build type {build.longname} not started: {cancel_file.read_text()}")
+            build_dir = self.get_build_dir(build)
+            if build_dir.is_symlink():
+                # Left behind by a scratch build that did not complete
+                remove_dir(build_dir)
+            build_dir.mkdir(parents=True,exist_ok=True)
+            (build_dir / "cacts_cancelled").write_text(cancel_file.read_text())
+            # Do not report the results of a previous run
+            for fn in [JUNIT_FRAGMENT,JSON_FRAGMENT]:
+                if (build_dir / fn).exists():
+                    (build_dir / fn).unlink()
+            return False
+
+        in_scratch = self.prepare_build_dir(build)
+        try:
+            success = self.build_and_test(build)
+            write_build_report(self.get_build_dir(build),build.longname,
+                               failed_phase=None if success else self.get_failed_phase(build) or "setup")
+
+            if self._fail_fast and not success and cancel_file is not None and not cancel_file.exists() and \
+               self.get_failed_phase(build) in FAIL_FAST_PHASES[self._fail_fast]:
+                phase = self.get_failed_phase(build) or "setup"
+                cancel_file.write_text(f"build type {build.longname} failed at {phase} time (--fail-fast {self._fail_fast})")
+        finally:
+            if in_scratch:
+                # The next build type (if any) can start while the results are copied back
+                sync_in_background(self.sync_scratch_build_dir,build)
+
+        return success
+
+    ###############################################################################
+    def prepare_build_dir(self,build):
+    ###############################################################################
+        """
+        Create an empty build dir, unless we reuse an existing one. If the machine
+        has a scratch dir with enough room, the build tree is placed there, and the
+        build dir is a symlink to it. Returns True in the latter case.
+        """
 
-        build_dir = self._work_dir / build.longname
+        build_dir = self.get_build_dir(build)
         if self._skip_config:
             expect (build_dir.exists(),
                     "Build directory did not exist, but --skip-config/--skip-build was used.\n")
-        else:
-            if build_dir.exists():
-                shutil.rmtree(build_dir)
-            build_dir.mkdir()
+            expect (not is_stub(build_dir),
+                    "Build directory only holds the results of a build done in the scratch dir, whose "
+                    "build tree was removed, but --skip-config/--skip-build/--rerun-failed was used.\n"
+                    f"  - build dir: {build_dir}\n")
+            return False
+
+        # Stubs left by a scratch build (see scratch.py) have no build tree to reuse
+        if self._incremental and not build_dir.is_symlink() and not is_stub(build_dir) and \
+           (build_dir / "CMakeCache.txt").exists():
+            print(f"Build type {build.longname}: reusing the build tree in {build_dir}")
+            self.remove_previous_results(build_dir)
+            return False
+
+        # Scratch trees do not outlive the run, so they cannot be used if
+        # the tree is needed later (by test-stage, a --skip-build or an --incremental run)
+        use_scratch = self._machine.scratch_dir and not self._build_only and not self._incremental
+        if use_scratch:
+            scratch_root = get_scratch_root(self._machine.scratch_dir,self._work_dir)
+            # Without a previous build in scratch, expect the size of a previous
+            # build in the work dir, if any
+            needed = self.get_scratch_sizes().get(build_dir.name,None)
+            if needed is None:
+                needed = get_tree_size(build_dir) if build_dir.is_dir() and not is_stub(build_dir) \
+                         else DEFAULT_TREE_SIZE
+            use_scratch, free = has_room(scratch_root.parent,needed)
+            if not use_scratch:
+                print(f"WARNING: scratch dir {self._machine.scratch_dir} has {free/2**30:.1f} GB free, but build "
+                      f"type {build.longname} needs about {needed/2**30:.1f} GB. Building in the work dir instead.")
+
+        # Do not wait for the old tree to be deleted
+        trash_dir = self.get_trash_dirs()[0]
+        move_to_trash(build_dir,trash_dir)
+        empty_trash_in_background(trash_dir)
+
+        if use_scratch:
+            scratch_trash = get_scratch_trash(self._machine.scratch_dir)
+            setup_scratch_build_dir(build_dir,scratch_root / build_dir.name,scratch_trash)
+            empty_trash_in_background(scratch_trash)
+            print(f"Build type {build.longname}: building in {scratch_root / build_dir.name}")
+            return True
+
+        build_dir.mkdir()
+        return False
+
+    ###############################################################################
+    def remove_previous_results(self, build_dir):
+    ###############################################################################
+        """
+        Remove the ctest sessions and cacts reports of previous runs from a build
+        tree that is reused, so that they are not mistaken for the ones of this
+        run. The cmake cache and the build products are kept, as well as the
+        test costs ctest uses for scheduling.
+        """
+
+        testing_dir = build_dir / "Testing"
+        stale = list(build_dir.glob("cacts_*")) + list(testing_dir.glob("Temporary/Last*"))
+        if (testing_dir / "TAG").exists():
+            stale.append(testing_dir / "TAG")
+        for f in stale:
+            if f.is_file():
+                f.unlink()
+        for d in testing_dir.glob("[0-9]*-[0-9]*"):
+            remove_dir(d)
+
+    ###############################################################################
+    def get_scratch_sizes(self):
+    ###############################################################################
+        """
+        Return a dict build_dir_name->bytes, with the size of the scratch build
+        trees the last time they were built
+        """
+        sizes_file = self._work_dir / ".cacts" / "scratch_sizes.json"
+        return json.loads(sizes_file.read_text()) if sizes_file.exists() else {}
+
+    ###############################################################################
+    def sync_scratch_build_dir(self,build):
+    ###############################################################################
+        """
+        Copy the results of the build back to the work dir, and remove the scratch tree
+        """
+
+        build_dir = self.get_build_dir(build)
+        extra = [self._project.baselines_summary_file] if self._project.baselines_summary_file else []
+        scratch_build_dir = sync_back(build_dir,extra)
+        print(f"Build type {build.longname}: copied results from {scratch_build_dir} to {build_dir}")
+
+        sizes = self.get_scratch_sizes()
+        sizes[build_dir.name] = get_tree_size(scratch_build_dir)
+        sizes_file = self._work_dir / ".cacts" / "scratch_sizes.json"
+        sizes_file.parent.mkdir(parents=True,exist_ok=True)
+        tmp_file = sizes_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(sizes,indent=2))
+        os.replace(tmp_file,sizes_file)
+
+        scratch_trash = get_scratch_trash(self._machine.scratch_dir)
+        move_to_trash(scratch_build_dir,scratch_trash)
+        empty_trash_in_background(scratch_trash)
+        try:
+            # Remove the scratch root too, if this was its last build tree
+            scratch_build_dir.parent.rmdir()
+        except OSError:
+            pass
+
+    ###############################################################################
+    def build_and_test(self,build):
+    ###############################################################################
+
+        build_dir = self.get_build_dir(build)
+
+        # Only report watchdog events and cancellations of this run
+        for fn in ["cacts_watchdog.json","cacts_cancelled"]:
+            if (build_dir / fn).exists():
+                (build_dir / fn).unlink()
+
+        if self._rerun_failed:
+            return self.rerun_failed_tests(build,build_dir)
 
         # If we're generating for the first time in this baseline dir, ensure that the folder exists
         if self._generate:
@@ -233,6 +1115,9 @@ class Driver(object):
             baseline_data_dir.mkdir(exist_ok=True)
 
         self.create_ctest_resource_file(build,build_dir)
+        if self._changed_since:
+            # Have cmake describe the targets, so we can map changed files to tests
+            write_file_api_query(build_dir)
         cmake_config = self.generate_cmake_config(build)
         ctest_cmd = self.generate_ctest_cmd(build,cmake_config)
 
@@ -241,13 +1126,40 @@ class Driver(object):
         print(f"  ctest command: {ctest_cmd}")
         print("===============================================================================")
 
-        # Generate the script ctest will run
-        self.generate_ctest_script(build)
+        phases = self.get_phases(build)
+        if (self._test_cache or self._changed_since or self._shard) and "test" in phases:
+            # We need the build tree to decide which tests to run, so
+            # configure and build first, then run the remaining phases
+            build_phases = [p for p in phases if p in ["configure","build"]]
+            self.generate_ctest_script(build,phases=build_phases)
+            stat = self.run_ctest(build,ctest_cmd)
+            success = stat==0
+
+            if success:
+                success = self.run_selected_tests(build,build_dir,phases[len(build_phases):])
+        else:
+            # Generate the script ctest will run
+            self.generate_ctest_script(build,exclude_tests=self.get_quarantined_tests(build))
+
+            # Run ctest
+            stat = self.run_ctest(build,ctest_cmd)
+            success = stat==0
 
-        # Run ctest
-        env_setup = " && ".join(self._machine.env_setup)
-        stat, _, _ = run_cmd(ctest_cmd,arg_stdout=None,arg_stderr=None,env_setup=env_setup,from_dir=build_dir,verbose=True)
-        success = stat==0
+            if "test" in phases:
+                success = self.process_test_results(build,build_dir,success)
+
+        # When submitting, the memcheck/coverage phases are part of the ctest script
+        if build.memcheck and "test" in phases:
+            if "memcheck" in phases:
+                success &= self.report_memcheck(build,build_dir)[0]
+            else:
+                success &= self.run_memcheck(build,build_dir)
+
+        if build.coverage and "test" in phases and "coverage" not in phases:
+            success &= self.process_coverage(build,build_dir)
+
+        if self._build_only and success:
+            self.write_handoff_manifest(build,build_dir)
 
         if self._generate and success:
 
@@ -267,12 +1179,552 @@ class Driver(object):
             # Store the sha used for baselines generation. This is only for record keeping.
             baseline_file = baseline_dir / "baseline_git_sha"
             with baseline_file.open("w", encoding="utf-8") as fd:
-                sha = get_current_sha()
+                sha = get_current_sha(repo=self._root_dir)
                 fd.write(sha)
             build.baselines_missing = False
 
         return success
 
+    ###############################################################################
+    def run_memcheck(self, build, build_dir):
+    ###############################################################################
+        """
+        Run the tests of this session again under valgrind, with the same resource
+        file (and parallel level) as the test phase. Tests whose executable, shared
+        libraries and inputs did not change since they were last found clean are
+        skipped (unless --force-tests is used).
+        """
+
+        env_setup = " && ".join(self._machine.env_setup)
+        tests = get_ctest_tests(build_dir,env_setup=env_setup)
+        ran = set(get_test_results(build_dir))
+
+        cache = TestCache(self._work_dir / ".cacts" / "memcheck_cache" / f"{build_dir.name}.json",
+                          build_dir, self._root_dir, env_setup=env_setup)
+        hashes = cache.compute_hashes(tests)
+        clean = [] if self._force_tests else [n for n in cache.get_cached_passes(hashes) if n in ran]
+        to_check = sorted(ran - set(clean))
+        if clean:
+            print(f"Build type {build.longname}: skipping memcheck for {len(clean)} unchanged tests "
+                  "that were clean last time")
+        if not to_check:
+            return True
+
+        script_name = "ctest_memcheck_script.cmake"
+        self.generate_ctest_script(build,phases=["memcheck"],include_tests=to_check,script_name=script_name)
+        ctest_cmd = self.generate_ctest_cmd(build,self.generate_cmake_config(build),script_name=script_name)
+        stat = self.run_ctest(build,ctest_cmd)
+
+        success, statuses = self.report_memcheck(build,build_dir)
+        cache.update(hashes,statuses)
+        cache.save()
+
+        return success and stat==0
+
+    ###############################################################################
+    def report_memcheck(self, build, build_dir):
+    ###############################################################################
+        """
+        Parse the memcheck results, and write the deduplicated defects to
+        cacts_memcheck_report.txt in the build dir. Returns (success,statuses),
+        where statuses is a dict test_name->'passed'/'failed' ('failed' if
+        the test failed or had defects)
+        """
+
+        statuses = {}
+        def results():
+            for r in iter_memcheck_results(build_dir):
+                clean = r["status"]=="passed" and not any(r["defects"].values())
+                statuses[r["name"]] = "passed" if clean else "failed"
+                yield r
+
+        defects = aggregate_defects(results())
+        text = format_defect_report(defects)
+        (build_dir / "cacts_memcheck_report.txt").write_text(text)
+
+        failed = sorted(n for n,s in statuses.items() if s!="passed")
+        print(f"Build type {build.longname}: {len(statuses)} tests run under memcheck, "
+              f"{len(failed)} with defects or failures, {len(defects)} distinct defects. "
+              f"Report in {build_dir / 'cacts_memcheck_report.txt'}")
+
+        return not failed, statuses
+
+    ###############################################################################
+    def process_coverage(self, build, build_dir):
+    ###############################################################################
+        """
+        Process the coverage data of the build tree in parallel (see coverage.py),
+        and write the merged report in the build dir: cacts_coverage.info (lcov),
+        cacts_coverage.xml (Cobertura) and cacts_coverage.json (summary).
+        With --coverage-diff, compare with the previous run of this build type.
+        """
+
+        cache_dir = self._work_dir / ".cacts" / "coverage" / "cache"
+        coverage, num_objects, num_cached, errors = \
+                process_coverage(build_dir,self._root_dir,cache_dir,max_workers=build.compile_res_count)
+        if num_objects==0:
+            print(f"Build type {build.longname}: no coverage data found (was it built with --coverage?)")
+            return False
+        for e in errors:
+            print(e)
+
+        write_lcov(coverage,build_dir / "cacts_coverage.info")
+        write_cobertura(coverage,build_dir / "cacts_coverage.xml",self._root_dir)
+        summary = summarize_coverage(coverage,self._root_dir)
+        (build_dir / "cacts_coverage.json").write_text(json.dumps(summary,indent=2))
+
+        pct = 100.0*summary["covered"]/summary["total"] if summary["total"] else 100.0
+        print(f"Build type {build.longname}: line coverage {pct:.2f}% ({summary['covered']}/{summary['total']}), "
+              f"from {num_objects} objects ({num_cached} cached). Report in {build_dir / 'cacts_coverage.info'}")
+
+        # Keep the summary outside of the build dir, for the next --coverage-diff
+        last_file = self._work_dir / ".cacts" / "coverage" / f"{build_dir.name}.json"
+        if self._coverage_diff:
+            if last_file.exists():
+                text = diff_coverage(json.loads(last_file.read_text()),summary)
+                (build_dir / "cacts_coverage_diff.txt").write_text(text)
+                print(text,end="")
+            else:
+                print(f"Build type {build.longname}: no previous coverage run to compare with")
+        last_file.parent.mkdir(parents=True,exist_ok=True)
+        last_file.write_text(json.dumps(summary,indent=2))
+
+        return not errors
+
+    ###############################################################################
+    def write_handoff_manifest(self, build, build_dir):
+    ###############################################################################
+        """
+        Store in the build dir what 'cacts test-stage' needs to run the test
+        phases later, possibly on another node: a ctest script for the remaining
+        phases, and a manifest with the hashes of the test files and the environment
+        """
+
+        env_setup = " && ".join(self._machine.env_setup)
+        tests = get_ctest_tests(build_dir,env_setup=env_setup)
+
+        # The number of resources is only known when the tests run
+        stage_build = copy.copy(build)
+        stage_build.testing_res_count = "${CACTS_TEST_RES_COUNT}"
+        phases = ["test"]
+        if build.memcheck:
+            phases.append("memcheck")
+        if build.coverage:
+            phases.append("coverage")
+        if self._submit and self._shard is None:
+            phases.append("submit")
+        self.generate_ctest_script(stage_build,phases=phases,exclude_tests=self.get_quarantined_tests(build),
+                                   script_name=TEST_STAGE_SCRIPT)
+
+        manifest = {
+            "build"        : build.longname,
+            "build_dir"    : str(build_dir),
+            "root_dir"     : str(self._root_dir),
+            "machine"      : self._machine.name,
+            "env_setup"    : self._machine.env_setup,
+            "env"          : hash_env(get_env_snapshot(env_setup)),
+            "uses_gpu"     : self._machine.uses_gpu(),
+            "num_run_res"  : self._machine.num_run_res,
+            "max_test_res" : get_max_test_resources(tests),
+            "script"       : TEST_STAGE_SCRIPT,
+            "files"        : get_test_files(tests,build_dir),
+            "git_sha"      : get_current_sha(repo=self._root_dir) if is_git_repo(self._root_dir) else None,
+            "date"         : datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        (build_dir / MANIFEST_FILE).write_text(json.dumps(manifest,indent=2))
+
+        print(f"Build type {build.longname}: run '{pathlib.Path(sys.argv[0]).name} test-stage {build_dir}' "
+              "to run its tests")
+
+    ###############################################################################
+    def run_ctest(self, build, ctest_cmd):
+    ###############################################################################
+        """
+        Run a ctest command in the build dir, printing its output as it runs.
+        With -p, each line is prefixed with the build name, so that the output
+        of concurrent builds can be told apart. The output is also appended to
+        cacts_output.log in the build dir. Returns the exit code.
+        """
+
+        build_dir = self.get_build_dir(build)
+        env_setup = " && ".join(self._machine.env_setup)
+        prefix = f"[{build.longname}] " if self._parallel else ""
+
+        monitors = []
+        cancel = None
+        if self.get_cancel_file() is not None:
+            cancel = CancelMonitor(build.longname,self.get_cancel_file())
+            if cancel.cancel_file.exists():
+                # The run was cancelled while we were busy with something else
+                (build_dir / "cacts_cancelled").write_text(cancel.cancel_file.read_text())
+                return 1
+            monitors.append(cancel)
+
+        watchdog = None
+        if self._stall_timeout or self._test_timeout_factor:
+            history = self.get_test_history(build)
+            watchdog = Watchdog(build.longname,build_dir / "cacts_traces",
+                                stall_timeout=self._stall_timeout,
+                                test_timeout_factor=self._test_timeout_factor,
+                                test_costs={n : history.average_time(n) for n in history.tests()
+                                            if history.average_time(n) is not None},
+                                get_tests=lambda: get_ctest_tests(build_dir,env_setup=env_setup))
+            monitors.append(watchdog)
+
+        stat, _, _ = run_cmd(ctest_cmd,arg_stdout=None,arg_stderr=None,env_setup=env_setup,
+                             from_dir=build_dir,verbose=True,prefix=prefix,log_file=build_dir / "cacts_output.log",
+                             monitors=monitors)
+
+        if watchdog is not None and watchdog.events:
+            save_events(build_dir / "cacts_watchdog.json",watchdog.events)
+        if cancel is not None and cancel.cancelled:
+            (build_dir / "cacts_cancelled").write_text(self.get_cancel_file().read_text())
+
+        return stat
+
+    ###############################################################################
+    def run_selected_tests(self, build, build_dir, phases):
+    ###############################################################################
+        """
+        Run the test (and following) phases on an already built tree, skipping tests
+        that are not affected by the changes (with --changed-since) and tests whose
+        inputs did not change since the last time they passed (with --test-cache)
+        """
+
+        env_setup = " && ".join(self._machine.env_setup)
+        tests = get_ctest_tests(build_dir,env_setup=env_setup)
+
+        selected = None
+        if self._changed_since:
+            selected = get_affected_tests(build_dir,self._root_dir,self._changed_files,tests,
+                                          self._project.test_labels_by_path)
+            if selected is not None:
+                if self._test_regex:
+                    selected = [n for n in selected if re.search(self._test_regex,n)]
+                print(f"Build type {build.longname}: {len(selected)} of {len(tests)} tests "
+                      f"are affected by changes since {self._changed_since}")
+
+        if self._shard:
+            if selected is None:
+                selected = [t["name"] for t in tests
+                            if not self._test_regex or re.search(self._test_regex,t["name"])]
+            if self._test_labels:
+                # Balance the tests that will actually run, rather than leave the labels to ctest
+                labels = {t["name"] : t["properties"].get("LABELS",[]) for t in tests}
+                selected = [n for n in selected
+                            if any(re.search(l,label) for l in self._test_labels for label in labels.get(n,[]))]
+            num_candidates = len(selected)
+            selected = self.get_shard_tests(build,selected)
+            print(f"Build type {build.longname}: shard {self._shard[0]}/{self._shard[1]} "
+                  f"runs {len(selected)} of {num_candidates} tests")
+
+        cached = []
+        if self._test_cache:
+            cache = TestCache(self._work_dir / ".cacts" / "test_cache" / f"{build_dir.name}.json",
+                              build_dir, self._root_dir, env_setup=env_setup)
+
+            hashes = cache.compute_hashes(tests)
+            if not self._force_tests:
+                cached = cache.get_cached_passes(hashes)
+                if selected is not None:
+                    cached = [n for n in cached if n in selected]
+            if cached:
+                print(f"Build type {build.longname}: skipping {len(cached)} tests with a cached PASS:")
+                for name in sorted(cached):
+                    print(f"  {name} ... cached")
+
+        quarantined = self.get_quarantined_tests(build)
+
+        to_run = set(t["name"] for t in tests) if selected is None else set(selected)
+        if not to_run - set(cached) - set(quarantined):
+            # Nothing left to run. Running ctest_test with no tests would be an error
+            phases = [p for p in phases if p!="test"]
+
+        success = True
+        if phases:
+            script_name = "ctest_test_script.cmake"
+            self.generate_ctest_script(build,phases=phases,include_tests=selected,
+                                       exclude_tests=cached+quarantined,script_name=script_name)
+            ctest_cmd = self.generate_ctest_cmd(build,self.generate_cmake_config(build),script_name=script_name)
+            stat = self.run_ctest(build,ctest_cmd)
+            success = stat==0
+
+        if "test" in phases:
+            success = self.process_test_results(build,build_dir,success)
+
+            if self._test_cache:
+                cache.update(hashes,get_test_results(build_dir))
+                cache.save()
+
+        return success
+
+    ###############################################################################
+    def rerun_failed_tests(self, build, build_dir):
+    ###############################################################################
+        """
+        Rerun the tests that failed in the last ctest session of this build,
+        without reconfiguring/rebuilding, and classify them as flaky or failed
+        """
+
+        # ctest does not remove the list of failed tests when a later run of the
+        # same session passes, so only look at the list of the current session
+        tag_dir = get_tag_dir(build_dir)
+        failed_file = build_dir / "Testing" / "Temporary" / f"LastTestsFailed_{tag_dir.name if tag_dir else ''}.log"
+        if tag_dir is None or not failed_file.exists():
+            failed_file = self.get_last_ctest_file(build,"TestsFailed")
+
+        # Lines have the form '<test number>:<test name>'
+        failed = []
+        if failed_file is not None and failed_file.exists():
+            failed = [l.split(":",1)[1] for l in failed_file.read_text().splitlines() if ":" in l]
+        if not failed:
+            print(f"Build type {build.longname}: no failed tests to rerun")
+            return True
+
+        print(f"Build type {build.longname}: rerunning {len(failed)} failed tests")
+        history = self.get_test_history(build)
+        still_failing, flaky = self.retry_tests(build,build_dir,failed,1+self._retries,history)
+        history.save()
+
+        for name in sorted(failed):
+            if name in flaky:
+                print(f"  {name} ... FLAKY (passed at rerun {flaky[name]})")
+            else:
+                print(f"  {name} ... FAILED ({1+self._retries} reruns)")
+
+        # Keep the list of failed tests in sync with the outcome of the reruns
+        if still_failing:
+            failed_file.write_text("".join(f"0:{n}\n" for n in still_failing))
+        else:
+            failed_file.unlink()
+
+        return not still_failing
+
+    ###############################################################################
+    def retry_tests(self, build, build_dir, tests, max_attempts, history=None):
+    ###############################################################################
+        """
+        Run the given tests in the existing build dir, until they pass or max_attempts
+        runs are done. Returns the list of tests that never passed, and a dict
+        test_name->attempt for the tests that passed at some attempt.
+        If a history is passed, the outcome of each attempt is added to it.
+        """
+
+        script_name = "ctest_rerun_script.cmake"
+        ctest_cmd = self.generate_ctest_cmd(build,self.generate_cmake_config(build),script_name=script_name)
+
+        # Each retry overwrites Test.xml with the retried tests only. Keep the
+        # results of the whole session aside, and patch them after each retry
+        test_xml = get_tag_dir(build_dir) / "Test.xml"
+        all_results = build_dir / "cacts_retry_Test.xml"
+        shutil.copyfile(test_xml,all_results)
+
+        remaining = sorted(tests)
+        passed = {}
+        try:
+            for attempt in range(1,max_attempts+1):
+                if not remaining:
+                    break
+                self.generate_ctest_script(build,phases=["test"],include_tests=remaining,script_name=script_name)
+                self.run_ctest(build,ctest_cmd)
+
+                results = {r["name"] : r for r in iter_test_results(build_dir)}
+                for name in remaining:
+                    if name in results:
+                        if history is not None:
+                            history.add(name,results[name]["status"],results[name]["time"])
+                        if results[name]["status"]=="passed":
+                            passed[name] = attempt
+                remaining = [n for n in remaining if n not in passed]
+
+                if test_xml.exists():
+                    replace_test_results(all_results,test_xml)
+        finally:
+            shutil.move(str(all_results),str(test_xml))
+
+        return remaining, passed
+
+    ###############################################################################
+    def process_test_results(self, build, build_dir, success):
+    ###############################################################################
+        """
+        Add the outcome of the tests to the history of the build type. If all the
+        failed tests are suspected to be flaky, retry them, and consider the build
+        successful if they eventually pass.
+        """
+
+        history = self.get_test_history(build)
+        results = list(iter_test_results(build_dir))
+        for r in results:
+            history.add(r["name"],r["status"],r["time"])
+
+        failed = [r["name"] for r in results if r["status"]=="failed"]
+        if not success and failed and self._flaky_retries>0 and \
+                all(history.is_suspected_flaky(n) for n in failed):
+            print(f"Build type {build.longname}: retrying {len(failed)} failed tests suspected to be flaky")
+            still_failing, flaky = self.retry_tests(build,build_dir,failed,self._flaky_retries,history)
+            for name in sorted(failed):
+                if name in flaky:
+                    print(f"  {name} ... FLAKY (passed at retry {flaky[name]})")
+                else:
+                    print(f"  {name} ... FAILED ({self._flaky_retries} retries)")
+            success = not still_failing
+
+        # Shards must all see the same history, to compute the same split.
+        # The history is updated by merge-results instead.
+        if self._shard is None:
+            history.save()
+
+        return success
+
+    ###############################################################################
+    def get_shard_tests(self, build, tests):
+    ###############################################################################
+        """
+        Return the tests of this shard. Tests are split among the shards so that the
+        historical cost of each shard is balanced. Tests with no recorded cost are
+        assumed to cost as much as the average test.
+        """
+
+        history = self.get_test_history(build)
+        costs = {n : history.average_time(n) for n in tests}
+        known = [c for c in costs.values() if c is not None]
+        default_cost = sum(known)/len(known) if known else 1.0
+        costs = {n : default_cost if c is None else c for n,c in costs.items()}
+
+        index, num_shards = self._shard
+        return partition_by_cost(tests,costs,num_shards)[index-1]
+
+    ###############################################################################
+    def merge_results(self):
+    ###############################################################################
+        """
+        Combine the test results of all the shards of each build type into a single
+        Test.xml in the (non-sharded) build dir, record them in the test history,
+        and submit them to CDash if requested
+        """
+
+        expect (self._shard is None, "Cannot use --shard with merge-results.\n")
+
+        success = True
+        for build in self._builds:
+            shard_dirs = {}
+            for d in self._work_dir.glob(f"{build.longname}_shard*of*"):
+                m = re.fullmatch(rf"{re.escape(build.longname)}_shard(\d+)of(\d+)",d.name)
+                if m:
+                    shard_dirs[(int(m.group(1)),int(m.group(2)))] = d
+
+            num_shards = max((n for _,n in shard_dirs),default=0)
+            shards = [shard_dirs.get((i,num_shards)) for i in range(1,num_shards+1)]
+            xml_files = [get_tag_dir(d) / "Test.xml" if d and get_tag_dir(d) else None for d in shards]
+            missing = [i+1 for i,f in enumerate(xml_files) if f is None or not f.exists()]
+            if num_shards==0 or missing:
+                print(f"Build type {build.longname}: cannot merge results, missing shards {missing or 'all'}")
+                success = False
+                continue
+
+            # Use the session of the first shard for the merged results
+            build_dir = self.get_build_dir(build)
+            tag_dir = build_dir / "Testing" / get_tag_dir(shards[0]).name
+            tag_dir.mkdir(parents=True,exist_ok=True)
+            shutil.copyfile(shards[0] / "Testing" / "TAG",build_dir / "Testing" / "TAG")
+            for part in ["Configure.xml","Build.xml"]:
+                if (get_tag_dir(shards[0]) / part).exists():
+                    shutil.copyfile(get_tag_dir(shards[0]) / part,tag_dir / part)
+            merge_test_xml(xml_files,tag_dir / "Test.xml")
+
+            history = self.get_test_history(build)
+            failed = []
+            num_tests = 0
+            for r in iter_test_results(build_dir):
+                num_tests += 1
+                history.add(r["name"],r["status"],r["time"])
+                if r["status"]!="passed":
+                    failed.append(r["name"])
+            history.save()
+
+            print(f"Build type {build.longname}: merged {num_tests} tests from {num_shards} shards into {tag_dir}")
+            for name in sorted(failed):
+                print(f"  {name} ... FAILED")
+            success &= not failed
+
+            if self._submit:
+                script_name = "ctest_submit_script.cmake"
+                self.generate_ctest_script(build,phases=["submit"],script_name=script_name)
+                stat = self.run_ctest(build,f"ctest -S {build_dir / script_name}")
+                success &= stat==0
+
+        return success
+
+    ###############################################################################
+    def get_test_history(self, build):
+    ###############################################################################
+        return TestHistory(self._work_dir / ".cacts" / "history" / f"{build.longname}.json")
+
+    ###############################################################################
+    def get_quarantined_tests(self, build):
+    ###############################################################################
+        if not self._quarantine:
+            return []
+
+        history = self.get_test_history(build)
+        return [n for n in history.tests() if history.is_quarantined(n)]
+
+    ###############################################################################
+    def print_watchdog_report(self, builds):
+    ###############################################################################
+        """
+        Print (and store in the work dir) the processes that the watchdog killed
+        """
+
+        lines = []
+        for build in builds:
+            for e in load_events(self.get_build_dir(build) / "cacts_watchdog.json"):
+                lines.append(f"  {e['time']} {build.longname}: {e['reason']}")
+                lines.append(f"    killed: {e['cmd']}")
+                for trace in e["traces"]:
+                    lines.append(f"    stack traces: {trace}")
+
+        if not lines:
+            return
+
+        text = "Watchdog report (stuck processes that were killed):\n"
+        text += "\n".join(lines) + "\n"
+
+        print(text)
+        (self._work_dir / "watchdog_report.txt").write_text(text)
+
+    ###############################################################################
+    def print_quarantine_report(self):
+    ###############################################################################
+        """
+        Print (and store in the work dir) the list of tests that are suspected
+        to be flaky, or that are quarantined
+        """
+
+        lines = []
+        for build in self._builds:
+            history = self.get_test_history(build)
+            for name in history.tests():
+                if history.is_quarantined(name):
+                    state = "QUARANTINED" if self._quarantine else "to quarantine (use --quarantine)"
+                elif history.is_suspected_flaky(name):
+                    state = "suspected flaky"
+                else:
+                    continue
+                lines.append(f"  {build.longname:<20} {name:<40} flakiness={history.flakiness(name):.2f}  {state}")
+
+        if not lines:
+            return
+
+        text = "Quarantine report (flakiness is the fraction of pass/fail flips in recent runs):\n"
+        text += "\n".join(lines) + "\n"
+        if self._quarantine:
+            text += "Quarantined tests are not run. Re-run without --quarantine to re-evaluate them.\n"
+
+        print(text)
+        (self._work_dir / "quarantine_report.txt").write_text(text)
+
     ###############################################################################
     def create_ctest_resource_file(self, build, build_dir):
     ###############################################################################
@@ -286,22 +1738,7 @@ class Driver(object):
 
         resources = self.get_taskset_resources(build, for_compile=False)
 
-        data = {}
-
-        # This is the only version numbering supported by ctest, so far
-        data["version"] = {"major":1,"minor":0}
-
-        # We add leading zeroes to ensure that ids will sort correctly
-        # both alphabetically and numerically
-        devices = []
-        for res_id in resources:
-            devices.append({"id":f"{res_id:05d}"})
-
-        # Add resource groups
-        data["local"] = [{"devices":devices}]
-
-        with (build_dir/"ctest_resource_file.json").open("w", encoding="utf-8") as outfile:
-            json.dump(data,outfile,indent=2)
+        write_ctest_resource_file(build_dir,resources)
 
         return len(resources)
 
@@ -313,11 +1750,8 @@ class Driver(object):
         if not for_compile and self._machine.uses_gpu():
             # For GPUs, the cpu affinity is irrelevant. Just assume all GPUS are open
             affinity_cp = list(range(self._machine.num_run_res))
-        elif "SLURM_CPU_BIND_LIST" in os.environ:
-            affinity_cp = get_cpu_ids_from_slurm_env_var()
         else:
-            this_process = psutil.Process()
-            affinity_cp = list(this_process.cpu_affinity())
+            affinity_cp = get_available_cpu_ids()
 
         affinity_cp.sort()
 
@@ -335,10 +1769,25 @@ class Driver(object):
 
         return resources
 
+    ###############################################################################
+    def get_build_dir(self,build):
+    ###############################################################################
+        if self._shard is None:
+            return self._work_dir / build.longname
+        else:
+            return self._work_dir / f"{build.longname}_shard{self._shard[0]}of{self._shard[1]}"
+
     ###############################################################################
     def get_last_ctest_file(self,build,phase):
     ###############################################################################
-        build_dir = self._work_dir / build.longname
+        """
+        Return the last ctest log of the given phase, which may be gzipped (see
+        open_log). If the build dir no longer exists, look in the log archive.
+        """
+        build_dir = self.get_build_dir(build)
+        if not build_dir.exists():
+            return self.get_log_archive().find_file(build_dir.name,f"Testing/Temporary/Last{phase}*")
+
         logs_dir = build_dir / "Testing/Temporary"
         files = list(logs_dir.glob(f"Last{phase}*"))
         # ctest creates files of the form Last{phase}_$TIMESTAMP.log, so lexicographical
@@ -358,6 +1807,10 @@ class Driver(object):
         for key, value in build.cmake_args.items():
             cmake_config += f" -D{key}={value} "
 
+        if self._compiler_launcher and not any("COMPILER_LAUNCHER" in a for a in self._cmake_args):
+            for lang in ["C","CXX","Fortran"]:
+                cmake_config += f" -DCMAKE_{lang}_COMPILER_LAUNCHER={self._compiler_launcher}"
+
         # Compilers
         if self._machine.cxx_compiler is not None:
             cmake_config += f" -DCMAKE_CXX_COMPILER={self._machine.cxx_compiler}"
@@ -400,32 +1853,68 @@ class Driver(object):
         return cmake_config
 
     ###############################################################################
-    def generate_ctest_cmd(self, build, cmake_config):
+    def generate_ctest_cmd(self, build, cmake_config, script_name="ctest_script.cmake"):
     ###############################################################################
 
         ctest_cmd = "ctest"
         ctest_cmd += " -VV" if self._verbose else " --output-on-failure"
-        ctest_cmd += f" -S {self._work_dir / build.longname / 'ctest_script.cmake'}"
+        ctest_cmd += f" -S {self.get_build_dir(build) / script_name}"
 
         ctest_cmd += f' -DCMAKE_COMMAND="{cmake_config}"'
 
         if self._submit:
             ctest_cmd += " -D Experimental"
 
-        ctest_cmd += f' --resource-spec-file {self._work_dir}/{build.longname}/ctest_resource_file.json'
+        ctest_cmd += f' --resource-spec-file {self.get_build_dir(build)}/ctest_resource_file.json'
 
         # If the build is not concurrent to other builds, this is not really necessary,
         # since we can use the whole node.
         if self._parallel:
             resources = self.get_taskset_resources(build, for_compile=True)
-            ctest_cmd = f"taskset -c {','.join([str(r) for r in resources])} sh -c '{cmd}'"
+            ctest_cmd = f"taskset -c {','.join([str(r) for r in resources])} sh -c '{ctest_cmd}'"
 
         return ctest_cmd
 
     ###############################################################################
-    def generate_ctest_script(self,build):
+    def get_phases(self, build):
+    ###############################################################################
+        """
+        Return the list of ctest phases to run for this build, according to the
+        command line options
+        """
+
+        phases = ["configure"]
+        if not self._config_only:
+            phases.append("build")
+            if not self._build_only:
+                phases.append("test")
+                # Shards do not submit on their own: merge-results submits all of them at once
+                if self._submit and self._shard is None:
+                    # Without submission, cacts runs memcheck and processes the coverage
+                    # data itself (see run_memcheck and process_coverage)
+                    if build.memcheck:
+                        phases.append("memcheck")
+                    if build.coverage:
+                        phases.append("coverage")
+                    phases.append("submit")
+
+        return phases
+
+    ###############################################################################
+    def generate_ctest_script(self,build,phases=None,include_tests=None,exclude_tests=None,
+                              script_name="ctest_script.cmake"):
     ###############################################################################
 
+        text = self.get_ctest_script_text(build,phases,include_tests,exclude_tests)
+        with open( self.get_build_dir(build) / script_name, 'w') as fd:
+            fd.write(text)
+
+    ###############################################################################
+    def get_ctest_script_text(self,build,phases=None,include_tests=None,exclude_tests=None):
+    ###############################################################################
+
+        phases = phases or self.get_phases(build)
+
         text = '# This file was automatically generated by CACTS.\n'
         text += f'# CACTS yaml config file: {self._config_file}\n\n'
 
@@ -433,7 +1922,7 @@ class Driver(object):
         text += 'set(CTEST_CMAKE_GENERATOR "Unix Makefiles")\n\n'
 
         text += f'set(CTEST_SOURCE_DIRECTORY {self._project.root_dir})\n'
-        text += f'set(CTEST_BINARY_DIRECTORY {self._work_dir / build.longname})\n\n'
+        text += f'set(CTEST_BINARY_DIRECTORY {self.get_build_dir(build)})\n\n'
 
         if self._submit:
             cdash = self._project.cdash
@@ -447,56 +1936,82 @@ class Driver(object):
                 curl_options = 'CURLOPT_SSL_VERIFYPEER_OFF;CURLOPT_SSL_VERIFYHOST_OFF'
                 text += f'set(DCTEST_CURL_OPTIONS "{curl_options}")\n\n'
 
-        text += '# Start ctest session\n'
-        text += 'ctest_start(Experimental)\n\n'
+        if "configure" in phases:
+            text += '# Start ctest session\n'
+            text += 'ctest_start(Experimental)\n\n'
 
-        text += '# Configure phase\n'
-        text += 'separate_arguments(OPTIONS_LIST UNIX_COMMAND "${CMAKE_COMMAND}")\n'
-        text += 'ctest_configure(OPTIONS "${OPTIONS_LIST}" RETURN_VALUE CONFIG_ERROR_CODE)\n'
+            text += '# Configure phase\n'
+            text += 'separate_arguments(OPTIONS_LIST UNIX_COMMAND "${CMAKE_COMMAND}")\n'
+            text += 'ctest_configure(OPTIONS "${OPTIONS_LIST}" RETURN_VALUE CONFIG_ERROR_CODE)\n'
 
-        text += 'if (CONFIG_ERROR_CODE)\n'
-        text += '  message (FATAL_ERROR "CTest failed during configure phase")\n'
-        text += 'endif ()\n\n'
+            text += 'if (CONFIG_ERROR_CODE)\n'
+            text += '  message (FATAL_ERROR "CTest failed during configure phase")\n'
+            text += 'endif ()\n\n'
+        else:
+            text += '# Resume the ctest session of the configure phase\n'
+            text += 'ctest_start(Experimental APPEND)\n\n'
 
-        if not self._config_only:
+        if "build" in phases:
             text += '# Build phase\n'
             text += f'ctest_build(FLAGS "-j{build.compile_res_count}" RETURN_VALUE BUILD_ERROR_CODE)\n'
             text += 'if (BUILD_ERROR_CODE)\n'
             text += '  message (FATAL_ERROR "CTest failed during build phase")\n'
             text += 'endif()\n\n'
 
-            if not self._build_only:
-                text += '# Test phase\n'
-                test_line = 'ctest_test(RETURN_VALUE TEST_ERROR_CODE'
-                test_line += f' PARALLEL_LEVEL {build.testing_res_count}'
-                if self._test_regex:
-                    test_line += f' INCLUDE {self._test_regex}'
-                if self._test_labels:
-                    test_line += f' INCLUDE_LABEL {self._test_labels}'
-                elif self._generate and self._project.baselines_gen_label:
-                    test_line += f' INCLUDE_LABEL {self._project.baselines_gen_label}'
-                test_line += ")\n"
-
-                text += test_line
-                text += 'if (TEST_ERROR_CODE)\n'
-                text += '    message (FATAL_ERROR "CTest failed during test phase")\n'
-                text += 'endif()\n\n'
-
-                if build.coverage:
-                    text += '# Coverage phase\n'
-                    text += 'ctest_coverage(RETURN_VALUE COVERAGE_ERROR_CODE)\n'
-                    text += 'if (COVERAGE_ERROR_CODE)\n'
-                    text += '  message (FATAL_ERROR "CTest failed during coverage phase")\n'
-                    text += 'endif()\n\n'
-
-                if self._submit:
-                    text += '# Submit phase\n'
-                    text += 'ctest_submit(RETRY_COUNT 10 RETRY_DELAY 60 RETURN_VALUE SUBMIT_ERROR_CODE)\n'
-                    text += 'if (SUBMIT_ERROR_CODE)\n'
-                    text += '  message (FATAL_ERROR "CTest failed during submit phase")\n'
-                    text += 'endif()\n'
-        with open( self._work_dir / build.longname / "ctest_script.cmake", 'w') as fd:
-            fd.write(text)
+        # The tests selection is shared by the test and memcheck phases
+        select_args = ''
+        if "test" in phases or "memcheck" in phases:
+            select_args = f' PARALLEL_LEVEL {build.testing_res_count}'
+            if include_tests is not None:
+                # The list was already filtered with the user regex (if any).
+                # Use a bracket argument, so that cmake does not process escapes in the regex
+                text += f'set(CACTS_INCLUDED_TESTS [=[{tests_regex(include_tests)}]=])\n'
+                select_args += ' INCLUDE "${CACTS_INCLUDED_TESTS}"'
+            elif self._test_regex:
+                select_args += f' INCLUDE {self._test_regex}'
+            if self._test_labels:
+                select_args += f' INCLUDE_LABEL "{"|".join(self._test_labels)}"'
+            elif self._generate and self._project.baselines_gen_label:
+                select_args += f' INCLUDE_LABEL {self._project.baselines_gen_label}'
+            if exclude_tests:
+                # Use a bracket argument, so that cmake does not process escapes in the regex
+                text += f'set(CACTS_EXCLUDED_TESTS [=[{tests_regex(exclude_tests)}]=])\n'
+                select_args += ' EXCLUDE "${CACTS_EXCLUDED_TESTS}"'
+
+        if "test" in phases:
+            text += '# Test phase\n'
+            text += f'ctest_test(RETURN_VALUE TEST_ERROR_CODE{select_args})\n'
+            text += 'if (TEST_ERROR_CODE)\n'
+            text += '    message (FATAL_ERROR "CTest failed during test phase")\n'
+            text += 'endif()\n\n'
+
+        if "memcheck" in phases:
+            text += '# Memcheck phase\n'
+            text += 'find_program(CTEST_MEMORYCHECK_COMMAND NAMES valgrind)\n'
+            text += 'set(CTEST_MEMORYCHECK_TYPE Valgrind)\n'
+            text += f'set(CTEST_MEMORYCHECK_COMMAND_OPTIONS "{VALGRIND_OPTIONS}")\n'
+            if self._machine.valg_supp_file:
+                text += f'set(CTEST_MEMORYCHECK_SUPPRESSIONS_FILE {self._machine.valg_supp_file})\n'
+            text += f'ctest_memcheck(RETURN_VALUE MEMCHECK_ERROR_CODE DEFECT_COUNT MEMCHECK_DEFECTS{select_args})\n'
+            text += 'if (MEMCHECK_ERROR_CODE OR MEMCHECK_DEFECTS)\n'
+            text += '  message (FATAL_ERROR "CTest failed during memcheck phase")\n'
+            text += 'endif()\n\n'
+
+        if "coverage" in phases:
+            text += '# Coverage phase\n'
+            text += 'ctest_coverage(RETURN_VALUE COVERAGE_ERROR_CODE)\n'
+            text += 'if (COVERAGE_ERROR_CODE)\n'
+            text += '  message (FATAL_ERROR "CTest failed during coverage phase")\n'
+            text += 'endif()\n\n'
+
+        if "submit" in phases:
+            text += '# Submit phase\n'
+            text += 'ctest_submit(RETRY_COUNT 10 RETRY_DELAY 60 RETURN_VALUE SUBMIT_ERROR_CODE)\n'
+            text += 'if (SUBMIT_ERROR_CODE)\n'
+            text += '  message (FATAL_ERROR "CTest failed during submit phase")\n'
+            text += 'endif()\n'
+
+        return text
 
     ###############################################################################
     def check_baselines_are_present(self):
@@ -534,6 +2049,22 @@ OR
     \033[1;32m# Run all tests on machine 'foo', using yaml config file /bar.yaml \033[0m
     > cd $scream_repo/components/eamxx
     > ./scripts/{0} -m foo -f /bar.yaml
+
+    \033[1;32m# Split the tests of build type 'dbg' across two nodes, then merge the results \033[0m
+    > ./scripts/{0} -m foo -t dbg --shard 1/2    # on node 1
+    > ./scripts/{0} -m foo -t dbg --shard 2/2    # on node 2
+    > ./scripts/{0} merge-results -m foo -t dbg
+
+    \033[1;32m# Build on the login node, then run the tests on a compute node \033[0m
+    > ./scripts/{0} -m foo -t dbg --build-only
+    > srun -N 1 ./scripts/{0} test-stage ./ctest-build/full_debug
+
+    \033[1;32m# Review what would be run, then run it \033[0m
+    > ./scripts/{0} -m foo --plan plan.json
+    > ./scripts/{0} execute plan.json
+
+    \033[1;32m# Find the commit since v1.0 where test foo started failing, or taking more than 60s \033[0m
+    > ./scripts/{0} bisect --good v1.0 --max-time 60 -m foo -t dbg --test-regex '^foo$'
 """.format(pathlib.Path(args[0]).name),
         description=description,
         formatter_class=GoodFormatter
@@ -568,10 +2099,34 @@ OR
                         help="Limit ctest to running only tests that match this label")
 
 
+    parser.add_argument("--changed-since", metavar="REF",
+                        help="Limit ctest to running only tests affected by the files changed in the root dir "
+                             "since the merge base with this git ref (local changes included)")
+
+    parser.add_argument("--rerun-failed", action="store_true",
+            help="Only rerun the tests that failed in the last run of each build type, in the existing "
+                 "build dir, without reconfiguring or rebuilding (implies --skip-build)")
+    parser.add_argument("--retries", type=int, default=0,
+            help="With --rerun-failed, rerun tests that keep failing up to this many more times, "
+                 "to tell flaky tests apart from real failures")
+
+    parser.add_argument("--flaky-retries", type=int, default=2,
+            help="If all the failed tests of a build type are suspected to be flaky (based on the history "
+                 "of their outcomes), retry them up to this many times. Use 0 to disable.")
+    parser.add_argument("--quarantine", action="store_true",
+            help="Do not run tests whose history shows they are very flaky")
+
+    parser.add_argument("--shard", metavar="I/N",
+            help="Only run the I-th of N shards of the tests of each build type (1<=I<=N), balanced "
+                 "by historical test cost. Each shard configures and builds the whole project in its own "
+                 "build dir (the build is not shared between shards); use "
+                 "'%(prog)s merge-results' with the same work dir to combine (and submit) their results.")
+
     parser.add_argument("--config-only", action="store_true",
             help="Only run config step, skip build and tests")
     parser.add_argument("--build-only", action="store_true",
-            help="Only run config and build steps, skip tests (implies --no-build)")
+            help="Only run config and build steps, skip tests (implies --no-build). "
+                 "The tests can be run later with '%(prog)s test-stage BUILD_DIR'")
 
     parser.add_argument("--skip-config", action="store_true",
             help="Skip cmake phase, pass directly to build. Requires the build directory to exist, "
@@ -580,6 +2135,16 @@ OR
             help="Skip build phase, pass directly to test. Requires the build directory to exist, "
                  "and will fail if build phase never completed in that dir (implies --skip-config).")
 
+    parser.add_argument("--test-cache", action="store_true",
+            help="Skip tests whose executable, shared libraries and input files did not change "
+                 "since the last time they passed. Skipped tests are reported as cached.")
+    parser.add_argument("--force-tests", action="store_true",
+            help="With --test-cache, run all tests anyway (their results still update the cache)")
+
+    parser.add_argument("--build-cache", action="store_true",
+            help="Skip build types that already passed with the same source tree, cmake config, "
+                 "environment and test selection. Requires a clean git tree in the root dir.")
+
     parser.add_argument("-g", "--generate", action="store_true",
         help="Instruct test-all-eamxx to generate baselines from current commit. Skips tests")
 
@@ -587,6 +2152,70 @@ OR
     parser.add_argument("-p", "--parallel", action="store_true",
                         help="Launch the different build types stacks in parallel")
 
+    parser.add_argument("--launcher", choices=["local","srun","ssh"],
+                        help="Process each build type in a separate worker, launched with this method. "
+                             "With srun/ssh, each worker gets a whole node, and output is streamed back here.")
+    parser.add_argument("--hosts",
+                        help="Comma-separated list of hosts to use with '--launcher ssh'")
+
+    parser.add_argument("--batch", choices=["array","hetjob"],
+                        help="Process each build type on a compute node, via a slurm job generated from the "
+                             "machine settings (num_bld_res, num_run_res, gpu_arch, and the sbatch options in "
+                             "'batch'): one job array element, or one heterogeneous job component, per build type")
+    parser.add_argument("--fake-scheduler", action="store_true",
+                        help="With --batch, run the job script locally instead of submitting it (for testing)")
+
+    parser.add_argument("--stall-timeout", type=float, metavar="SECONDS",
+                        help="Kill a build type if its processes accumulate no cpu time and print no output "
+                             "for this many seconds (e.g., a deadlock). Stack traces are captured first, "
+                             "if gdb or py-spy are available.")
+
+    parser.add_argument("--test-timeout-factor", type=float, metavar="F",
+                        help="Kill a test that runs for more than F times its average time in recent runs "
+                             "(and at least 60 seconds), capturing its stack traces first. "
+                             "The other tests of the build type keep running.")
+
+    parser.add_argument("--fail-fast", nargs="?", const="any", metavar="POLICY",
+                        help="Once a build type fails, cancel the other build types that are still running "
+                             "(their partial logs are kept). POLICY selects which failures trigger the "
+                             "cancellation: 'configure', 'build' (configure or build) or 'any' (the default).")
+
+    parser.add_argument("--gc-max-age", type=float, metavar="DAYS",
+                        help="Before running, remove the build dirs in the work dir (other than the ones of the "
+                             "selected build types) that were not used in the last DAYS days")
+    parser.add_argument("--gc-max-size", type=float, metavar="GB",
+                        help="Before running, remove the least recently used build dirs in the work dir (other "
+                             "than the ones of the selected build types) until the work dir takes at most GB "
+                             "gigabytes. Removed trees are deleted in the background.")
+
+    parser.add_argument("--archive-logs", action="store_true",
+                        help="After running, store a gzipped copy of the logs and ctest results of each build "
+                             "type in the work dir archive (.cacts/archive), and compress large logs in place")
+    parser.add_argument("--archive-max-age", type=float, metavar="DAYS",
+                        help="Remove the archived runs older than DAYS days (the last run of each build type "
+                             "is always kept)")
+    parser.add_argument("--archive-max-size", type=float, metavar="GB",
+                        help="Remove the oldest archived runs until the archive takes at most GB gigabytes "
+                             "(the last run of each build type is always kept)")
+
+    parser.add_argument("--coverage-diff", action="store_true",
+                        help="For build types with coverage enabled, compare the line coverage (overall and "
+                             "per file) with the previous run of the same build type")
+
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="Run all the requested build types, even the ones whose cmake configuration and "
+                             "environment are identical to the ones of another build type")
+
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse the existing build tree of each build type (configuring and building "
+                             "incrementally) instead of starting from an empty one. If ccache is found, it is "
+                             "used as compiler launcher")
+
+    parser.add_argument("--plan", metavar="FILE",
+                        help="Do not run anything. Instead, resolve the config and write to FILE a json plan with "
+                             "the builds, the commands and scripts that would be run, and their resources. "
+                             "Run '%(prog)s execute FILE' to execute it without parsing the config file again.")
+
     parser.add_argument("-v", "--verbose", action="store_true",
         help="Print output of config/build/test phases as they would be printed by running them manually.")
 
@@ -0,0 +1,187 @@
+"""
+Utilities to select the tests affected by the changes in the source tree,
+using the dependency information of the build system
+"""
+
+import re
+import json
+import fnmatch
+import pathlib
+
+from .utils  import expect
+from .engine import run_cmds_concurrently
+
+# Changes to these files can affect any target, so we can't be selective
+CMAKE_FILES_REGEX = re.compile(r'(^|/)CMakeLists\.txt$|\.cmake(\.in)?$')
+
+###############################################################################
+def get_changed_files(root_dir, ref):
+###############################################################################
+    """
+    Return the set of (absolute) paths of files that changed in root_dir since
+    the merge base of ref and HEAD, including local modifications and untracked files
+    """
+
+    root_dir = pathlib.Path(root_dir)
+
+    # The git queries are independent, so run them concurrently
+    cmds = ["git rev-parse --show-toplevel",
+            f"base=$(git merge-base {ref} HEAD) && git diff --name-only $base",
+            "top=$(git rev-parse --show-toplevel) && cd $top && git ls-files --others --exclude-standard"]
+    results = run_cmds_concurrently(cmds,from_dir=root_dir)
+    for cmd, (stat,_,err) in zip(cmds,results):
+        expect (stat==0,
+                "Could not retrieve the files changed in the source tree.\n"
+                f"  - command: {cmd}\n"
+                f"  - error: {err}\n")
+
+    top = pathlib.Path(results[0][1])
+    files = results[1][1].splitlines() + results[2][1].splitlines()
+
+    return set((top / f).resolve() for f in files if f)
+
+###############################################################################
+def write_file_api_query(build_dir):
+###############################################################################
+    """
+    Ask cmake to generate the codemodel via the file API during the configure phase
+    """
+
+    query_dir = pathlib.Path(build_dir) / ".cmake" / "api" / "v1" / "query"
+    query_dir.mkdir(parents=True,exist_ok=True)
+    (query_dir / "codemodel-v2").touch()
+
+###############################################################################
+def read_codemodel_targets(build_dir):
+###############################################################################
+    """
+    Read the targets from the file API reply in build_dir. Returns None if
+    cmake did not generate any reply.
+    """
+
+    reply_dir = pathlib.Path(build_dir) / ".cmake" / "api" / "v1" / "reply"
+    indices = sorted(reply_dir.glob("index-*.json"))
+    if not indices:
+        return None
+
+    index = json.loads(indices[-1].read_text())
+    codemodel = None
+    for obj in index.get("objects",[]):
+        if obj["kind"]=="codemodel":
+            codemodel = json.loads((reply_dir / obj["jsonFile"]).read_text())
+    if codemodel is None:
+        return None
+
+    targets = []
+    for config in codemodel.get("configurations",[]):
+        for t in config.get("targets",[]):
+            targets.append(json.loads((reply_dir / t["jsonFile"]).read_text()))
+
+    return targets
+
+###############################################################################
+def parse_depfile(depfile, build_dir):
+###############################################################################
+    """
+    Return the set of prerequisites listed in a make-style depfile
+    """
+
+    deps = set()
+    text = depfile.read_text(errors="replace").replace("\\\n"," ")
+    for line in text.splitlines():
+        if line.startswith("#") or ":" not in line:
+            continue
+        # Split at the first ': ', so that windows-like drive letters do not confuse us
+        _, _, prereqs = line.partition(": ")
+        for p in prereqs.split():
+            path = pathlib.Path(p)
+            deps.add(path if path.is_absolute() else pathlib.Path(build_dir) / path)
+
+    return deps
+
+###############################################################################
+def get_affected_tests(build_dir, root_dir, changed_files, tests, labels_by_path=None):
+###############################################################################
+    """
+    Return the names of the tests affected by the changed files, or None if
+    we cannot tell (in which case all tests should run)
+
+    A test is affected if:
+      - its command or REQUIRED_FILES contain a changed file
+      - its command contains the artifact of a target affected by the changes,
+        that is, a target with a changed source or header (according to the
+        depfiles of the build), or one that depends on such a target
+      - it has a label that labels_by_path maps to a changed file
+    """
+
+    build_dir = pathlib.Path(build_dir)
+    root_dir  = pathlib.Path(root_dir)
+
+    if any(CMAKE_FILES_REGEX.search(str(f)) for f in changed_files):
+        print("  CMake files were changed, all tests are affected")
+        return None
+
+    targets = read_codemodel_targets(build_dir)
+    if targets is None:
+        print("  No cmake file API reply was found, all tests are affected")
+        return None
+
+    source_dir = root_dir
+    affected = set()
+    for t in targets:
+        files = set()
+        for s in t.get("sources",[]):
+            path = pathlib.Path(s["path"])
+            files.add(path if path.is_absolute() else source_dir / path)
+
+        # Headers are not listed as sources, but the compiler depfiles have them
+        tgt_dir = build_dir / t.get("paths",{}).get("build",".") / "CMakeFiles" / f"{t['name']}.dir"
+        for pattern in ["**/*.d", "**/compiler_depend.make", "**/depend.make"]:
+            for depfile in tgt_dir.glob(pattern):
+                files |= parse_depfile(depfile,build_dir)
+
+        if any(f.resolve() in changed_files for f in files):
+            affected.add(t["id"])
+
+    # Propagate to the targets that depend on affected targets
+    dependents = {}
+    for t in targets:
+        for d in t.get("dependencies",[]):
+            dependents.setdefault(d["id"],set()).add(t["id"])
+    stack = list(affected)
+    while stack:
+        for tid in dependents.get(stack.pop(),set()):
+            if tid not in affected:
+                affected.add(tid)
+                stack.append(tid)
+
+    artifacts = set()
+    for t in targets:
+        if t["id"] in affected:
+            for a in t.get("artifacts",[]):
+                path = pathlib.Path(a["path"])
+                artifacts.add((path if path.is_absolute() else build_dir / path).resolve())
+
+    labels = set()
+    for pattern,values in (labels_by_path or {}).items():
+        for f in changed_files:
+            try:
+                rel = f.relative_to(root_dir.resolve())
+            except ValueError:
+                continue
+            if fnmatch.fnmatch(str(rel),pattern):
+                labels.update(values if isinstance(values,list) else [values])
+
+    selected = []
+    for test in tests:
+        required = test["properties"].get("REQUIRED_FILES",[])
+        required = required if isinstance(required,list) else required.split(";")
+        files = set(pathlib.Path(a).resolve() for a in test["command"]+required if a.startswith("/"))
+
+        test_labels = test["properties"].get("LABELS",[])
+        test_labels = test_labels if isinstance(test_labels,list) else test_labels.split(";")
+
+        if files & (changed_files | artifacts) or labels.intersection(test_labels):
+            selected.append(test["name"])
+
+    return selected
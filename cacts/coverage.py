@@ -0,0 +1,272 @@
+"""
+Coverage processing for build types with 'coverage: True'. The gcda files of
+the build tree are processed (with gcov, or llvm-cov for clang builds) by a
+pool of worker processes, and the results are merged into a single report,
+in lcov, Cobertura and json formats. The result of each object is cached,
+keyed by the hash of its gcno/gcda files, so that objects whose counters did
+not change are not processed again.
+"""
+
+import os
+import re
+import json
+import gzip
+import hashlib
+import pathlib
+import datetime
+import concurrent.futures
+from xml.sax.saxutils import quoteattr
+
+from .utils import run_cmd
+
+###############################################################################
+def get_coverage_tool(build_dir):
+###############################################################################
+    """
+    Return the command that prints the coverage data of a gcda file, matching
+    the compiler in the cmake cache: gcov for gcc, 'llvm-cov gcov' for clang.
+    Tools next to the compiler (with the same version suffix) are preferred.
+    """
+
+    cache = pathlib.Path(build_dir) / "CMakeCache.txt"
+    text = cache.read_text() if cache.exists() else ""
+    compiler_id = re.search(r'^CMAKE_CXX_COMPILER_ID:\w+=(.*)$',text,re.M) or \
+                  re.search(r'^CMAKE_C_COMPILER_ID:\w+=(.*)$',text,re.M)
+    compiler = re.search(r'^CMAKE_CXX_COMPILER:\w+=(.*)$',text,re.M) or \
+               re.search(r'^CMAKE_C_COMPILER:\w+=(.*)$',text,re.M)
+
+    # The compiler id is not always in the cache, so also look at the name
+    name = pathlib.Path(compiler.group(1)).name if compiler else ""
+    is_clang = "clang" in name or (compiler_id is not None and "Clang" in compiler_id.group(1))
+
+    tool = "llvm-cov" if is_clang else "gcov"
+    if compiler:
+        version = re.search(r'(-[\d.]+)$',name)
+        candidate = pathlib.Path(compiler.group(1)).parent / (tool + (version.group(1) if version else ""))
+        if candidate.exists():
+            tool = str(candidate)
+
+    # Print to stdout, in a machine readable format
+    return f"{tool} gcov -i -t" if is_clang else f"{tool} -j -t"
+
+###############################################################################
+def parse_gcov_output(output):
+###############################################################################
+    """
+    Parse the output of gcov -j -t (json), or of llvm-cov gcov -i -t (intermediate
+    text format). Returns a dict file->{"lines":{line:count}, "functions":{name:[line,count]}}
+    """
+
+    files = {}
+    def add(fname, cwd):
+        if cwd and not os.path.isabs(fname):
+            fname = os.path.join(cwd,fname)
+        return files.setdefault(os.path.normpath(fname),{"lines" : {}, "functions" : {}})
+
+    output = output.strip()
+    if output.startswith("{"):
+        # gcov prints one json document per gcda file
+        for doc in output.splitlines():
+            if not doc.strip():
+                continue
+            data = json.loads(doc)
+            cwd = data.get("current_working_directory",None)
+            for f in data["files"]:
+                entry = add(f["file"],cwd)
+                for l in f["lines"]:
+                    n = str(l["line_number"])
+                    entry["lines"][n] = entry["lines"].get(n,0) + l["count"]
+                for fn in f.get("functions",[]):
+                    entry["functions"][fn.get("demangled_name",fn["name"])] = [fn["start_line"],fn["execution_count"]]
+    else:
+        entry = None
+        for line in output.splitlines():
+            key, _, value = line.partition(":")
+            if key=="file":
+                entry = add(value,None)
+            elif entry is None:
+                continue
+            elif key=="lcount":
+                n, count = value.split(",")[:2]
+                entry["lines"][n] = entry["lines"].get(n,0) + int(count)
+            elif key=="function":
+                start, count, fname = value.split(",",2)
+                entry["functions"][fname] = [int(start),int(count)]
+
+    return files
+
+###############################################################################
+def process_gcda(gcda, tool, cache_dir):
+###############################################################################
+    """
+    Return the coverage data (see parse_gcov_output) of one object, reusing
+    the cached result if its gcno/gcda files did not change.
+    Returns (data,cached). Raises RuntimeError if the tool fails.
+    """
+
+    gcda = pathlib.Path(gcda)
+    gcno = gcda.with_suffix(".gcno")
+
+    # Skip the headers (magic, version and stamp), since the stamp changes at every compilation
+    h = hashlib.sha256(tool.encode())
+    for f in [gcno,gcda]:
+        if f.exists():
+            h.update(f.read_bytes()[12:])
+    key = h.hexdigest()
+    cache_file = pathlib.Path(cache_dir) / key[:2] / f"{key}.json.gz"
+    if cache_file.exists():
+        with gzip.open(cache_file,"rt") as fd:
+            return json.load(fd), True
+
+    stat, out, err = run_cmd(f"{tool} -o {gcda.parent} {gcda}",from_dir=gcda.parent)
+    if stat!=0:
+        raise RuntimeError(f"Coverage tool failed on {gcda}:\n{err}")
+    data = parse_gcov_output(out)
+
+    cache_file.parent.mkdir(parents=True,exist_ok=True)
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with gzip.open(tmp_file,"wt") as fd:
+        json.dump(data,fd)
+    os.replace(tmp_file,cache_file)
+
+    return data, False
+
+###############################################################################
+def merge_coverage(total, data, root_dir):
+###############################################################################
+    """
+    Add the counts in data to total, only keeping the files inside root_dir
+    """
+
+    root = str(root_dir).rstrip("/") + "/"
+    for fname, entry in data.items():
+        if not fname.startswith(root):
+            continue
+        dst = total.setdefault(fname,{"lines" : {}, "functions" : {}})
+        for n, count in entry["lines"].items():
+            dst["lines"][n] = dst["lines"].get(n,0) + count
+        for name, (start, count) in entry["functions"].items():
+            dst["functions"][name] = [start,dst["functions"].get(name,[start,0])[1] + count]
+
+###############################################################################
+def process_coverage(build_dir, root_dir, cache_dir, max_workers=None):
+###############################################################################
+    """
+    Process all the gcda files in build_dir concurrently, and merge their data.
+    Returns (coverage,num_objects,num_cached,errors), where coverage is a dict
+    file->{"lines":{line:count}, "functions":{name:[line,count]}}
+    """
+
+    build_dir = pathlib.Path(build_dir)
+    tool = get_coverage_tool(build_dir)
+    gcdas = sorted(build_dir.rglob("*.gcda"))
+
+    coverage = {}
+    num_cached = 0
+    errors = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_gcda,g,tool,cache_dir) for g in gcdas]
+        # Merge as the results come in, rather than holding all of them
+        for f in concurrent.futures.as_completed(futures):
+            try:
+                data, cached = f.result()
+            except RuntimeError as e:
+                errors.append(str(e))
+                continue
+            num_cached += cached
+            merge_coverage(coverage,data,root_dir)
+
+    return coverage, len(gcdas), num_cached, errors
+
+###############################################################################
+def summarize_coverage(coverage, root_dir):
+###############################################################################
+    """
+    Return a dict with the number of covered/total lines, overall and per file
+    (relative to root_dir)
+    """
+
+    files = {}
+    for fname, entry in sorted(coverage.items()):
+        counts = entry["lines"].values()
+        files[os.path.relpath(fname,root_dir)] = [sum(1 for c in counts if c>0), len(counts)]
+
+    return {
+        "date"    : datetime.datetime.now().isoformat(timespec="seconds"),
+        "covered" : sum(c for c,_ in files.values()),
+        "total"   : sum(t for _,t in files.values()),
+        "files"   : files,
+    }
+
+###############################################################################
+def write_lcov(coverage, lcov_file):
+###############################################################################
+    with open(lcov_file,"w",encoding="utf-8") as fd:
+        for fname, entry in sorted(coverage.items()):
+            fd.write(f"SF:{fname}\n")
+            funcs = sorted(entry["functions"].items(),key=lambda f: f[1][0])
+            for name, (start, _) in funcs:
+                fd.write(f"FN:{start},{name}\n")
+            for name, (_, count) in funcs:
+                fd.write(f"FNDA:{count},{name}\n")
+            fd.write(f"FNF:{len(funcs)}\nFNH:{sum(1 for _,(_,c) in funcs if c>0)}\n")
+            lines = sorted(entry["lines"].items(),key=lambda l: int(l[0]))
+            for n, count in lines:
+                fd.write(f"DA:{n},{count}\n")
+            fd.write(f"LF:{len(lines)}\nLH:{sum(1 for _,c in lines if c>0)}\n")
+            fd.write("end_of_record\n")
+
+###############################################################################
+def write_cobertura(coverage, xml_file, root_dir):
+###############################################################################
+    rate = lambda covered, total: f"{covered/total:.4f}" if total else "1"
+    summary = summarize_coverage(coverage,root_dir)
+    with open(xml_file,"w",encoding="utf-8") as fd:
+        fd.write('<?xml version="1.0" ?>\n')
+        fd.write(f'<coverage line-rate="{rate(summary["covered"],summary["total"])}" branch-rate="0" '
+                 f'lines-covered="{summary["covered"]}" lines-valid="{summary["total"]}" '
+                 f'version="cacts" timestamp="{int(datetime.datetime.now().timestamp())}">\n')
+        fd.write(f'  <sources><source>{root_dir}</source></sources>\n')
+        fd.write('  <packages>\n')
+        fd.write(f'    <package name="{pathlib.Path(root_dir).name}" '
+                 f'line-rate="{rate(summary["covered"],summary["total"])}" branch-rate="0">\n')
+        fd.write('      <classes>\n')
+        for fname, entry in sorted(coverage.items()):
+            rel = os.path.relpath(fname,root_dir)
+            covered, total = summary["files"][rel]
+            fd.write(f'        <class name={quoteattr(rel)} filename={quoteattr(rel)} '
+                     f'line-rate="{rate(covered,total)}" branch-rate="0">\n')
+            fd.write('          <lines>\n')
+            for n, count in sorted(entry["lines"].items(),key=lambda l: int(l[0])):
+                fd.write(f'            <line number="{n}" hits="{count}"/>\n')
+            fd.write('          </lines>\n')
+            fd.write('        </class>\n')
+        fd.write('      </classes>\n    </package>\n  </packages>\n</coverage>\n')
+
+###############################################################################
+def diff_coverage(old, new):
+###############################################################################
+    """
+    Return a text describing the changes between two coverage summaries
+    (see summarize_coverage): the overall change, and the files whose
+    coverage changed
+    """
+
+    pct = lambda covered, total: 100.0*covered/total if total else 100.0
+    text = f"Line coverage: {pct(old['covered'],old['total']):.2f}% ({old['date']}) -> " \
+           f"{pct(new['covered'],new['total']):.2f}%\n"
+
+    for fname in sorted(set(old["files"]) | set(new["files"])):
+        before = old["files"].get(fname,None)
+        after  = new["files"].get(fname,None)
+        if before==after:
+            continue
+        if before is None:
+            text += f"  + {fname}: {pct(*after):.1f}% (new)\n"
+        elif after is None:
+            text += f"  - {fname}: no longer covered\n"
+        else:
+            text += f"  {'-' if pct(*after)<pct(*before) else '+'} {fname}: " \
+                    f"{pct(*before):.1f}% -> {pct(*after):.1f}% ({after[0]-before[0]:+d} covered lines)\n"
+
+    return text
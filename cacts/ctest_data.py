@@ -0,0 +1,207 @@
+"""
+Helpers to query ctest for information on a build tree, and to parse
+the files that ctest leaves in it
+"""
+
+import re
+import json
+import pathlib
+import xml.etree.ElementTree as ET
+
+from .utils import expect, run_cmd
+
+# For each phase, the ctest xml file and the tags with its start/end times
+PHASE_TIMES_TAGS = {
+    "configure" : ("Configure.xml", "StartConfigureTime", "EndConfigureTime"),
+    "build"     : ("Build.xml", "StartBuildTime", "EndBuildTime"),
+    "test"      : ("Test.xml", "StartTestTime", "EndTestTime"),
+    "memcheck"  : ("DynamicAnalysis.xml", "StartTestTime", "EndTestTime"),
+}
+
+###############################################################################
+def get_ctest_tests(build_dir, env_setup=None):
+###############################################################################
+    """
+    Return the list of tests that ctest knows about in this build dir.
+    Each test is a dict with the keys 'name', 'command' (a list of strings)
+    and 'properties' (a dict property_name->value)
+    """
+
+    stat, out, err = run_cmd("ctest --show-only=json-v1",from_dir=build_dir,env_setup=env_setup)
+    expect (stat==0,
+            "Could not retrieve the list of tests from ctest.\n"
+            f"  - build dir: {build_dir}\n"
+            f"  - error: {err}\n")
+
+    tests = []
+    for t in json.loads(out).get("tests",[]):
+        tests.append({
+            "name"       : t["name"],
+            "command"    : t.get("command",[]),
+            "properties" : {p["name"] : p["value"] for p in t.get("properties",[])}
+        })
+
+    return tests
+
+###############################################################################
+def write_ctest_resource_file(build_dir, resources):
+###############################################################################
+    """
+    Write the json file that ctest uses to schedule tests in parallel, with
+    one res group (with 1 slot) per entry in the resources list
+    """
+
+    data = {}
+
+    # This is the only version numbering supported by ctest, so far
+    data["version"] = {"major":1,"minor":0}
+
+    # We add leading zeroes to ensure that ids will sort correctly
+    # both alphabetically and numerically
+    devices = []
+    for res_id in resources:
+        devices.append({"id":f"{res_id:05d}"})
+
+    # Add resource groups
+    data["local"] = [{"devices":devices}]
+
+    with (pathlib.Path(build_dir)/"ctest_resource_file.json").open("w", encoding="utf-8") as outfile:
+        json.dump(data,outfile,indent=2)
+
+###############################################################################
+def get_tag_dir(build_dir):
+###############################################################################
+    """
+    Return the Testing/<tag> folder of the most recent ctest session in build_dir,
+    or None if no session was ever started there
+    """
+
+    tag_file = pathlib.Path(build_dir) / "Testing" / "TAG"
+    if not tag_file.exists():
+        return None
+
+    lines = tag_file.read_text().splitlines()
+    if not lines:
+        return None
+
+    return tag_file.parent / lines[0].strip()
+
+###############################################################################
+def iter_test_results(build_dir):
+###############################################################################
+    """
+    Yield a dict for each test run in the most recent ctest session in build_dir,
+    with keys 'name', 'status' (one of 'passed', 'failed', 'notrun') and 'time'
+    (the execution time in seconds, or None if not available)
+    """
+
+    tag_dir = get_tag_dir(build_dir)
+    if tag_dir is None or not (tag_dir / "Test.xml").exists():
+        return
+
+    # Test.xml embeds the output of each test, so it can be large. Parse it
+    # incrementally, and drop each <Test> element once we're done with it
+    for _, elem in ET.iterparse(str(tag_dir / "Test.xml")):
+        if elem.tag=="Test" and "Status" in elem.attrib:
+            time = None
+            for m in elem.iter("NamedMeasurement"):
+                if m.attrib.get("name")=="Execution Time":
+                    time = float(m.findtext("Value"))
+            yield {"name" : elem.findtext("Name"), "status" : elem.attrib["Status"], "time" : time}
+            elem.clear()
+
+###############################################################################
+def get_phase_times(build_dir):
+###############################################################################
+    """
+    Return a dict phase->seconds, with the duration of the configure, build,
+    test and memcheck phases of the most recent ctest session in build_dir
+    (according to ctest's xml files, so with a 1 second resolution)
+    """
+
+    tag_dir = get_tag_dir(build_dir)
+    if tag_dir is None:
+        return {}
+
+    times = {}
+    for phase, (xml_file, start, end) in PHASE_TIMES_TAGS.items():
+        if not (tag_dir / xml_file).exists():
+            continue
+        found = {}
+        for _, elem in ET.iterparse(str(tag_dir / xml_file)):
+            if elem.tag in [start,end]:
+                found[elem.tag] = int(elem.text)
+            elem.clear()
+        if start in found and end in found:
+            times[phase] = found[end] - found[start]
+
+    return times
+
+###############################################################################
+def get_test_results(build_dir):
+###############################################################################
+    """
+    Return a dict test_name->status for the tests run in the most recent ctest
+    session in build_dir. Status is one of 'passed', 'failed', 'notrun'.
+    """
+
+    return {r["name"] : r["status"] for r in iter_test_results(build_dir)}
+
+###############################################################################
+def tests_regex(names):
+###############################################################################
+    """
+    Return a regex matching exactly the given test names, usable in the
+    INCLUDE/EXCLUDE arguments of ctest_test
+
+    >>> tests_regex(['a.b','c'])
+    '^(a\\\\.b|c)$'
+    """
+
+    return "^(" + "|".join(re.sub(r'([\\.^$|()\[\]*+?{}])',r'\\\1',n) for n in sorted(names)) + ")$"
+
+###############################################################################
+def merge_test_xml(xml_files, output_file):
+###############################################################################
+    """
+    Merge the Test.xml files of several ctest sessions (e.g., the shards of a
+    test suite) into a single Test.xml, which can be submitted to CDash
+    """
+
+    tree = ET.parse(str(xml_files[0]))
+    testing = tree.getroot().find("Testing")
+    test_list = testing.find("TestList")
+
+    # Insert the tests of the other files right after the last test of the first one
+    pos = max(i for i,e in enumerate(testing) if e.tag in ["TestList","Test"]) + 1
+    for xml_file in xml_files[1:]:
+        for _, elem in ET.iterparse(str(xml_file)):
+            if elem.tag=="Test" and "Status" in elem.attrib:
+                entry = ET.SubElement(test_list,"Test")
+                entry.text = elem.findtext("FullName")
+                testing.insert(pos,elem)
+                pos += 1
+
+    tree.write(str(output_file),encoding="UTF-8",xml_declaration=True)
+
+###############################################################################
+def replace_test_results(xml_file, new_xml_file):
+###############################################################################
+    """
+    Replace the results of the tests in xml_file (a Test.xml) with the ones in
+    new_xml_file, the Test.xml of a session that re-ran some of the tests.
+    Tests that were not re-run keep their results.
+    """
+
+    new_results = {}
+    for _, elem in ET.iterparse(str(new_xml_file)):
+        if elem.tag=="Test" and "Status" in elem.attrib:
+            new_results[elem.findtext("Name")] = elem
+
+    tree = ET.parse(str(xml_file))
+    testing = tree.getroot().find("Testing")
+    for i, elem in enumerate(testing):
+        if elem.tag=="Test" and "Status" in elem.attrib and elem.findtext("Name") in new_results:
+            testing[i] = new_results[elem.findtext("Name")]
+
+    tree.write(str(xml_file),encoding="UTF-8",xml_declaration=True)
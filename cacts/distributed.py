@@ -0,0 +1,148 @@
+"""
+Utilities to run build types on worker nodes. The coordinator resolves the
+configuration once, and stores (pickled) everything a worker needs to process
+one build type. Workers are launched via srun, ssh, or as local processes,
+and their output is streamed back to the coordinator.
+"""
+
+import sys
+import json
+import shlex
+import queue
+import pickle
+import pathlib
+import threading
+import subprocess
+
+from .utils   import expect
+from .scratch import wait_for_syncs
+
+###############################################################################
+def write_worker_state(state_file, driver, build):
+###############################################################################
+    state_file = pathlib.Path(state_file)
+    state_file.parent.mkdir(parents=True,exist_ok=True)
+    with state_file.open("wb") as fd:
+        pickle.dump((driver,build),fd)
+
+###############################################################################
+def run_worker(state_file):
+###############################################################################
+    """
+    Entry point of a worker: process the build type stored in state_file,
+    and write the outcome in a json file next to it
+    """
+
+    state_file = pathlib.Path(state_file)
+    with state_file.open("rb") as fd:
+        driver, build = pickle.load(fd)
+
+    success = driver.run_build(build)
+    wait_for_syncs()
+
+    state_file.with_suffix(".result.json").write_text(json.dumps({"success" : success}))
+
+    sys.exit(0 if success else 1)
+
+###############################################################################
+def clear_worker_result(state_file):
+###############################################################################
+    result_file = pathlib.Path(state_file).with_suffix(".result.json")
+    if result_file.exists():
+        result_file.unlink()
+
+###############################################################################
+def read_worker_result(state_file):
+###############################################################################
+    """
+    Return the outcome reported by the worker, or None if it did not report any
+    """
+    result_file = pathlib.Path(state_file).with_suffix(".result.json")
+    if not result_file.exists():
+        return None
+
+    return json.loads(result_file.read_text())["success"]
+
+###############################################################################
+def get_worker_cmd(state_file, launcher, host=None):
+###############################################################################
+    """
+    Return the shell command that launches a worker for the given state file
+    """
+
+    # Make sure the worker imports this very same cacts package
+    pkg_parent = pathlib.Path(__file__).resolve().parent.parent
+    code = f"from cacts.distributed import run_worker; run_worker({json.dumps(str(state_file))})"
+    worker_cmd = f"cd {shlex.quote(str(pathlib.Path.cwd()))} && " \
+                 f"PYTHONPATH={shlex.quote(str(pkg_parent))} {sys.executable} -u -c {shlex.quote(code)}"
+
+    if launcher=="local":
+        return worker_cmd
+    elif launcher=="srun":
+        # Give the whole node to the worker
+        return f"srun --nodes=1 --ntasks=1 --exclusive sh -c {shlex.quote(worker_cmd)}"
+    elif launcher=="ssh":
+        expect (host is not None, "Launcher 'ssh' requires a host name.\n")
+        return f"ssh {host} {shlex.quote(worker_cmd)}"
+    else:
+        expect (False, f"Unsupported worker launcher '{launcher}'. Use one of local, srun, ssh.\n")
+
+###############################################################################
+def run_workers(state_files, launcher, hosts=None):
+###############################################################################
+    """
+    Launch one worker for each (name,state_file) item, and wait for all of them.
+    The output of each worker is printed with a '[name]' prefix, and stored
+    in a log file next to its state file. With the ssh launcher, each host
+    runs one worker at a time. Returns a dict name->success.
+    """
+
+    if launcher=="ssh":
+        expect (hosts, "Launcher 'ssh' requires a list of hosts (use --hosts).\n")
+        free_hosts = queue.Queue()
+        for h in hosts:
+            free_hosts.put(h)
+    else:
+        free_hosts = None
+
+    print_lock = threading.Lock()
+    results = {}
+
+    def run_one(name, state_file):
+        host = free_hosts.get() if free_hosts is not None else None
+        try:
+            cmd = get_worker_cmd(state_file,launcher,host)
+            with print_lock:
+                print(f"[{name}] launching worker{' on '+host if host else ''}: {cmd}")
+
+            log_file = pathlib.Path(state_file).with_suffix(".log")
+            with log_file.open("w") as log:
+                # Exiting the with block closes the pipe, and waits for the worker
+                with subprocess.Popen(cmd,shell=True,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,
+                                      text=True,bufsize=1) as proc:
+                    for line in proc.stdout:
+                        log.write(line)
+                        with print_lock:
+                            print(f"[{name}] {line}",end="")
+
+            results[name] = read_worker_result(state_file)
+            if results[name] is None:
+                with print_lock:
+                    print(f"[{name}] worker exited with code {proc.returncode} without reporting a result. "
+                          f"See {log_file}")
+                results[name] = False
+        finally:
+            if host is not None:
+                free_hosts.put(host)
+
+    threads = []
+    for name, state_file in state_files.items():
+        # Remove results of previous runs
+        clear_worker_result(state_file)
+        t = threading.Thread(target=run_one,args=(name,state_file))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+
+    return results
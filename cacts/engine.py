@@ -0,0 +1,302 @@
+"""
+The engine to run shell commands. Output is read in chunks and split into
+lines as it arrives, so that it can be echoed (with a prefix) and logged while
+the command runs, without holding all of it in memory. Single commands run
+synchronously (with a reader thread per stream); asyncio is used for commands
+that run alongside monitors, and to run many commands concurrently.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import subprocess
+import collections
+import concurrent.futures
+
+import psutil
+
+# Same exit code as coreutils' timeout
+TIMEOUT_STATUS = 124
+
+# When echoing or logging the output, only the last lines are kept (for error messages)
+TAIL_LINES = 200
+
+###############################################################################
+class OutputSink(object):
+###############################################################################
+    """
+    Where the lines of an output stream go: the console (with a prefix),
+    a log file, and/or a buffer returned to the caller
+    """
+
+    def __init__(self, echo=False, prefix="", log=None, capture=False, console=None):
+        self.echo    = echo
+        self.prefix  = prefix
+        self.log     = log
+        self.console = console or sys.stdout
+        self.lines   = [] if capture else collections.deque(maxlen=TAIL_LINES)
+        self.at_line_start = True
+        self.last_write = time.monotonic()
+
+    def write(self, line):
+        self.last_write = time.monotonic()
+        # Very long lines may come in pieces: only the first one gets the prefix
+        if self.echo:
+            self.console.write((self.prefix if self.at_line_start else "") + line)
+            self.console.flush()
+        self.at_line_start = line.endswith("\n")
+        if self.log is not None:
+            self.log.write(line)
+        self.lines.append(line)
+
+    def text(self):
+        return "".join(self.lines).strip()
+
+###############################################################################
+class LineSplitter(object):
+###############################################################################
+    """
+    Split the chunks read from a stream into lines, and forward them to the
+    sinks. Lines longer than chunk_size are forwarded in pieces, without
+    waiting for their end.
+    """
+
+    def __init__(self, sinks, chunk_size):
+        self.sinks      = sinks
+        self.chunk_size = chunk_size
+        self.partial    = ""
+
+    def feed(self, chunk):
+        self.partial += chunk.decode("utf-8",errors="replace")
+        *lines, self.partial = self.partial.split("\n")
+        for line in lines:
+            for s in self.sinks:
+                s.write(line + "\n")
+        if len(self.partial)>self.chunk_size:
+            for s in self.sinks:
+                s.write(self.partial)
+            self.partial = ""
+
+    def close(self):
+        if self.partial:
+            # Terminate the last line, so that it does not get mixed with other output
+            for s in self.sinks:
+                s.write(self.partial + "\n")
+            self.partial = ""
+
+###############################################################################
+async def pump_stream(stream, sinks, chunk_size=65536):
+###############################################################################
+    """
+    Read the (asyncio) stream until EOF, and forward each line to the sinks
+    """
+
+    splitter = LineSplitter(sinks,chunk_size)
+    while True:
+        chunk = await stream.read(chunk_size)
+        if not chunk:
+            break
+        splitter.feed(chunk)
+    splitter.close()
+
+###############################################################################
+def pump_stream_sync(stream, sinks, chunk_size=65536):
+###############################################################################
+    """
+    Read the (file) stream until EOF, and forward each line to the sinks
+    """
+
+    splitter = LineSplitter(sinks,chunk_size)
+    while True:
+        chunk = stream.read1(chunk_size)
+        if not chunk:
+            break
+        splitter.feed(chunk)
+    splitter.close()
+    stream.close()
+
+###############################################################################
+def kill_process_tree(pid):
+###############################################################################
+    try:
+        proc = psutil.Process(pid)
+        procs = proc.children(recursive=True) + [proc]
+    except psutil.NoSuchProcess:
+        return
+    for p in procs:
+        try:
+            p.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+###############################################################################
+def terminate_process_tree(pid, grace=10):
+###############################################################################
+    """
+    Ask the process and its children to terminate (SIGTERM), and kill the
+    ones that are still alive after grace seconds
+    """
+
+    try:
+        proc = psutil.Process(pid)
+        procs = proc.children(recursive=True) + [proc]
+    except psutil.NoSuchProcess:
+        return
+    for p in procs:
+        try:
+            p.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(procs,timeout=grace)
+    for p in alive:
+        try:
+            p.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+###############################################################################
+def get_outputs(out, err, echo_stdout, echo_stderr, combine_output, stat, timeout, timed_out):
+###############################################################################
+    output = None if echo_stdout else out.text()
+    errput = None if echo_stderr or combine_output else err.text()
+    if timed_out:
+        msg = f"Command timed out after {timeout} seconds"
+        errput = f"{errput}\n{msg}" if errput else msg
+        return TIMEOUT_STATUS, output, errput
+
+    return stat, output, errput
+
+###############################################################################
+def run_cmd_sync(cmd, from_dir=None, echo_stdout=False, echo_stderr=False,
+                 combine_output=False, prefix="", log_file=None, timeout=None):
+###############################################################################
+    """
+    Same as run_cmd_async (without monitors), but without an event loop, so
+    that it can be called from anywhere, including from a running event loop
+    """
+
+    proc = subprocess.Popen(cmd,shell=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT if combine_output else subprocess.PIPE,
+                            cwd=from_dir)
+
+    log = open(log_file,"a",encoding="utf-8") if log_file else None
+    try:
+        out = OutputSink(echo=echo_stdout,prefix=prefix,log=log,capture=not echo_stdout)
+        err = OutputSink(echo=echo_stderr,prefix=prefix,log=log,capture=not echo_stderr,console=sys.stderr)
+
+        pumps = [threading.Thread(target=pump_stream_sync,args=(proc.stdout,[out]),daemon=True)]
+        if not combine_output:
+            pumps.append(threading.Thread(target=pump_stream_sync,args=(proc.stderr,[err]),daemon=True))
+        for p in pumps:
+            p.start()
+
+        timed_out = False
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+        finally:
+            if proc.returncode is None:
+                kill_process_tree(proc.pid)
+                proc.wait()
+            for p in pumps:
+                p.join()
+    finally:
+        if log is not None:
+            log.close()
+
+    return get_outputs(out,err,echo_stdout,echo_stderr,combine_output,proc.returncode,timeout,timed_out)
+
+###############################################################################
+async def run_cmd_async(cmd, from_dir=None, echo_stdout=False, echo_stderr=False,
+                        combine_output=False, prefix="", log_file=None, timeout=None, monitors=None):
+###############################################################################
+    """
+    Run a shell command. Returns (stat, output, errput), where output/errput
+    are None for streams that are echoed to the console (like subprocess does
+    for inherited streams), and the whole stream otherwise.
+
+    If log_file is given, both streams are also appended to it.
+    If the command does not complete within timeout seconds, it is killed
+    (together with its children), and stat is TIMEOUT_STATUS. If the task
+    running this coroutine is cancelled, the command is killed as well.
+    Monitors (see watchdog.py) are objects with a coroutine watch(pid,last_output_time),
+    which run alongside the command, and can kill it.
+    """
+
+    proc = await asyncio.create_subprocess_shell(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if combine_output else subprocess.PIPE,
+            cwd=from_dir)
+
+    log = open(log_file,"a",encoding="utf-8") if log_file else None
+    try:
+        out = OutputSink(echo=echo_stdout,prefix=prefix,log=log,capture=not echo_stdout)
+        err = OutputSink(echo=echo_stderr,prefix=prefix,log=log,capture=not echo_stderr,console=sys.stderr)
+
+        pumps = [pump_stream(proc.stdout,[out])]
+        if not combine_output:
+            pumps.append(pump_stream(proc.stderr,[err]))
+
+        last_output_time = lambda: max(out.last_write,err.last_write)
+        watchers = [asyncio.ensure_future(m.watch(proc.pid,last_output_time)) for m in monitors or []]
+
+        timed_out = False
+        try:
+            await asyncio.wait_for(asyncio.gather(*pumps,proc.wait()),timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+        finally:
+            for w in watchers:
+                w.cancel()
+            await asyncio.gather(*watchers,return_exceptions=True)
+            if proc.returncode is None:
+                kill_process_tree(proc.pid)
+                await proc.wait()
+    finally:
+        if log is not None:
+            log.close()
+
+    return get_outputs(out,err,echo_stdout,echo_stderr,combine_output,proc.returncode,timeout,timed_out)
+
+###############################################################################
+def run_coroutine(coro):
+###############################################################################
+    """
+    Run the coroutine to completion, and return its result. If an event loop
+    is already running in this thread (e.g., when cacts is used from async
+    code), the coroutine runs in a new loop in a separate thread.
+    """
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run,coro).result()
+
+###############################################################################
+def run_cmds_concurrently(cmds, from_dir=None, env_setup=None, max_concurrent=None):
+###############################################################################
+    """
+    Run several (small) commands concurrently, capturing their output.
+    Returns the list of (stat, output, errput), in the same order as cmds.
+    """
+
+    max_concurrent = max_concurrent or (os.cpu_count() or 1)*2
+
+    async def run_all():
+        sem = asyncio.Semaphore(max_concurrent)
+        async def run_one(cmd):
+            async with sem:
+                if env_setup:
+                    cmd = f"{env_setup} && {cmd}"
+                return await run_cmd_async(cmd,from_dir=str(from_dir) if from_dir else None)
+        return await asyncio.gather(*[run_one(c) for c in cmds])
+
+    return list(run_coroutine(run_all())) if cmds else []
@@ -1,12 +1,16 @@
 import os
 import sys
+import json
+import hashlib
 import pathlib
 import argparse
 
-from .parse_config  import parse_project, parse_machine
 from .utils         import check_minimum_python_version, GoodFormatter
 
-check_minimum_python_version(3, 4)
+# NOTE: this runs in shell profiles and job scripts, so it must start fast. The config
+#       parsing modules (and their dependencies) are only imported if the cache misses.
+
+check_minimum_python_version(3, 8)
 
 ###############################################################################
 def print_mach_env():
@@ -15,13 +19,74 @@ def print_mach_env():
 
     args = vars(parse_command_line(sys.argv, __doc__, __version__))
 
-    project = parse_project(args['config_file'],args['root_dir'])
-    machine = parse_machine(args['config_file'],project,args['machine_name'])
+    cache_file = None if args['no_cache'] else \
+                 get_cache_file(args['config_file'],args['root_dir'],args['machine_name'],__version__)
+    env_setup = read_cache_file(cache_file) if cache_file else None
+
+    if env_setup is None:
+        from .parse_config import parse_project, parse_machine
+
+        # Only env_setup is needed, so only evaluate that
+        project = parse_project(args['config_file'],args['root_dir'])
+        machine = parse_machine(args['config_file'],project,args['machine_name'],fields=['env_setup'])
+        env_setup = machine.env_setup
 
-    print(" && ".join(machine.env_setup))
+        if cache_file:
+            write_cache_file(cache_file,{"machine" : machine.name, "env_setup" : env_setup})
+
+    print(" && ".join(env_setup))
 
     sys.exit(0)
 
+###############################################################################
+def get_cache_file(config_file, root_dir, machine_name, version):
+###############################################################################
+    """
+    The file caching the resolved env setup of a machine. It only gets reused if
+    the config file (and ~/.cime/cacts.yaml for the 'local' machine), the root
+    dir, the machine name, the hostname and the cacts version are unchanged.
+    """
+
+    files = [pathlib.Path(config_file)]
+    if machine_name=="local":
+        files.append(pathlib.Path("~/.cime/cacts.yaml").expanduser())
+
+    h = hashlib.sha256()
+    for f in files:
+        if not f.exists():
+            # Let the config parsing report the error
+            return None
+        h.update(str(f.absolute()).encode() + b"\0" + f.read_bytes() + b"\0")
+    if hasattr(os,"uname"):
+        hostname = os.uname().nodename
+    else:
+        import socket
+        hostname = socket.gethostname()
+    h.update("\0".join([str(root_dir),machine_name,hostname,version]).encode())
+
+    cache_dir = pathlib.Path(os.environ.get("XDG_CACHE_HOME","~/.cache")).expanduser() / "cacts" / "mach_env"
+    return cache_dir / f"{h.hexdigest()}.json"
+
+###############################################################################
+def read_cache_file(cache_file):
+###############################################################################
+    try:
+        return json.loads(cache_file.read_text())["env_setup"]
+    except (OSError,ValueError,KeyError):
+        return None
+
+###############################################################################
+def write_cache_file(cache_file, record):
+###############################################################################
+    # The cache is only an optimization, so failing to write it is not an error
+    try:
+        cache_file.parent.mkdir(parents=True,exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(record))
+        os.replace(tmp_file,cache_file)
+    except OSError:
+        pass
+
 ###############################################################################
 def parse_command_line(args, description, version):
 ###############################################################################
@@ -44,6 +109,10 @@ OR
     parser.add_argument("-r", "--root-dir", default=f"{os.getcwd()}",
         help="The root directory of the project, where the main CMakeLists.txt file is located")
 
+    parser.add_argument("--no-cache", action="store_true",
+        help="Do not use (nor update) the cached env setup of the machine. Useful if the env setup "
+             "uses $(...) commands whose output changes over time")
+
     parser.add_argument("machine_name", help="The machine name for which you want the scream env")
 
     return parser.parse_args(args[1:])
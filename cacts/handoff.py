@@ -0,0 +1,174 @@
+"""
+Support for splitting the build and test phases of a build type: a --build-only
+run leaves a manifest in the build dir, which 'cacts test-stage' uses to run
+the test (and submit) phases later, possibly on a different node.
+"""
+
+import sys
+import json
+import hashlib
+import pathlib
+import argparse
+
+from .utils import expect, run_cmd, sha256_file, get_env_snapshot, get_available_cpu_ids, GoodFormatter
+from .ctest_data import write_ctest_resource_file
+
+MANIFEST_FILE     = "cacts_manifest.json"
+TEST_STAGE_SCRIPT = "ctest_test_stage.cmake"
+
+# Files with absolute paths to the build dir, which ctest needs to run tests
+RELOCATABLE_FILES = ["CTestTestfile.cmake", "DartConfiguration.tcl", TEST_STAGE_SCRIPT]
+
+###############################################################################
+def get_test_files(tests, build_dir):
+###############################################################################
+    """
+    Return a dict relative_path->sha256 for the files inside build_dir that
+    the tests use in their command line (executables and inputs)
+    """
+
+    build_dir = pathlib.Path(build_dir)
+    files = {}
+    for test in tests:
+        for arg in test["command"]:
+            path = pathlib.Path(arg)
+            if path.is_absolute() and build_dir in path.parents and path.is_file():
+                files[str(path.relative_to(build_dir))] = sha256_file(path)
+
+    return files
+
+###############################################################################
+def get_max_test_resources(tests):
+###############################################################################
+    """
+    Return the largest number of resources that a single test requires
+    """
+
+    max_res = 1
+    for test in tests:
+        props = test["properties"]
+        max_res = max(max_res,int(props.get("PROCESSORS",1)))
+        for group in props.get("RESOURCE_GROUPS",[]):
+            max_res = max(max_res,int(group.get("number",1)))
+
+    return max_res
+
+###############################################################################
+def hash_env(env):
+###############################################################################
+    """
+    Hash the values of the env vars, so that the manifest does not store
+    their content (which may contain credentials)
+    """
+
+    return {n : hashlib.sha256(v.encode()).hexdigest()[:16] for n,v in env.items()}
+
+###############################################################################
+def relocate_build_dir(build_dir, old_dir):
+###############################################################################
+    """
+    Replace the old location of the build dir with the new one in the files
+    that ctest reads to run the tests
+    """
+
+    build_dir = pathlib.Path(build_dir)
+    print(f"Build dir was moved from {old_dir} to {build_dir}. Updating test files.")
+
+    for name in RELOCATABLE_FILES:
+        for fn in build_dir.rglob(name):
+            text = fn.read_text()
+            fn.write_text(text.replace(str(old_dir),str(build_dir)))
+
+###############################################################################
+def run_test_stage(build_dir, num_res=None, verbose=False):
+###############################################################################
+    """
+    Run the test stage of a build dir produced by a --build-only run.
+    Returns True if all phases succeeded.
+    """
+
+    build_dir = pathlib.Path(build_dir).expanduser().absolute()
+    manifest_file = build_dir / MANIFEST_FILE
+    expect (manifest_file.exists(),
+            f"No {MANIFEST_FILE} in {build_dir}. Was it produced by a successful --build-only run?\n")
+
+    manifest = json.loads(manifest_file.read_text())
+    env_setup = list(manifest["env_setup"])
+
+    # The manifest keeps the original build dir, and the one the files currently refer to
+    location = manifest.get("location",manifest["build_dir"])
+    if pathlib.Path(location)!=build_dir:
+        relocate_build_dir(build_dir,location)
+        manifest["location"] = str(build_dir)
+        manifest_file.write_text(json.dumps(manifest,indent=2))
+    if pathlib.Path(manifest["build_dir"])!=build_dir:
+        # The rpath of the executables still points to the original location
+        lib_dirs = sorted(set(str(f.parent) for f in build_dir.rglob("*.so*") if f.is_file()))
+        if lib_dirs:
+            env_setup.append(f"export LD_LIBRARY_PATH={':'.join(lib_dirs)}:$LD_LIBRARY_PATH")
+
+    print("===============================================================================")
+    print(f"Test stage of build {manifest['build']} (built at sha={manifest['git_sha']} on {manifest['date']})")
+    print("===============================================================================")
+
+    # Verify that the test files are the ones that were built
+    changed = [f for f,h in manifest["files"].items()
+               if not (build_dir / f).exists() or sha256_file(build_dir / f)!=h]
+    expect (not changed,
+            "The following test files differ from the ones listed in the manifest:\n  " +
+            "\n  ".join(changed) + "\n")
+
+    env = hash_env(get_env_snapshot(" && ".join(manifest["env_setup"])))
+    diff = sorted(n for n in set(env) | set(manifest["env"]) if env.get(n)!=manifest["env"].get(n))
+    if diff:
+        print(f"  WARNING: the environment differs from the build one in these variables: {', '.join(diff)}")
+
+    # Size the resource file for this node
+    if manifest["uses_gpu"]:
+        resources = list(range(num_res or manifest["num_run_res"]))
+    else:
+        resources = get_available_cpu_ids()[:num_res]
+    if len(resources)<manifest["max_test_res"]:
+        print(f"  WARNING: this node has {len(resources)} resources, "
+              f"but some tests need {manifest['max_test_res']}")
+    write_ctest_resource_file(build_dir,resources)
+
+    ctest_cmd = "ctest"
+    ctest_cmd += " -VV" if verbose else " --output-on-failure"
+    ctest_cmd += f" -S {build_dir / manifest['script']}"
+    ctest_cmd += f" -DCACTS_TEST_RES_COUNT={len(resources)}"
+    ctest_cmd += f" --resource-spec-file {build_dir / 'ctest_resource_file.json'}"
+
+    stat, _, _ = run_cmd(ctest_cmd,arg_stdout=None,arg_stderr=None,env_setup=" && ".join(env_setup),
+                         from_dir=build_dir,verbose=True)
+
+    return stat==0
+
+###############################################################################
+def test_stage_main(args):
+###############################################################################
+    """
+    Entry point of 'cacts test-stage'. Returns True if all build dirs passed.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog=f"{pathlib.Path(sys.argv[0]).name} test-stage",
+        description="Run the test (and submit) phases in build dirs produced by 'cacts --build-only', "
+                    "with a resource file sized for the current node",
+        formatter_class=GoodFormatter
+    )
+
+    parser.add_argument("build_dirs", nargs='+', help="The build dirs to test")
+    parser.add_argument("-n", "--num-res", type=int,
+                        help="Number of resources (cores, or GPUs on GPU machines) to use. "
+                             "Defaults to all the cores available, or all the GPUs of the machine")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print output of test phase as it would be printed by running it manually.")
+
+    args = parser.parse_args(args)
+
+    success = True
+    for build_dir in args.build_dirs:
+        success &= run_test_stage(build_dir,args.num_res,args.verbose)
+
+    return success
@@ -0,0 +1,119 @@
+"""
+Per-test history of outcomes across runs, used to detect flaky tests
+"""
+
+import os
+import json
+import pathlib
+import datetime
+
+###############################################################################
+class TestHistory(object):
+###############################################################################
+    """
+    Stores the most recent outcomes (status and execution time) of each test of
+    a build type. A test whose outcome keeps flipping between pass and fail is
+    considered flaky.
+    """
+
+    # Number of outcomes kept for each test
+    window = 20
+
+    # Fraction of pass/fail flips above which a test is suspected to be flaky,
+    # and above which it is quarantined (if quarantine is enabled)
+    flaky_threshold      = 0.1
+    quarantine_threshold = 0.3
+
+    # Do not quarantine tests with fewer outcomes than this
+    min_runs_for_quarantine = 5
+
+    # A single flip is a test that started (or stopped) failing, e.g. because
+    # of a regression (or its fix). Flaky tests flip back and forth.
+    min_flips = 2
+
+    def __init__(self, history_file):
+        self._history_file = pathlib.Path(history_file)
+
+        if self._history_file.exists():
+            self._outcomes = json.loads(self._history_file.read_text())
+        else:
+            self._outcomes = {}
+
+    ###########################################################################
+    def add(self, name, status, time=None):
+    ###########################################################################
+        if status not in ["passed","failed"]:
+            return
+
+        outcomes = self._outcomes.setdefault(name,[])
+        outcomes.append({
+            "status" : status,
+            "time"   : time,
+            "date"   : datetime.datetime.now().isoformat(timespec="seconds")
+        })
+        del outcomes[:-self.window]
+
+    ###########################################################################
+    def tests(self):
+    ###########################################################################
+        return sorted(self._outcomes.keys())
+
+    ###########################################################################
+    def flakiness(self, name):
+    ###########################################################################
+        """
+        Return the fraction of consecutive outcomes of the test that differ,
+        or 0 if the outcome did not flip at least min_flips times
+        """
+        statuses = [o["status"] for o in self._outcomes.get(name,[])]
+        flips = sum(1 for a,b in zip(statuses[:-1],statuses[1:]) if a!=b)
+        if flips<self.min_flips:
+            return 0.0
+
+        return flips / (len(statuses)-1)
+
+    ###########################################################################
+    def is_suspected_flaky(self, name):
+    ###########################################################################
+        return self.flakiness(name)>=self.flaky_threshold
+
+    ###########################################################################
+    def is_quarantined(self, name):
+    ###########################################################################
+        return len(self._outcomes.get(name,[]))>=self.min_runs_for_quarantine and \
+               self.flakiness(name)>=self.quarantine_threshold
+
+    ###########################################################################
+    def average_time(self, name):
+    ###########################################################################
+        times = [o["time"] for o in self._outcomes.get(name,[]) if o["time"] is not None]
+        return sum(times)/len(times) if times else None
+
+    ###########################################################################
+    def save(self):
+    ###########################################################################
+        self._history_file.parent.mkdir(parents=True,exist_ok=True)
+        tmp_file = self._history_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(self._outcomes,indent=2,sort_keys=True))
+        os.replace(tmp_file,self._history_file)
+
+###############################################################################
+def partition_by_cost(names, costs, num_parts):
+###############################################################################
+    """
+    Split the names in num_parts lists with (roughly) the same total cost,
+    using a greedy longest-first assignment. The result only depends on the
+    inputs, so independent processes compute the same partition.
+
+    >>> partition_by_cost(['a','b','c','d'],{'a':3,'b':2,'c':2,'d':1},2)
+    [['a', 'd'], ['b', 'c']]
+    """
+
+    parts = [[] for _ in range(num_parts)]
+    loads = [0.0]*num_parts
+    for name in sorted(names,key=lambda n: (-costs[n],n)):
+        i = min(range(num_parts),key=lambda j: (loads[j],j))
+        parts[i].append(name)
+        loads[i] += costs[name]
+
+    return parts
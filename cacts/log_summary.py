@@ -0,0 +1,176 @@
+"""
+Utilities to extract the relevant parts of (possibly huge) ctest logs:
+compiler errors, failed tests, and cmake errors. Logs are scanned line by
+line (gzipped logs included), and only a bounded amount of lines is kept in
+memory at any time.
+"""
+
+import re
+import pathlib
+import collections
+
+from .retention import open_log
+
+# Lines that signal an error in the output of a build. Lines from the build tool
+# itself (e.g., 'make: *** [foo] Error 1') are not matched, since they only
+# repeat that something failed.
+BUILD_ERROR_REGEX = re.compile(r'(: (fatal )?error\b|: Error\b|undefined reference to|Segmentation fault)')
+
+###############################################################################
+def iter_build_errors(lines, before=5, after=10):
+###############################################################################
+    """
+    Yield (title,lines) for each compiler/linker error in a build log, with
+    some lines of context before and after it
+    """
+
+    context = collections.deque(maxlen=before)
+    current = None
+    left = 0
+    for line in lines:
+        line = line.rstrip("\n")
+        if current is not None:
+            if left>0 and not BUILD_ERROR_REGEX.search(line):
+                current[1].append(line)
+                left -= 1
+                continue
+            yield current
+            current = None
+            context.clear()
+
+        if BUILD_ERROR_REGEX.search(line):
+            current = (line.strip(), list(context) + [line])
+            left = after
+        else:
+            context.append(line)
+
+    if current is not None:
+        yield current
+
+###############################################################################
+def iter_failed_tests(lines, tail=20):
+###############################################################################
+    """
+    Yield (test_name,lines) for each test that did not pass in a LastTest log,
+    with the last lines of its output
+    """
+
+    name = None
+    output = None
+    in_output = False
+    for line in lines:
+        line = line.rstrip("\n")
+        m = re.match(r'^\d+/\d+ Test: (.+)$',line)
+        if m:
+            name = m.group(1)
+            output = collections.deque(maxlen=tail)
+            in_output = False
+        elif name is None:
+            continue
+        elif line=="Output:":
+            in_output = True
+        elif line=="<end of output>":
+            in_output = False
+        elif in_output:
+            if not line.startswith("----------"):
+                output.append(line)
+        elif line.startswith("Test Passed"):
+            name = None
+        elif line.startswith("Test ") and not line.startswith("Test time"):
+            # E.g., 'Test Failed.', or a reason for the failure
+            yield name, [line] + list(output)
+            name = None
+
+###############################################################################
+def iter_cmake_errors(lines, max_lines=50):
+###############################################################################
+    """
+    Yield (title,lines) for each 'CMake Error' block in a configure log
+    """
+
+    current = None
+    prev_empty = False
+    for line in lines:
+        line = line.rstrip("\n")
+        if current is not None:
+            # A block ends at the first non-indented line following an empty line
+            if prev_empty and line and not line[0].isspace():
+                while not current[1][-1].strip():
+                    current[1].pop()
+                yield current
+                current = None
+            elif len(current[1])<max_lines:
+                current[1].append(line)
+        prev_empty = not line.strip()
+
+        if line.startswith("CMake Error"):
+            current = (line, [line])
+
+    if current is not None:
+        while not current[1][-1].strip():
+            current[1].pop()
+        yield current
+
+###############################################################################
+def iter_tail(lines, tail=30):
+###############################################################################
+    """
+    Yield a single item with the last lines of a log
+    """
+
+    yield "last lines", list(collections.deque((l.rstrip("\n") for l in lines),maxlen=tail))
+
+EXTRACTORS = {
+    "Build"     : (iter_build_errors, "compiler/linker errors"),
+    "Test"      : (iter_failed_tests, "failed tests"),
+    "Configure" : (iter_cmake_errors, "cmake errors"),
+}
+
+###############################################################################
+def summarize_log(log_file, phase, extract_file, max_items=5, max_lines=15):
+###############################################################################
+    """
+    Scan the log of a ctest phase, write all the extracted items to
+    extract_file, and return a short summary with the first max_items items
+    (each truncated to max_lines lines). Phases without an extractor
+    (e.g., Submit) are summarized with the last lines of the log. If the folder
+    of extract_file no longer exists (e.g., the build dir was removed, and the
+    log comes from the log archive), the extract is written next to the log.
+    """
+
+    extract_file = pathlib.Path(extract_file)
+    if not extract_file.parent.exists():
+        extract_file = pathlib.Path(log_file).parent / extract_file.name
+
+    # Tails are not truncated to their first lines
+    tail = lambda log: iter_tail(log,tail=max_lines)
+    extractor, what = EXTRACTORS.get(phase,(tail,"log lines"))
+
+    num_items = 0
+    shown = []
+    with open_log(log_file) as log, \
+         open(extract_file,"w",encoding="utf-8") as out:
+        out.write(f"Extract of {log_file}\n")
+        for title, lines in extractor(log):
+            num_items += 1
+            out.write(f"\n===== {title}\n")
+            out.write("\n".join(lines) + "\n")
+            if len(shown)<max_items:
+                shown.append((title,lines))
+
+    if num_items==0 and extractor is not tail:
+        # Nothing recognizable: fall back to the end of the log
+        with open_log(log_file) as log:
+            shown = list(tail(log))
+
+    text = f"Found {num_items} {what} in {log_file}"
+    text += f" (showing the first {max_items}):\n" if num_items>max_items else ":\n"
+    for title, lines in shown:
+        text += f"  ----- {title}\n"
+        for line in lines[:max_lines]:
+            text += f"    {line}\n"
+        if len(lines)>max_lines:
+            text += f"    ... ({len(lines)-max_lines} more lines)\n"
+    text += f"Full extract in {extract_file}"
+
+    return text
@@ -7,7 +7,8 @@ import pathlib
 import socket
 import re
 
-from .utils import expect, get_available_cpu_count, expand_variables, evaluate_commands
+from .utils    import expect, get_available_cpu_count, evaluate_commands
+from .template import expand_variables
 
 ###############################################################################
 class Machine:
@@ -16,7 +17,12 @@ class Machine:
     Parent class for objects describing a machine to use for EAMxx standalone testing.
     """
 
-    def __init__ (self,name,project,machines_specs):
+    def __init__ (self,name,project,machines_specs,fields=None):
+        """
+        If fields is given (e.g., ['env_setup']), only these attributes are
+        expanded/evaluated and checked. The other ones are left as in the config.
+        """
+
         # Check inputs
         expect (isinstance(machines_specs,dict),
                 "Machine constructor expects a dict object for 'machines_specs'"
@@ -50,12 +56,13 @@ class Machine:
         self.num_run_res    = None
         self.env_setup      = None
         self.gpu_arch       = None
-        self.batch          = None
+        self.batch          = None # Options for sbatch (e.g., account, partition, time), used with --batch
         self.cxx_compiler   = None
         self.c_compiler     = None
         self.ftn_compiler   = None
         self.baselines_dir  = None
         self.valg_supp_file = None
+        self.scratch_dir    = None # Node-local storage (e.g., tmpfs or NVMe) where the build trees are placed
         self.inherits       = None
 
         # Set parameter, first using the 'default' machine (if any), then this machine's settings
@@ -76,16 +83,19 @@ class Machine:
             'project' : project,
             'machine' : self,
         }
-        expand_variables(self,objects)
+        expand_variables(self,objects,fields)
 
         # Evaluate remaining bash commands of the form $(...)
-        evaluate_commands(self)
+        evaluate_commands(self,fields=fields)
 
         # Check props are valid
-        expect (self.mach_file is None or pathlib.Path(self.mach_file).expanduser().exists(),
-                f"Invalid/non-existent machine file '{self.mach_file}'")
         expect (isinstance(self.env_setup,list),
                 f"machine->env_setup should be a list of strings (got {type(self.env_setup)} instead).\n")
+        if fields is not None:
+            return
+
+        expect (self.mach_file is None or pathlib.Path(self.mach_file).expanduser().exists(),
+                f"Invalid/non-existent machine file '{self.mach_file}'")
 
         try:
             self.num_bld_res = int(self.num_bld_res)
@@ -0,0 +1,140 @@
+"""
+Helpers for the memcheck phase: parse the results that ctest_memcheck leaves
+in the build tree, and aggregate the valgrind errors of all tests into a
+report where each defect (kind of error + stack) appears once.
+"""
+
+import re
+import zlib
+import base64
+import collections
+import xml.etree.ElementTree as ET
+
+from .ctest_data import get_tag_dir
+
+# Valgrind options used by ctest_memcheck (the suppression file is set separately)
+VALGRIND_OPTIONS = "--trace-children=yes --leak-check=full --num-callers=20"
+
+# Valgrind messages (at the start of a block) that are not errors
+NOT_ERRORS = ("Memcheck,", "Copyright", "Using Valgrind", "Command:", "Parent PID", "HEAP SUMMARY",
+              "LEAK SUMMARY", "ERROR SUMMARY", "All heap blocks", "For lists", "For counts", "Rerun with",
+              "Use --track-origins", "To see them", "Warning:")
+
+# Number of stack frames that identify a defect
+NUM_KEY_FRAMES = 8
+
+###############################################################################
+def iter_memcheck_results(build_dir):
+###############################################################################
+    """
+    Yield a dict for each test run under ctest_memcheck in the most recent ctest
+    session in build_dir, with keys 'name', 'status', 'defects' (a dict
+    defect_type->count) and 'log' (the valgrind output)
+    """
+
+    tag_dir = get_tag_dir(build_dir)
+    if tag_dir is None or not (tag_dir / "DynamicAnalysis.xml").exists():
+        return
+
+    # Only the tests with defects (or failures) get a detailed entry. The
+    # others are just listed (by full name) in TestList
+    listed = []
+    # Like Test.xml, this can be large, so parse it incrementally
+    for _, elem in ET.iterparse(str(tag_dir / "DynamicAnalysis.xml")):
+        if elem.tag=="TestList":
+            listed = [t.text for t in elem]
+        elif elem.tag=="Test" and "Status" in elem.attrib:
+            if elem.findtext("FullName") in listed:
+                listed.remove(elem.findtext("FullName"))
+            defects = {d.attrib.get("type",d.attrib.get("Type","defect")) : int(d.text or 0)
+                       for d in elem.iter("Defect")}
+            log = elem.find("Log")
+            text = ""
+            if log is not None and log.text:
+                text = log.text
+                if log.attrib.get("compression",None) is not None:
+                    text = zlib.decompress(base64.b64decode(text)).decode("utf-8",errors="replace")
+            yield {"name" : elem.findtext("Name"), "status" : elem.attrib["Status"],
+                   "defects" : defects, "log" : text}
+            elem.clear()
+
+    for full_name in listed:
+        yield {"name" : full_name.rsplit("/",1)[-1], "status" : "passed", "defects" : {}, "log" : ""}
+
+###############################################################################
+def iter_valgrind_errors(lines):
+###############################################################################
+    """
+    Yield (kind,frames) for each error in a valgrind output, where frames is
+    the list of stack frames of the error (without addresses)
+    """
+
+    kind = None
+    frames = []
+    for line in lines:
+        # ctest marks the first line of each error with its type, e.g. '<b>UMR</b> '
+        m = re.match(r'^(?:<b>\w+</b> )?==\d+==( *)(.*)$',line.rstrip("\n"))
+        if m is None:
+            continue
+        indent, text = m.groups()
+        if not text:
+            # Errors are separated by empty lines
+            if kind is not None:
+                yield kind, frames
+            kind, frames = None, []
+        elif kind is None:
+            if len(indent)==1 and not text.startswith(NOT_ERRORS):
+                kind = text
+        else:
+            f = re.match(r'^(?:at|by) 0x[0-9A-Fa-f]+: (.*)$',text)
+            if f:
+                frames.append(f.group(1))
+
+    if kind is not None:
+        yield kind, frames
+
+###############################################################################
+def defect_key(kind, frames):
+###############################################################################
+    """
+    Normalize an error, so that the same defect found by several tests (or
+    several times by the same test) gets the same key
+    """
+
+    # E.g., '40 bytes in 1 blocks are definitely lost in loss record 3 of 7' -> 'definitely lost'
+    leak = re.search(r'are (definitely|indirectly|possibly) lost',kind)
+    if leak:
+        kind = f"{leak.group(1)} lost"
+    return kind, tuple(frames[:NUM_KEY_FRAMES])
+
+###############################################################################
+def aggregate_defects(results):
+###############################################################################
+    """
+    Given the results yielded by iter_memcheck_results, return a dict
+    (kind,frames)->{"count" : N, "tests" : set of test names}
+    """
+
+    defects = collections.OrderedDict()
+    for r in results:
+        for kind, frames in iter_valgrind_errors(r["log"].splitlines()):
+            d = defects.setdefault(defect_key(kind,frames),{"count" : 0, "tests" : set()})
+            d["count"] += 1
+            d["tests"].add(r["name"])
+    return defects
+
+###############################################################################
+def format_defect_report(defects):
+###############################################################################
+    """
+    Return a text with one entry per defect, the most common ones first
+    """
+
+    text = f"Found {len(defects)} distinct memcheck defects\n"
+    for (kind, frames), d in sorted(defects.items(),key=lambda x: -x[1]["count"]):
+        tests = sorted(d["tests"])
+        text += f"\n===== {kind} ({d['count']} occurrences, in {len(tests)} tests)\n"
+        for f in frames:
+            text += f"    {f}\n"
+        text += f"  tests: {', '.join(tests[:10])}{' ...' if len(tests)>10 else ''}\n"
+    return text
@@ -1,4 +1,8 @@
+import os
+import copy
 import pathlib
+import itertools
+import collections
 import yaml
 
 from .project    import Project
@@ -6,12 +10,43 @@ from .machine    import Machine
 from .build_type import BuildType
 from .utils      import expect, check_minimum_python_version
 
-check_minimum_python_version(3, 4)
+check_minimum_python_version(3, 8)
+
+# The project/machine/build objects of a config file, after variables expansion
+# and $(...) evaluation. It can be passed to several Driver objects (see resolve_config).
+ResolvedConfig = collections.namedtuple("ResolvedConfig",["project","machine","builds","config_file"])
+
+###############################################################################
+def load_yaml(yaml_file):
+###############################################################################
+    with open(yaml_file,"r") as fd:
+        return yaml.load(fd,Loader=yaml.SafeLoader)
+
+###############################################################################
+def resolve_config(config_file=None, root_dir=None, machine_name=None, build_types=None,
+                   generate=False, local=False):
+###############################################################################
+    """
+    Parse and evaluate a config file once. The result can be reused by any number
+    of Driver objects (via their resolved_config argument), which then skip the
+    parsing. Defaults are the same as for the cacts command line.
+    """
+
+    root_dir = pathlib.Path(root_dir or os.getcwd()).expanduser().absolute()
+    config_file = pathlib.Path(config_file or root_dir / "cacts.yaml")
+    expect (config_file.exists(),
+            f"Could not find/open config file: {config_file}\n")
+
+    project = parse_project(config_file,root_dir)
+    machine = parse_machine(config_file,project,'local' if local else machine_name)
+    builds  = parse_builds(config_file,project,machine,generate,build_types)
+
+    return ResolvedConfig(project,machine,builds,config_file)
 
 ###############################################################################
 def parse_project(config_file,root_dir):
 ###############################################################################
-    content = yaml.load(open(config_file,"r"),Loader=yaml.SafeLoader)
+    content = load_yaml(config_file)
 
     expect ('project' in content.keys(),
             "Missing 'project' section in configuration file\n"
@@ -22,9 +57,9 @@ def parse_project(config_file,root_dir):
     return Project(content['project'],root_dir)
 
 ###############################################################################
-def parse_machine(config_file,project,machine_name):
+def parse_machine(config_file,project,machine_name,fields=None):
 ###############################################################################
-    content = yaml.load(open(config_file,"r"),Loader=yaml.SafeLoader)
+    content = load_yaml(config_file)
 
     expect ('machines' in content.keys(),
             "Missing 'machines' section in configuration file\n"
@@ -35,28 +70,131 @@ def parse_machine(config_file,project,machine_name):
     machs = content['machines']
     if machine_name=="local":
         local_yaml = pathlib.Path("~/.cime/cacts.yaml").expanduser()
-        local_content = yaml.load(open(local_yaml,'r'),Loader=yaml.SafeLoader)
+        local_content = load_yaml(local_yaml)
         machs.update(local_content['machines'])
         machine_name = 'local'
 
     # Build Machine
-    return Machine(machine_name,project,machs)
+    return Machine(machine_name,project,machs,fields)
+
+###############################################################################
+def merge_build_settings(spec, settings, where):
+###############################################################################
+    expect (isinstance(settings,dict),
+            f"Invalid settings for {where}: expected a dict (got {type(settings)} instead).\n")
+    for key, value in settings.items():
+        if key=='cmake_args':
+            expect (isinstance(value,dict),
+                    f"Invalid value for cmake_args in {where}: expected a dict (got {type(value)} instead).\n")
+            spec.setdefault('cmake_args',{}).update(value)
+        else:
+            spec[key] = value
+
+###############################################################################
+def expand_matrix(name, entry):
+###############################################################################
+    """
+    Return a dict build_name->specs for the build types of a matrix entry of the
+    configurations section. The 'matrix' key maps each axis to its values: either
+    a list of names, or a dict name->settings (e.g., cmake_args, merged in axis
+    order). Each combination is a build type named <name>_<value1>_<value2>...,
+    with an attribute per axis (so ${build.<axis>} can be used in the settings).
+    Optional 'exclude' and 'include' lists of {axis: value} dicts remove the
+    combinations matching all the given axes, or add combinations (with extra
+    settings, if keys other than the axes are given).
+    """
+
+    matrix = entry['matrix']
+    expect (isinstance(matrix,dict) and matrix,
+            f"Invalid matrix for configuration '{name}': expected a non-empty dict axis->values.\n")
+    axes = {}
+    for axis, values in matrix.items():
+        if isinstance(values,list):
+            values = {str(v) : {} for v in values}
+        expect (isinstance(values,dict) and values,
+                f"Invalid values for axis '{axis}' of configuration '{name}': expected a non-empty list or dict.\n")
+        axes[axis] = {str(k) : v or {} for k,v in values.items()}
+
+    base = {k : v for k,v in entry.items() if k not in ['matrix','include','exclude']}
+    matches = lambda combo, rule: all(str(rule[a])==combo[a] for a in axes if a in rule)
+
+    combos = [dict(zip(axes,values)) for values in itertools.product(*axes.values())]
+    for rule in entry.get('exclude',[]) or []:
+        expect (isinstance(rule,dict) and set(rule) <= set(axes),
+                f"Invalid exclude rule {rule} for configuration '{name}'. Keys must be axes of the matrix.\n")
+        combos = [c for c in combos if not matches(c,rule)]
+    combos = [(c,{}) for c in combos]
+
+    for rule in entry.get('include',[]) or []:
+        expect (isinstance(rule,dict) and set(axes) <= set(rule),
+                f"Invalid include rule {rule} for configuration '{name}'. All the axes of the matrix must be set.\n")
+        extra = {k : v for k,v in rule.items() if k not in axes}
+        found = [c for c,_ in combos if matches(c,rule)]
+        if found:
+            combos = [(c,e) if not matches(c,rule) else (c,dict(e,**extra)) for c,e in combos]
+        else:
+            combos.append(({a : str(rule[a]) for a in axes},extra))
+
+    specs = {}
+    for combo, extra in combos:
+        build_name = "_".join([name] + list(combo.values()))
+        spec = copy.deepcopy(base)
+        for axis, value in combo.items():
+            spec[axis] = value
+            merge_build_settings(spec,copy.deepcopy(axes[axis].get(value,{})),f"{name}.matrix.{axis}.{value}")
+        merge_build_settings(spec,copy.deepcopy(extra),f"the include rules of '{name}'")
+        specs[build_name] = spec
+
+    return specs
+
+###############################################################################
+def expand_configurations(configs):
+###############################################################################
+    """
+    Expand the matrix entries of the configurations section (see expand_matrix).
+    Only the specs are expanded: build types (with variables expansion and
+    $(...) evaluation) are only created for the selected ones.
+    Returns (specs,groups), with groups a dict matrix_name->list of build names.
+    """
+
+    specs = {}
+    groups = {}
+    for name, entry in configs.items():
+        if isinstance(entry,dict) and 'matrix' in entry:
+            expect (name!='default',
+                    "The 'default' configuration cannot have a matrix.\n")
+            expanded = expand_matrix(name,entry)
+            groups[name] = list(expanded.keys())
+        else:
+            expanded = {name : entry}
+        for build_name, spec in expanded.items():
+            expect (build_name not in specs,
+                    f"Configuration '{build_name}' is defined more than once (check the matrix entries).\n")
+            specs[build_name] = spec
+
+    return specs, groups
 
 ###############################################################################
 def parse_builds(config_file,project,machine,generate,build_types=None):
 ###############################################################################
-    content = yaml.load(open(config_file,"r"),Loader=yaml.SafeLoader)
+    content = load_yaml(config_file)
 
     expect ('configurations' in content.keys(),
             "Missing 'configurations' section in configuration file\n"
             f" - config file: {config_file}\n"
             f" - sections found: {','.join(content.keys())}\n")
 
+    configs, groups = expand_configurations(content['configurations'])
+
     # Get builds
     builds = []
     if build_types:
+        # The name of a matrix entry selects all its build types
+        names = []
         for name in build_types:
-            build = BuildType(name,project,machine,content['configurations'])
+            names += groups.get(name,[name])
+        for name in names:
+            build = BuildType(name,project,machine,configs)
             # Skip non-baselines builds when generating baselines
             if not generate or build.uses_baselines:
                 builds.append(build)
@@ -65,10 +203,17 @@ def parse_builds(config_file,project,machine,generate,build_types=None):
         for name in configs.keys():
             if name=='default':
                 continue
-            build = BuildType(name,project,machine,content['configurations'])
+            build = BuildType(name,project,machine,configs)
 
             # Skip non-baselines builds when generating baselines
             if (not generate or build.uses_baselines) and build.on_by_default:
                 builds.append(build)
 
+    longnames = [b.longname for b in builds]
+    for longname in set(longnames):
+        expect (longnames.count(longname)==1,
+                f"Several build types have longname '{longname}': "
+                f"{','.join(b.name for b in builds if b.longname==longname)}.\n"
+                " - for matrix configurations, use the axes in the longname, e.g. ${build.name} or ${build.<axis>}\n")
+
     return builds
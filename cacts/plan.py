@@ -0,0 +1,81 @@
+"""
+Utilities to store a resolved CACTS run in a json plan file, and to load it
+back. A plan holds the driver options and the project/machine/build objects
+after variables expansion and $(...) evaluation, so that executing it does
+not require parsing the config file again.
+"""
+
+import json
+import pathlib
+
+from .project    import Project
+from .machine    import Machine
+from .build_type import BuildType
+from .utils      import expect, sha256_file
+
+PLAN_VERSION = 1
+
+###############################################################################
+def object_state(obj):
+###############################################################################
+    """
+    Return the attributes of a config object, as json-friendly values
+    """
+
+    return json.loads(json.dumps(vars(obj),default=str))
+
+###############################################################################
+def restore_object(cls, state):
+###############################################################################
+    """
+    Create an object of type cls with the given attributes, bypassing its
+    constructor (which would expand variables and evaluate commands again)
+    """
+
+    obj = cls.__new__(cls)
+    obj.__dict__.update(state)
+    return obj
+
+###############################################################################
+def write_plan(plan_file, options, config_file, project, machine, builds, actions):
+###############################################################################
+    plan = {
+        "version"       : PLAN_VERSION,
+        "config_file"   : str(config_file),
+        "config_sha256" : sha256_file(config_file),
+        "options"       : options,
+        "project"       : object_state(project),
+        "machine"       : object_state(machine),
+        "builds"        : [object_state(b) for b in builds],
+        "actions"       : actions,
+    }
+
+    plan_file = pathlib.Path(plan_file)
+    plan_file.parent.mkdir(parents=True,exist_ok=True)
+    plan_file.write_text(json.dumps(plan,indent=2))
+
+###############################################################################
+def read_plan(plan_file):
+###############################################################################
+    """
+    Load a plan file. Returns the plan dict, with the project, machine and
+    builds entries turned back into Project, Machine and BuildType objects
+    """
+
+    plan_file = pathlib.Path(plan_file)
+    expect (plan_file.exists(), f"Could not find/open plan file: {plan_file}\n")
+
+    plan = json.loads(plan_file.read_text())
+    expect (plan.get("version",None)==PLAN_VERSION,
+            f"Unsupported plan version {plan.get('version',None)} (expected {PLAN_VERSION}).\n"
+            f"  - plan file: {plan_file}\n")
+
+    config_file = pathlib.Path(plan["config_file"])
+    if not config_file.exists() or sha256_file(config_file)!=plan["config_sha256"]:
+        print(f"WARNING: config file {config_file} changed since the plan was generated.")
+
+    plan["project"] = restore_object(Project,plan["project"])
+    plan["machine"] = restore_object(Machine,plan["machine"])
+    plan["builds"]  = [restore_object(BuildType,b) for b in plan["builds"]]
+
+    return plan
@@ -20,6 +20,7 @@ class Project:
     baselines_summary_file: Optional[str] = None
     cmake_vars_names: Dict[str, any] = field(default_factory=dict)
     cdash: Dict[str, any] = field(default_factory=dict)
+    test_labels_by_path: Dict[str, any] = field(default_factory=dict)
 
     # To check inside init
     valid_keys = {
@@ -28,7 +29,8 @@ class Project:
             'baseline_cmp_label',
             'baseline_summary_file',
             'cmake_settings',
-            'cdash'
+            'cdash',
+            'test_labels_by_path'
     }
 
     def __init__ (self,project_specs,root_dir):
@@ -73,6 +75,10 @@ class Project:
 
         self.cdash = project_specs.get('cdash',{})
 
+        # Optional map from a glob pattern (relative to root_dir) to a list of test labels.
+        # With --changed-since, tests with these labels are run if a matching file changed.
+        self.test_labels_by_path = project_specs.get('test_labels_by_path',{})
+
     def __post_init__  (self):
         # Evaluate bash commands of the form $(...)
         evaluate_commands(self)
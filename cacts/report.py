@@ -0,0 +1,195 @@
+"""
+Per-test reports in JUnit XML and json formats, for CI systems (GitLab,
+Jenkins). The Test.xml of each build type is parsed incrementally, and
+test outputs are truncated, so that memory use does not depend on the
+size of the test outputs.
+
+Each build type gets its own report fragments in its build dir, written
+right after it runs. The fragments of all build types are then combined
+(again, streaming them) into unified reports in the work dir.
+"""
+
+import os
+import re
+import json
+import zlib
+import base64
+import shutil
+import tempfile
+import pathlib
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+from .ctest_data import get_tag_dir
+
+JUNIT_FRAGMENT = "cacts_junit.xml"
+JSON_FRAGMENT  = "cacts_results.jsonl"
+
+# Only the end of the output of failed tests is kept
+MAX_OUTPUT_CHARS = 10000
+
+###############################################################################
+def truncate_output(text, max_chars=MAX_OUTPUT_CHARS):
+###############################################################################
+    if len(text)<=max_chars:
+        return text
+    return f"[... {len(text)-max_chars} characters truncated ...]\n" + text[-max_chars:]
+
+###############################################################################
+def iter_test_details(build_dir, max_chars=MAX_OUTPUT_CHARS):
+###############################################################################
+    """
+    Yield a dict for each test in the most recent ctest session in build_dir,
+    with keys 'name', 'status', 'time', 'labels', 'exit_value', 'completion',
+    'processors', 'resources' (the resource groups assigned by ctest), and
+    'output' (truncated, and only for tests that did not pass)
+    """
+
+    tag_dir = get_tag_dir(build_dir)
+    if tag_dir is None or not (tag_dir / "Test.xml").exists():
+        return
+
+    for _, elem in ET.iterparse(str(tag_dir / "Test.xml")):
+        if elem.tag!="Test" or "Status" not in elem.attrib:
+            continue
+
+        measurements = {m.attrib.get("name") : m.findtext("Value") for m in elem.iter("NamedMeasurement")}
+        time = measurements.get("Execution Time",None)
+        procs = measurements.get("Processors",None)
+
+        # E.g., CTEST_RESOURCE_GROUP_0_DEVICES=id:3,slots:1
+        resources = []
+        for line in (measurements.get("Environment",None) or "").splitlines():
+            m = re.match(r'^CTEST_RESOURCE_GROUP_(\d+)_(\w+)=(.*)$',line)
+            if m:
+                resources.append(f"group{m.group(1)}:{m.group(2).lower()}:{m.group(3)}")
+
+        output = None
+        if elem.attrib["Status"]!="passed":
+            value = elem.find("Results/Measurement/Value")
+            output = (value.text or "") if value is not None else ""
+            if value is not None and value.attrib.get("compression",None) is not None:
+                output = zlib.decompress(base64.b64decode(output)).decode("utf-8",errors="replace")
+            output = truncate_output(output,max_chars)
+
+        yield {
+            "name"       : elem.findtext("Name"),
+            "status"     : elem.attrib["Status"],
+            "time"       : float(time) if time else None,
+            "labels"     : [l.text for l in elem.iter("Label")],
+            "exit_value" : measurements.get("Exit Value",None),
+            "completion" : measurements.get("Completion Status",None),
+            "processors" : int(float(procs)) if procs else None,
+            "resources"  : resources,
+            "output"     : output,
+        }
+        elem.clear()
+
+###############################################################################
+def write_junit_testcase(fd, suite, test):
+###############################################################################
+    fd.write(f'    <testcase classname={quoteattr(suite)} name={quoteattr(test["name"])} '
+             f'time="{test["time"] or 0:.3f}">\n')
+    if test["status"]=="failed":
+        message = test.get("message",None) or f"exit value {test['exit_value']} ({test['completion']})"
+        fd.write(f'      <failure message={quoteattr(message)}>{escape(test["output"] or "")}</failure>\n')
+    elif test["status"]!="passed":
+        fd.write(f'      <skipped message={quoteattr(test["status"])}/>\n')
+    if test["processors"] is not None or test["resources"]:
+        fd.write('      <properties>\n')
+        if test["processors"] is not None:
+            fd.write(f'        <property name="processors" value="{test["processors"]}"/>\n')
+        for r in test["resources"]:
+            fd.write(f'        <property name="resource" value={quoteattr(r)}/>\n')
+        fd.write('      </properties>\n')
+    fd.write('    </testcase>\n')
+
+###############################################################################
+def write_build_report(build_dir, suite, failed_phase=None):
+###############################################################################
+    """
+    Write the JUnit (one testsuite element) and json lines (a summary line,
+    then one line per test) report fragments of a build type in its build
+    dir. If the build type failed outside of the test phase, failed_phase
+    (e.g., 'build', or 'setup' for failures before configuring) is reported
+    as a failed test case. Returns the summary.
+    """
+
+    build_dir = pathlib.Path(build_dir)
+    summary = {"build" : suite, "tests" : 0, "failures" : 0, "skipped" : 0, "time" : 0.0}
+
+    # The testsuite element needs the counts first, so the test cases go to a temp file
+    with tempfile.TemporaryFile("w+",encoding="utf-8") as cases, \
+         open(build_dir / (JSON_FRAGMENT+".tmp"),"w",encoding="utf-8") as tests_out:
+        def add(test):
+            summary["tests"] += 1
+            summary["failures"] += test["status"]=="failed"
+            summary["skipped"] += test["status"] not in ["passed","failed"]
+            summary["time"] += test["time"] or 0
+            write_junit_testcase(cases,suite,test)
+            tests_out.write(json.dumps(test) + "\n")
+
+        for test in iter_test_details(build_dir):
+            add(test)
+
+        if failed_phase in ["setup","configure","build","memcheck"]:
+            add({"name" : failed_phase, "status" : "failed", "time" : None, "labels" : [],
+                 "exit_value" : None, "completion" : None, "processors" : None, "resources" : [],
+                 "message" : f"{suite} failed at {failed_phase} time", "output" : None})
+
+        with open(build_dir / JUNIT_FRAGMENT,"w",encoding="utf-8") as fd:
+            fd.write(f'  <testsuite name={quoteattr(suite)} tests="{summary["tests"]}" '
+                     f'failures="{summary["failures"]}" skipped="{summary["skipped"]}" '
+                     f'time="{summary["time"]:.3f}">\n')
+            cases.seek(0)
+            shutil.copyfileobj(cases,fd)
+            fd.write('  </testsuite>\n')
+
+    with open(build_dir / JSON_FRAGMENT,"w",encoding="utf-8") as fd, \
+         open(build_dir / (JSON_FRAGMENT+".tmp"),"r",encoding="utf-8") as tests_in:
+        fd.write(json.dumps(summary) + "\n")
+        shutil.copyfileobj(tests_in,fd)
+    os.remove(build_dir / (JSON_FRAGMENT+".tmp"))
+
+    return summary
+
+###############################################################################
+def write_unified_report(build_dirs, junit_file, json_file):
+###############################################################################
+    """
+    Combine the report fragments of the given build dirs (the ones that have
+    them) into a single JUnit file and a single json file. Returns the totals.
+    """
+
+    build_dirs = [pathlib.Path(d) for d in build_dirs if (pathlib.Path(d) / JSON_FRAGMENT).exists()]
+
+    totals = {"tests" : 0, "failures" : 0, "skipped" : 0, "time" : 0.0}
+    for d in build_dirs:
+        with open(d / JSON_FRAGMENT,"r",encoding="utf-8") as fd:
+            summary = json.loads(fd.readline())
+        for k in totals:
+            totals[k] += summary[k]
+
+    with open(junit_file,"w",encoding="utf-8") as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write(f'<testsuites name="cacts" tests="{totals["tests"]}" failures="{totals["failures"]}" '
+                  f'skipped="{totals["skipped"]}" time="{totals["time"]:.3f}">\n')
+        for d in build_dirs:
+            with open(d / JUNIT_FRAGMENT,"r",encoding="utf-8") as fd:
+                shutil.copyfileobj(fd,out)
+        out.write('</testsuites>\n')
+
+    with open(json_file,"w",encoding="utf-8") as out:
+        out.write('{\n"totals" : ' + json.dumps(totals) + ',\n"builds" : [\n')
+        for i, d in enumerate(build_dirs):
+            with open(d / JSON_FRAGMENT,"r",encoding="utf-8") as fd:
+                summary = json.loads(fd.readline())
+                out.write(("," if i>0 else "") + json.dumps(summary)[:-1] + ', "tests_details" : [\n')
+                first = True
+                for line in fd:
+                    out.write(("," if not first else "") + line)
+                    first = False
+                out.write(']}\n')
+        out.write(']\n}\n')
+
+    return totals
@@ -0,0 +1,66 @@
+"""
+Structured results of a CACTS run, returned by Driver.run
+"""
+
+###############################################################################
+class BuildResult(object):
+###############################################################################
+    """
+    The outcome of one build type:
+      - name: the build type longname
+      - status: 'passed', 'failed', 'cancelled' or 'cached' (passed in a previous run, see --build-cache)
+      - failed_phase: 'setup' (before configuring), 'configure', 'build', 'test' or 'memcheck' (None if passed)
+      - phases: the ctest phases that were requested
+      - phase_times: dict phase->seconds, for the phases that ran
+      - failed_tests: names of the tests that failed
+      - build_dir: the build dir
+      - logs: dict name->path of the logs and reports in the build dir
+    """
+
+    def __init__(self, name, status, failed_phase=None, phases=None, phase_times=None,
+                 failed_tests=None, build_dir=None, logs=None):
+        self.name         = name
+        self.status       = status
+        self.failed_phase = failed_phase
+        self.phases       = phases or []
+        self.phase_times  = phase_times or {}
+        self.failed_tests = failed_tests or []
+        self.build_dir    = build_dir
+        self.logs         = logs or {}
+
+    @property
+    def success(self):
+        return self.status in ["passed","cached"]
+
+    def to_dict(self):
+        d = dict(vars(self))
+        d["build_dir"] = str(self.build_dir) if self.build_dir else None
+        d["logs"] = {k : str(v) for k,v in self.logs.items()}
+        return d
+
+    def __repr__(self):
+        return f"BuildResult({self.name}: {self.status})"
+
+###############################################################################
+class RunResult(object):
+###############################################################################
+    """
+    The outcome of a run: a dict build_longname->BuildResult. It evaluates to
+    True if all the build types passed, so it can be used as a plain status.
+    """
+
+    def __init__(self, builds=None):
+        self.builds = builds or {}
+
+    @property
+    def success(self):
+        return all(b.success for b in self.builds.values())
+
+    def __bool__(self):
+        return self.success
+
+    def to_dict(self):
+        return {"success" : self.success, "builds" : {n : b.to_dict() for n,b in self.builds.items()}}
+
+    def __repr__(self):
+        return f"RunResult({'PASS' if self.success else 'FAIL'}: {list(self.builds.values())})"
@@ -0,0 +1,193 @@
+"""
+Retention of the logs and results of past runs. After a run, the logs and
+ctest results of each build type are stream-compressed (gzip) into a per-run
+archive folder, with an index. Old runs are pruned to fit an age/size budget.
+Large logs in the build dir are compressed in place; open_log reads both
+compressed and plain logs.
+"""
+
+import os
+import gzip
+import json
+import shutil
+import fnmatch
+import pathlib
+import datetime
+import concurrent.futures
+
+from .trash import move_to_trash, empty_trash_in_background
+
+# What to archive from a build dir (relative paths)
+ARCHIVE_PATTERNS = ["Testing/Temporary/Last*", "Testing/*/*.xml", "cacts_*"]
+
+# Logs that are compressed in place in the build dir, if large enough.
+# The lists of failed tests are left alone, since ctest reads them back.
+COMPRESS_PATTERNS = ["Testing/Temporary/Last*.log", "cacts_output.log"]
+NO_COMPRESS_PATTERNS = ["Testing/Temporary/LastTestsFailed*"]
+
+INDEX_FILE = "index.json"
+
+###############################################################################
+def open_log(path):
+###############################################################################
+    """
+    Open a (possibly gzipped) text log for reading
+    """
+
+    path = pathlib.Path(path)
+    if path.suffix==".gz":
+        return gzip.open(path,"rt",encoding="utf-8",errors="replace")
+    return open(path,"r",encoding="utf-8",errors="replace")
+
+###############################################################################
+def compress_file(src, dst):
+###############################################################################
+    """
+    Gzip src into dst, in chunks. Returns the size of dst.
+    """
+
+    with open(src,"rb") as fin, gzip.open(dst,"wb",compresslevel=6) as fout:
+        shutil.copyfileobj(fin,fout,2**20)
+    return os.path.getsize(dst)
+
+###############################################################################
+def match_any(rel_path, patterns):
+###############################################################################
+    return any(fnmatch.fnmatch(rel_path,p) for p in patterns)
+
+###############################################################################
+def compress_logs_in_place(build_dir, min_size=2**20):
+###############################################################################
+    """
+    Replace the large logs of build_dir with a gzipped copy (X -> X.gz)
+    """
+
+    build_dir = pathlib.Path(build_dir)
+    for pattern in COMPRESS_PATTERNS:
+        for f in build_dir.glob(pattern):
+            rel = str(f.relative_to(build_dir))
+            if match_any(rel,NO_COMPRESS_PATTERNS) or f.is_symlink() or f.stat().st_size<min_size:
+                continue
+            compress_file(f,f.with_name(f.name+".gz"))
+            f.unlink()
+
+###############################################################################
+class LogArchive(object):
+###############################################################################
+    """
+    The archived runs, in archive_dir/<build dir name>/<date>. Each run folder
+    holds the gzipped files (with their relative path in the build dir, plus
+    '.gz'), and an index with the run info and the original/stored sizes.
+    """
+
+    def __init__(self, archive_dir):
+        self._archive_dir = pathlib.Path(archive_dir)
+
+    ###########################################################################
+    def add_run(self, build_dir, info, max_workers=4):
+    ###########################################################################
+        """
+        Archive the logs and results in build_dir. info is a dict stored in the
+        index (e.g., build name, git sha, status). Returns the run folder.
+        """
+
+        build_dir = pathlib.Path(build_dir)
+        date = datetime.datetime.now()
+        run_dir = self._archive_dir / build_dir.name / date.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while run_dir.exists():
+            run_dir = run_dir.with_name(f"{date.strftime('%Y%m%d-%H%M%S')}.{suffix}")
+            suffix += 1
+
+        files = set()
+        for pattern in ARCHIVE_PATTERNS:
+            files.update(f for f in build_dir.glob(pattern) if f.is_file())
+
+        def archive(src):
+            rel = str(src.relative_to(build_dir))
+            if src.suffix==".gz":
+                dst = run_dir / rel
+                dst.parent.mkdir(parents=True,exist_ok=True)
+                shutil.copyfile(src,dst)
+                return rel[:-3], {"size" : None, "stored" : dst.stat().st_size}
+            dst = run_dir / (rel+".gz")
+            dst.parent.mkdir(parents=True,exist_ok=True)
+            return rel, {"size" : src.stat().st_size, "stored" : compress_file(src,dst)}
+
+        run_dir.mkdir(parents=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            entries = dict(executor.map(archive,sorted(files)))
+
+        index = dict(info)
+        index.update(date=date.isoformat(timespec="seconds"),build_dir=str(build_dir),files=entries)
+        (run_dir / INDEX_FILE).write_text(json.dumps(index,indent=2,sort_keys=True))
+
+        return run_dir
+
+    ###########################################################################
+    def get_runs(self, build_dir_name=None):
+    ###########################################################################
+        """
+        Return the list of (run_dir,index) of the archived runs (of one build
+        dir, or of all), from the oldest to the newest
+        """
+
+        pattern = f"{build_dir_name or '*'}/*/{INDEX_FILE}"
+        runs = []
+        for f in self._archive_dir.glob(pattern):
+            try:
+                runs.append((f.parent,json.loads(f.read_text())))
+            except (OSError,ValueError):
+                # Being written, or pruned, by another process
+                continue
+        return sorted(runs,key=lambda r: (r[1]["date"],r[0].name))
+
+    ###########################################################################
+    def find_file(self, build_dir_name, pattern):
+    ###########################################################################
+        """
+        Return the archived copy of the last file (by name) matching pattern
+        (relative to the build dir) in the newest run of build_dir_name, or None
+        """
+
+        for run_dir, index in reversed(self.get_runs(build_dir_name)):
+            found = sorted(rel for rel in index["files"] if fnmatch.fnmatch(rel,pattern))
+            if found:
+                return run_dir / (found[-1]+".gz")
+        return None
+
+    ###########################################################################
+    def prune(self, trash_dir, max_age=None, max_size=None):
+    ###########################################################################
+        """
+        Remove the runs older than max_age days, and then the oldest runs, until
+        the archive takes at most max_size GB. The newest run of each build dir
+        is always kept. Returns the removed run folders.
+        """
+
+        runs = self.get_runs()
+        newest = {}
+        for run_dir, _ in runs:
+            newest[run_dir.parent.name] = run_dir
+        candidates = [(r,i) for r,i in runs if newest[r.parent.name]!=r]
+
+        removed = []
+        if max_age is not None:
+            now = datetime.datetime.now()
+            while candidates and now-datetime.datetime.fromisoformat(candidates[0][1]["date"]) > \
+                  datetime.timedelta(days=max_age):
+                removed.append(candidates.pop(0)[0])
+
+        if max_size is not None:
+            stored = lambda index: sum(e["stored"] for e in index["files"].values())
+            total = sum(stored(i) for r,i in runs if r not in removed)
+            while candidates and total>max_size*2**30:
+                run_dir, index = candidates.pop(0)
+                total -= stored(index)
+                removed.append(run_dir)
+
+        for run_dir in removed:
+            move_to_trash(run_dir,trash_dir)
+        empty_trash_in_background(trash_dir)
+
+        return removed
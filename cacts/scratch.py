@@ -0,0 +1,160 @@
+"""
+Utilities to build in node-local scratch storage. The build tree lives in the
+scratch dir, and the work dir holds a symlink to it while the build runs.
+Once done, the results (logs, Testing folder, scripts) are copied back to a
+regular folder in the work dir (a stub, with no build tree) in the background,
+and the scratch tree is removed.
+"""
+
+import os
+import json
+import shutil
+import socket
+import hashlib
+import pathlib
+import threading
+import concurrent.futures
+
+from .trash import move_to_trash
+
+# What to copy back from the scratch tree. The build tree itself (including the
+# cmake cache, which points to the scratch dir) is not usable once synced back.
+SYNC_ITEMS = ["Testing", "ctest_resource_file.json", "ctest_*.cmake", "cacts_*"]
+
+# Written in the stub that replaces the build dir once the results are synced back
+STUB_FILE = "cacts_scratch.json"
+
+# Space assumed to be needed by a build tree that was never built in scratch
+DEFAULT_TREE_SIZE = 10*2**30
+
+# The syncs started by this process (see sync_in_background)
+PENDING_SYNCS = []
+
+###############################################################################
+def get_scratch_root(scratch_dir, work_dir):
+###############################################################################
+    """
+    Return the folder inside scratch_dir that holds the build trees of work_dir.
+    Different work dirs get different folders, so they do not clash.
+    """
+
+    key = hashlib.sha256(str(work_dir).encode()).hexdigest()[:12]
+    return pathlib.Path(scratch_dir).expanduser() / f"cacts-{key}"
+
+###############################################################################
+def get_scratch_trash(scratch_dir):
+###############################################################################
+    """
+    Return the trash folder for the scratch trees (see trash.py)
+    """
+
+    return pathlib.Path(scratch_dir).expanduser() / ".cacts-trash"
+
+###############################################################################
+def remove_dir(path):
+###############################################################################
+    """
+    Remove a folder, or a symlink (possibly dangling) to a folder
+    """
+
+    path = pathlib.Path(path)
+    if path.is_symlink():
+        path.unlink()
+    elif path.exists():
+        shutil.rmtree(path)
+
+###############################################################################
+def is_stub(build_dir):
+###############################################################################
+    """
+    Return True if build_dir only holds the results synced back from a scratch tree
+    """
+
+    return (pathlib.Path(build_dir) / STUB_FILE).exists()
+
+###############################################################################
+def has_room(scratch_dir, needed):
+###############################################################################
+    """
+    Check that scratch_dir has at least needed bytes free (plus a 10% margin).
+    Returns (ok,free_bytes).
+    """
+
+    pathlib.Path(scratch_dir).mkdir(parents=True,exist_ok=True)
+    free = shutil.disk_usage(scratch_dir).free
+    return free>=1.1*needed, free
+
+###############################################################################
+def setup_scratch_build_dir(build_dir, scratch_build_dir, trash_dir):
+###############################################################################
+    """
+    Create an empty build tree in scratch, and point build_dir to it. A tree
+    left behind by an interrupted run is moved to trash_dir.
+    """
+
+    move_to_trash(scratch_build_dir,trash_dir)
+    remove_dir(build_dir)
+    scratch_build_dir.mkdir(parents=True)
+    build_dir.symlink_to(scratch_build_dir,target_is_directory=True)
+
+###############################################################################
+def sync_back(build_dir, extra_items=None, max_workers=4):
+###############################################################################
+    """
+    Replace the build_dir symlink with a regular folder, holding a copy of
+    the results in the scratch tree. The items are copied concurrently.
+    Returns the scratch tree, which the caller can then remove.
+    """
+
+    build_dir = pathlib.Path(build_dir)
+    scratch_build_dir = pathlib.Path(os.readlink(build_dir))
+    tmp_dir = build_dir.with_name(f".{build_dir.name}.sync")
+    remove_dir(tmp_dir)
+    tmp_dir.mkdir()
+
+    items = set()
+    for pattern in SYNC_ITEMS + (extra_items or []):
+        items.update(scratch_build_dir.glob(pattern))
+
+    def copy(src):
+        dst = tmp_dir / src.relative_to(scratch_build_dir)
+        dst.parent.mkdir(parents=True,exist_ok=True)
+        if src.is_dir():
+            shutil.copytree(src,dst,symlinks=True)
+        else:
+            shutil.copy2(src,dst)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for f in [executor.submit(copy,i) for i in items]:
+            f.result()
+
+    (tmp_dir / STUB_FILE).write_text(json.dumps({
+        "host"      : socket.gethostname(),
+        "build_dir" : str(scratch_build_dir),
+    }, indent=2))
+
+    build_dir.unlink()
+    tmp_dir.rename(build_dir)
+
+    return scratch_build_dir
+
+###############################################################################
+def sync_in_background(func, *args):
+###############################################################################
+    """
+    Run func(*args) (e.g., a sync_back followed by the removal of the scratch
+    tree) in a background thread, so that this process can move on. The thread
+    is not a daemon, so the process does not exit before it completes (this
+    includes the workers of a ProcessPoolExecutor), but wait_for_syncs must be
+    called before using the results in the same process.
+    """
+
+    thread = threading.Thread(target=func,args=args)
+    thread.start()
+    PENDING_SYNCS.append(thread)
+
+###############################################################################
+def wait_for_syncs():
+###############################################################################
+    while PENDING_SYNCS:
+        PENDING_SYNCS.pop().join()
@@ -0,0 +1,273 @@
+"""
+Expansion of the ${obj.attr...} expressions in the config objects (project,
+machine, build). Each expression is parsed once (with the python ast module)
+and checked against a small whitelist of operations, then evaluated by a tiny
+interpreter (no eval). The attributes referenced by the expressions form a
+dependency graph, which is resolved depth first, with memoization, so the
+result does not depend on the order of the attributes. Cycles are reported.
+"""
+
+import re
+import ast
+import operator
+import functools
+
+from .utils import expect
+
+# Same delimiters as before: ${obj.attr<python expression tail>}
+TEMPLATE_PATTERN = re.compile(r'\$\{(\w+\.\w+.*?)\}')
+
+BINARY_OPS = {
+    ast.Add : operator.add, ast.Sub : operator.sub, ast.Mult : operator.mul,
+    ast.Div : operator.truediv, ast.FloorDiv : operator.floordiv, ast.Mod : operator.mod,
+}
+UNARY_OPS = {ast.USub : operator.neg, ast.UAdd : operator.pos, ast.Not : operator.not_}
+COMPARE_OPS = {
+    ast.Eq : operator.eq, ast.NotEq : operator.ne, ast.Lt : operator.lt, ast.LtE : operator.le,
+    ast.Gt : operator.gt, ast.GtE : operator.ge, ast.In : lambda a,b: a in b, ast.NotIn : lambda a,b: a not in b,
+    ast.Is : operator.is_, ast.IsNot : operator.is_not,
+}
+FUNCTIONS = {f.__name__ : f for f in [str, int, float, bool, len, min, max, abs, round, sorted]}
+# Python<3.9 wraps subscripts in an Index node
+INDEX_NODES = (ast.Index,) if hasattr(ast,"Index") else ()
+# str.format is not allowed, since its fields can access any attribute (e.g., '{0.__class__}')
+METHODS = {
+    'upper', 'lower', 'capitalize', 'title', 'strip', 'lstrip', 'rstrip', 'replace', 'split',
+    'rsplit', 'join', 'startswith', 'endswith', 'zfill', 'count', 'find',
+    'get', 'keys', 'values', 'items',
+}
+
+###############################################################################
+class Template(object):
+###############################################################################
+    """
+    A parsed string: a list of literal strings and expressions (ast nodes),
+    and the (obj,attr) pairs the expressions reference
+    """
+
+    def __init__(self, text):
+        self.text  = text
+        self.parts = []
+        self.refs  = set()
+
+        pos = 0
+        for m in TEMPLATE_PATTERN.finditer(text):
+            self.parts.append(text[pos:m.start()])
+            self.parts.append(parse_expression(m.group(1),text))
+            self.refs.update(get_references(self.parts[-1]))
+            pos = m.end()
+        self.parts.append(text[pos:])
+
+    def is_constant(self):
+        return len(self.parts)==1
+
+###############################################################################
+@functools.lru_cache(maxsize=None)
+def compile_template(text):
+###############################################################################
+    return Template(text)
+
+###############################################################################
+def parse_expression(source, text):
+###############################################################################
+    """
+    Parse the expression, and check that it only uses whitelisted operations
+    """
+
+    try:
+        tree = ast.parse(source,mode="eval").body
+    except SyntaxError:
+        expect (False,
+                f"Invalid expression '${{{source}}}' in string '{text}'\n")
+
+    allowed = (ast.Name, ast.Attribute, ast.Constant, ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp,
+               ast.IfExp, ast.Subscript, ast.Slice, ast.Call, ast.List, ast.Tuple, ast.Load,
+               ast.And, ast.Or, *BINARY_OPS, *UNARY_OPS, *COMPARE_OPS, *INDEX_NODES)
+    for node in ast.walk(tree):
+        expect (isinstance(node,allowed),
+                f"Cannot evaluate expression '${{{source}}}': {type(node).__name__} is not allowed.\n")
+        if isinstance(node,ast.Attribute):
+            expect (not node.attr.startswith("_"),
+                    f"Cannot evaluate expression '${{{source}}}': private attributes are not allowed.\n")
+        if isinstance(node,ast.Call):
+            expect (not node.keywords,
+                    f"Cannot evaluate expression '${{{source}}}': keyword arguments are not allowed.\n")
+            # Methods of the config objects (e.g., machine.uses_gpu()) can be called without arguments
+            expect ((isinstance(node.func,ast.Name) and node.func.id in FUNCTIONS) or
+                    (isinstance(node.func,ast.Attribute) and
+                     (node.func.attr in METHODS or (isinstance(node.func.value,ast.Name) and not node.args))),
+                    f"Cannot evaluate expression '${{{source}}}': only calls to {', '.join(sorted(FUNCTIONS))}, "
+                    f"to {', '.join(sorted(METHODS))}, and to the methods of the config objects "
+                    "(without arguments) are allowed.\n")
+
+    return tree
+
+###############################################################################
+def get_references(tree):
+###############################################################################
+    """
+    Return the (obj,attr) pairs referenced in an expression
+    """
+
+    return {(node.value.id,node.attr) for node in ast.walk(tree)
+            if isinstance(node,ast.Attribute) and isinstance(node.value,ast.Name)}
+
+###############################################################################
+def iter_strings(value):
+###############################################################################
+    if isinstance(value,str):
+        yield value
+    elif isinstance(value,dict):
+        for v in value.values():
+            yield from iter_strings(v)
+    elif isinstance(value,list):
+        for v in value:
+            yield from iter_strings(v)
+
+###############################################################################
+class Resolver(object):
+###############################################################################
+    """
+    Resolve the attributes of a set of named objects (e.g., 'project', 'machine',
+    'build'), expanding their ${...} expressions. An attribute is resolved after
+    the ones it depends on, and only once.
+    """
+
+    def __init__(self, objects):
+        self._objects  = objects
+        self._resolved = {}
+        self._stack    = []
+
+    ###########################################################################
+    def resolve(self, obj_name, att_name):
+    ###########################################################################
+        key = (obj_name,att_name)
+        if key in self._resolved:
+            return self._resolved[key]
+
+        expect (obj_name in self._objects,
+                f"Invalid configuration ${{{obj_name}.{att_name}}}. Must be ${{obj.attr}}, "
+                f"with obj in {list(self._objects.keys())}\n")
+        obj = self._objects[obj_name]
+        expect (hasattr(obj,att_name),
+                f"{obj_name} has no attribute '{att_name}'\n"
+                f"  - existing attributes: {sorted(a for a in dir(obj) if not a.startswith('_'))}\n")
+        if key in self._stack:
+            cycle = self._stack[self._stack.index(key):] + [key]
+            expect (False,
+                    f"Circular reference in the config: {' -> '.join(f'{o}.{a}' for o,a in cycle)}\n")
+
+        value = getattr(obj,att_name)
+        self._stack.append(key)
+        try:
+            # Resolve the dependencies first
+            for text in iter_strings(value):
+                for ref in sorted(compile_template(text).refs):
+                    if ref[0] in self._objects:
+                        self.resolve(*ref)
+            result = self.expand(value)
+        finally:
+            self._stack.pop()
+
+        self._resolved[key] = result
+        return result
+
+    ###########################################################################
+    def expand(self, value):
+    ###########################################################################
+        """
+        Return a copy of value with the expressions in its strings expanded.
+        The objects themselves are not modified.
+        """
+        if isinstance(value,str):
+            template = compile_template(value)
+            if template.is_constant():
+                return value
+            return "".join(p if isinstance(p,str) else str(self.evaluate(p,template.text))
+                           for p in template.parts)
+        elif isinstance(value,dict):
+            return {k : self.expand(v) for k,v in value.items()}
+        elif isinstance(value,list):
+            return [self.expand(v) for v in value]
+        return value
+
+    ###########################################################################
+    def evaluate(self, node, text):
+    ###########################################################################
+        ev = lambda n: self.evaluate(n,text)
+        try:
+            if isinstance(node,ast.Attribute) and isinstance(node.value,ast.Name):
+                return self.resolve(node.value.id,node.attr)
+            elif isinstance(node,ast.Attribute):
+                return getattr(ev(node.value),node.attr)
+            elif isinstance(node,ast.Name):
+                expect (node.id in FUNCTIONS,
+                        f"Invalid name '{node.id}' in string '{text}'. Use ${{obj.attr}}, "
+                        f"with obj in {list(self._objects.keys())}\n")
+                return FUNCTIONS[node.id]
+            elif isinstance(node,ast.Constant):
+                return node.value
+            elif isinstance(node,ast.BinOp):
+                return BINARY_OPS[type(node.op)](ev(node.left),ev(node.right))
+            elif isinstance(node,ast.UnaryOp):
+                return UNARY_OPS[type(node.op)](ev(node.operand))
+            elif isinstance(node,ast.Compare):
+                left = ev(node.left)
+                for op, right in zip(node.ops,node.comparators):
+                    right = ev(right)
+                    if not COMPARE_OPS[type(op)](left,right):
+                        return False
+                    left = right
+                return True
+            elif isinstance(node,ast.BoolOp):
+                result = None
+                for v in node.values:
+                    result = ev(v)
+                    if isinstance(node.op,ast.And) != bool(result):
+                        break
+                return result
+            elif isinstance(node,ast.IfExp):
+                return ev(node.body) if ev(node.test) else ev(node.orelse)
+            elif isinstance(node,ast.Subscript):
+                return ev(node.value)[ev(node.slice)]
+            elif isinstance(node,INDEX_NODES):
+                return ev(node.value)
+            elif isinstance(node,ast.Slice):
+                return slice(*(ev(n) if n is not None else None for n in [node.lower,node.upper,node.step]))
+            elif isinstance(node,(ast.List,ast.Tuple)):
+                return [ev(e) for e in node.elts]
+            elif isinstance(node,ast.Call):
+                if isinstance(node.func,ast.Attribute) and isinstance(node.func.value,ast.Name):
+                    # A method of a config object, e.g. machine.uses_gpu()
+                    func = getattr(self._objects[node.func.value.id],node.func.attr) \
+                           if node.func.value.id in self._objects else ev(node.func)
+                else:
+                    func = ev(node.func)
+                return func(*[ev(a) for a in node.args])
+        except (TypeError,ValueError,KeyError,IndexError,AttributeError,ZeroDivisionError) as e:
+            expect (False,
+                    f"Could not evaluate the expressions in string '{text}': {type(e).__name__}: {e}\n")
+
+        expect (False, f"Unsupported expression in string '{text}'\n")
+
+###############################################################################
+def expand_variables(tgt_obj, src_obj_dict, fields=None):
+###############################################################################
+    """
+    Replace the ${obj.attr...} expressions in the attributes of tgt_obj (and in
+    the dicts/lists they hold) with their value, where obj is a key of
+    src_obj_dict. Attributes of tgt_obj referencing other attributes of tgt_obj
+    are expanded in dependency order. If fields is given, only these attributes
+    (and the ones they reference) are expanded.
+    """
+
+    resolver = Resolver(src_obj_dict)
+    names = [n for n,o in src_obj_dict.items() if o is tgt_obj]
+    for att_name in fields or list(vars(tgt_obj).keys()):
+        if names:
+            value = resolver.resolve(names[0],att_name)
+        else:
+            value = resolver.expand(getattr(tgt_obj,att_name))
+        setattr(tgt_obj,att_name,value)
+
+    return tgt_obj
@@ -0,0 +1,65 @@
+# The library API: resolve a config once, run it with several drivers, and
+# inspect the structured results
+
+import json
+
+import cacts
+
+CONFIG = """
+project:
+    name: Foo
+machines:
+    default:
+        num_bld_res: 1
+        num_run_res: 1
+    foo:
+        env_setup: ["export A=1"]
+configurations:
+    default:
+        uses_baselines: False
+        on_by_default: True
+    good:
+        cmake_args:
+            FAIL: OFF
+    bad:
+        cmake_args:
+            FAIL: ON
+"""
+
+CMAKELISTS = """
+cmake_minimum_required(VERSION 3.9)
+project(Foo NONE)
+enable_testing()
+add_test(NAME t_pass COMMAND true)
+if (FAIL)
+  add_test(NAME t_fail COMMAND false)
+endif()
+"""
+
+def test_resolve_config(tmp_path, repo, git_commit):
+    (repo / "cacts.yaml").write_text(CONFIG)
+    (repo / "CMakeLists.txt").write_text(CMAKELISTS)
+    git_commit(repo,"api")
+
+    config = cacts.resolve_config(root_dir=repo,machine_name="foo")
+    assert isinstance(config,cacts.ResolvedConfig)
+    assert config.machine.name=="foo"
+    assert [b.name for b in config.builds]==["good","bad"]
+
+    result = cacts.Driver(resolved_config=config,work_dir=tmp_path / "work").run()
+    assert isinstance(result,cacts.RunResult)
+    assert not result and not result.success
+    good, bad = result.builds["good"], result.builds["bad"]
+    assert isinstance(good,cacts.BuildResult)
+    assert (good.status, good.failed_phase, good.failed_tests)==("passed", None, [])
+    assert (bad.status, bad.failed_phase, bad.failed_tests)==("failed", "test", ["t_fail"])
+    assert bad.phases==["configure", "build", "test"]
+    assert set(bad.phase_times) <= set(bad.phases) and "test" in bad.phase_times
+    assert bad.build_dir==tmp_path / "work" / "bad"
+    assert all(p.exists() for p in bad.logs.values())
+    assert json.loads(json.dumps(result.to_dict()))["builds"]["bad"]["failed_tests"]==["t_fail"]
+
+    # The same config can be reused, e.g. for a subset of the build types
+    result = cacts.Driver(resolved_config=config,work_dir=tmp_path / "work2",build_types=["good"]).run()
+    assert result and list(result.builds)==["good"]
+    assert [b.name for b in config.builds]==["good","bad"]
@@ -0,0 +1,34 @@
+# Tracking batch jobs
+
+import pytest
+
+from cacts.batch import FakeScheduler, wait_for_job
+
+class FlakyScheduler(object):
+    """
+    Reports no state for the first polls (e.g., sacct failing)
+    """
+
+    poll_interval = 0
+
+    def __init__(self, states):
+        self.states = states
+
+    def get_states(self, job_id):
+        return self.states.pop(0) if self.states else {}
+
+def test_wait_for_job(tmp_path):
+    script = tmp_path / "job.sh"
+    script.write_text("#SBATCH --array=0-1\nsleep 0.5\nexit $SLURM_ARRAY_TASK_ID\n")
+    scheduler = FakeScheduler()
+    scheduler.poll_interval = 0.1
+    job_id = scheduler.submit(script,None)
+    assert wait_for_job(scheduler,job_id)=={f"{job_id}_0" : "COMPLETED", f"{job_id}_1" : "FAILED"}
+
+def test_wait_for_job_scheduler_failures():
+    states = [{}, {"1" : "PENDING"}, {}, {}, {"1" : "RUNNING"}, {}, {"1" : "COMPLETED"}]
+    assert wait_for_job(FlakyScheduler(states),"1",max_failed_polls=3)=={"1" : "COMPLETED"}
+
+    states = [{"1" : "RUNNING"}, {}, {}, {}]
+    with pytest.raises(RuntimeError,match="3 times in a row"):
+        wait_for_job(FlakyScheduler(states),"1",max_failed_polls=3)
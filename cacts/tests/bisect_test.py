@@ -0,0 +1,55 @@
+# git bisect driver, and reuse of build trees across bisect steps
+
+import json
+import subprocess
+
+import cacts
+from cacts.bisect import run_bisection, get_first_bad_commit
+from cacts.scratch import STUB_FILE
+
+def get_sha(repo, ref="HEAD"):
+    return subprocess.run(f"git rev-parse {ref}",shell=True,cwd=repo,check=True,
+                          capture_output=True,text=True).stdout.strip()
+
+def test_run_bisection(tmp_path, repo, git_commit):
+    good = get_sha(repo)
+    shas = []
+    for i in range(8):
+        (repo / "value.txt").write_text(str(i))
+        git_commit(repo,f"value {i}")
+        shas.append(get_sha(repo))
+
+    def evaluate(sha):
+        value = int((repo / "value.txt").read_text())
+        if value==2:
+            return "skip", {"value" : value}
+        return ("bad" if value>=5 else "good"), {"value" : value}
+
+    record_file = tmp_path / "bisect.json"
+    first_bad, steps = run_bisection(repo,good,"HEAD",evaluate,record_file)
+    assert first_bad==shas[5]
+    assert all(s["verdict"]==("bad" if s["value"]>=5 else "good") for s in steps if s["value"]!=2)
+    assert json.loads(record_file.read_text())["first_bad"]==first_bad
+    # The repo is back where it was
+    assert get_sha(repo)==shas[-1]
+
+def test_get_first_bad_commit():
+    assert get_first_bad_commit("Bisecting: 3 revisions left to test")==None
+    assert get_first_bad_commit("abcdef1234 is the first bad commit\ncommit abcdef1234")=="abcdef1234"
+
+def test_incremental_reuse(tmp_path, repo):
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work",incremental=True)
+    build = driver._builds[0]
+    build_dir = driver.get_build_dir(build)
+    build_dir.mkdir(parents=True)
+    (build_dir / "CMakeCache.txt").write_text("")
+    (build_dir / "cacts_output.log").write_text("")
+
+    # The build tree is reused, without the results of the previous run
+    assert not driver.prepare_build_dir(build)
+    assert sorted(f.name for f in build_dir.iterdir())==["CMakeCache.txt"]
+
+    # Results synced back from a scratch tree are not a build tree
+    (build_dir / STUB_FILE).write_text("{}")
+    assert not driver.prepare_build_dir(build)
+    assert list(build_dir.iterdir())==[]
@@ -0,0 +1,97 @@
+# Test and build caches: what invalidates them
+
+import os
+
+import cacts
+# Not imported by name, or pytest would try to collect TestCache
+from cacts import cache as cacts_cache
+from cacts.cache import BuildCache
+from cacts import history as cacts_history
+from cacts.utils import is_clean_tree, get_tree_hash
+
+def get_fingerprint(repo, **kwargs):
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=repo.parent / "work",**kwargs)
+    return driver.get_build_fingerprints()["dbg"]
+
+def test_build_fingerprints(tmp_path, repo, git_commit):
+    full = get_fingerprint(repo)
+    assert get_fingerprint(repo)==full
+
+    # Runs of a subset of the tests are not the same as full runs
+    partial = [get_fingerprint(repo,changed_since="HEAD"),
+               get_fingerprint(repo,rerun_failed=True),
+               get_fingerprint(repo,test_regex="foo"),
+               get_fingerprint(repo,cmake_args=["-DFOO=1"])]
+    assert len(set(partial+[full]))==len(partial)+1
+
+    # Quarantining a test changes the selection
+    assert get_fingerprint(repo,quarantine=True)==full
+    history = cacts_history.TestHistory(tmp_path / "work" / ".cacts" / "history" / "dbg.json")
+    for s in "PFPFPF":
+        history.add("t","passed" if s=="P" else "failed")
+    history.save()
+    assert get_fingerprint(repo,quarantine=True) not in [full]+partial
+
+    # A new commit changes the tree, and local changes disable the cache
+    (repo / "foo.txt").write_text("foo")
+    git_commit(repo,"foo")
+    assert get_fingerprint(repo)!=full
+    (repo / "foo.txt").write_text("bar")
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work")
+    assert driver.get_build_fingerprints()=={}
+
+def test_build_cache(tmp_path):
+    cache = BuildCache(tmp_path / "cache.json")
+    cache.max_entries = 2
+    for i in range(3):
+        cache.add(BuildCache.fingerprint(i=i),{"result" : "PASS", "date" : f"2024-01-0{i+1}"})
+    cache.save()
+
+    cache = BuildCache(tmp_path / "cache.json")
+    assert cache.get(BuildCache.fingerprint(i=0)) is None
+    assert cache.get(BuildCache.fingerprint(i=2))["date"]=="2024-01-03"
+
+def test_test_cache(tmp_path):
+    exe = tmp_path / "test.sh"
+    exe.write_text("#!/bin/sh\n")
+    exe.chmod(0o755)
+    data = tmp_path / "input.txt"
+    data.write_text("1")
+    test = {"name" : "t", "command" : [str(exe), str(data)], "properties" : {}}
+
+    cache = cacts_cache.TestCache(tmp_path / "cache.json",tmp_path,tmp_path)
+    hashes = cache.compute_hashes([test])
+    assert cache.get_cached_passes(hashes)==[]
+    cache.update(hashes,{"t" : "passed"})
+    cache.save()
+
+    cache = cacts_cache.TestCache(tmp_path / "cache.json",tmp_path,tmp_path)
+    assert cache.get_cached_passes(cache.compute_hashes([test]))==["t"]
+
+    # Changing an input of the test invalidates its pass
+    data.write_text("2")
+    os.utime(data,ns=(0,0))
+    cache = cacts_cache.TestCache(tmp_path / "cache.json",tmp_path,tmp_path)
+    hashes = cache.compute_hashes([test])
+    assert cache.get_cached_passes(hashes)==[]
+
+    # So does a failure
+    cache.update(hashes,{"t" : "passed"})
+    assert cache.get_cached_passes(hashes)==["t"]
+    cache.update(hashes,{"t" : "failed"})
+    assert cache.get_cached_passes(hashes)==[]
+
+def test_clean_tree_scope(tmp_path, repo, git_commit):
+    # The tree hash covers the whole repo, and so must the check for local changes,
+    # even when the project is in a subfolder and the work dir is inside the repo
+    (repo / "sub").mkdir()
+    (repo / "sub" / "foo.txt").write_text("foo")
+    git_commit(repo,"sub")
+    work_dir = repo / "sub" / "work"
+    work_dir.mkdir()
+    (work_dir / "out.txt").write_text("out")
+    assert is_clean_tree(repo / "sub",exclude=[str(work_dir)])
+    assert get_tree_hash(repo / "sub")==get_tree_hash(repo)
+
+    (repo / "bar.txt").write_text("bar")
+    assert not is_clean_tree(repo / "sub",exclude=[str(work_dir)])
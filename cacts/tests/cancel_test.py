@@ -0,0 +1,80 @@
+# --fail-fast and cancel(): the cancellation only affects the run it belongs to
+
+import threading
+
+import cacts
+
+CONFIG = """
+project:
+    name: Foo
+machines:
+    default:
+        num_bld_res: 1
+        num_run_res: 1
+    foo:
+        env_setup: ["export A=1"]
+configurations:
+    default:
+        uses_baselines: False
+        on_by_default: True
+    bad:
+        cmake_args:
+            FAIL: ON
+    good:
+        cmake_args:
+            FAIL: OFF
+"""
+
+CMAKELISTS = """
+cmake_minimum_required(VERSION 3.9)
+project(Foo NONE)
+if (FAIL)
+  message(FATAL_ERROR "Configuration failed on purpose")
+endif()
+enable_testing()
+add_test(NAME t COMMAND sh -c "test ! -e ${CMAKE_SOURCE_DIR}/hang || sleep 30")
+"""
+
+def setup_repo(repo, git_commit):
+    (repo / "cacts.yaml").write_text(CONFIG)
+    (repo / "CMakeLists.txt").write_text(CMAKELISTS)
+    git_commit(repo,"fail")
+
+def get_cancel_files(work_dir):
+    return list((work_dir / ".cacts").glob("cancel*"))
+
+def test_fail_fast(tmp_path, repo, git_commit):
+    setup_repo(repo,git_commit)
+    work_dir = tmp_path / "work"
+
+    result = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=work_dir,fail_fast="any").run()
+    assert result.builds["bad"].status=="failed"
+    assert result.builds["good"].status=="cancelled"
+    assert get_cancel_files(work_dir)==[]
+
+    # The next run (e.g., another shard) is not affected
+    result = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=work_dir,build_types=["good"]).run()
+    assert result.builds["good"].status=="passed"
+
+    # Without --fail-fast, a failure does not cancel the other build types
+    result = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=work_dir).run()
+    assert [result.builds[n].status for n in ["bad","good"]]==["failed","passed"]
+
+def test_cancel(tmp_path, repo, git_commit):
+    setup_repo(repo,git_commit)
+    (repo / "hang").write_text("")
+    work_dir = tmp_path / "work"
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=work_dir,build_types=["good"])
+
+    # Not running: nothing to cancel
+    driver.cancel()
+    assert driver.get_cancel_file() is None and get_cancel_files(work_dir)==[]
+
+    timer = threading.Timer(3,driver.cancel,args=["cancelled by the test"])
+    timer.start()
+    try:
+        result = driver.run()
+    finally:
+        timer.cancel()
+    assert result.builds["good"].status=="cancelled"
+    assert get_cancel_files(work_dir)==[]
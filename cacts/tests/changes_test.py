@@ -0,0 +1,78 @@
+# Selection of the tests affected by changes in the source tree
+
+import json
+import pathlib
+
+from cacts.changes import get_changed_files, parse_depfile, get_affected_tests, write_file_api_query
+
+def write_json(path, data):
+    path.parent.mkdir(parents=True,exist_ok=True)
+    path.write_text(json.dumps(data))
+
+def make_build_dir(build_dir, root_dir):
+    """
+    A fake file API reply: b and a (which depends on lib), and a depfile listing a header of b
+    """
+
+    reply = build_dir / ".cmake" / "api" / "v1" / "reply"
+    write_json(reply / "index-1.json",{"objects" : [{"kind" : "codemodel", "jsonFile" : "codemodel.json"}]})
+    write_json(reply / "codemodel.json",{"configurations" : [{"targets" : [
+        {"jsonFile" : f"{t}.json"} for t in ["lib", "a", "b"]]}]})
+    write_json(reply / "lib.json",{"name" : "lib", "id" : "lib::@1", "sources" : [{"path" : "lib.cpp"}],
+                                   "artifacts" : [{"path" : "liblib.a"}]})
+    write_json(reply / "a.json",{"name" : "a", "id" : "a::@1", "sources" : [{"path" : "a.cpp"}],
+                                 "dependencies" : [{"id" : "lib::@1"}], "artifacts" : [{"path" : "a"}]})
+    write_json(reply / "b.json",{"name" : "b", "id" : "b::@1", "sources" : [{"path" : str(root_dir / "b.cpp")}],
+                                 "paths" : {"build" : "sub"}, "artifacts" : [{"path" : "sub/b"}]})
+
+    depfile = build_dir / "sub" / "CMakeFiles" / "b.dir" / "b.cpp.o.d"
+    depfile.parent.mkdir(parents=True)
+    depfile.write_text(f"CMakeFiles/b.dir/b.cpp.o: {root_dir}/b.cpp \\\n  {root_dir}/include/b.h\n")
+
+def test_parse_depfile(tmp_path):
+    depfile = tmp_path / "foo.o.d"
+    depfile.write_text("# comment\nfoo.o: /src/foo.cpp \\\n /src/foo.h \\\n  rel.h\n\n/src/foo.h:\n")
+    assert parse_depfile(depfile,tmp_path)=={pathlib.Path("/src/foo.cpp"), pathlib.Path("/src/foo.h"),
+                                             tmp_path / "rel.h"}
+
+def test_get_affected_tests(tmp_path):
+    root_dir = tmp_path / "src"
+    build_dir = tmp_path / "build"
+    root_dir.mkdir()
+    make_build_dir(build_dir,root_dir)
+
+    tests = [
+        {"name" : "test_a", "command" : [str(build_dir / "a")], "properties" : {}},
+        {"name" : "test_b", "command" : [str(build_dir / "sub" / "b"), "-v"], "properties" : {}},
+        {"name" : "test_data", "command" : ["/bin/cat"], "properties" : {"REQUIRED_FILES" : f"{root_dir}/input.txt"}},
+        {"name" : "test_phys", "command" : ["/bin/true"], "properties" : {"LABELS" : ["physics", "fast"]}},
+    ]
+    affected = lambda *files: get_affected_tests(build_dir,root_dir,{(root_dir / f).resolve() for f in files},tests,
+                                                 labels_by_path={"phys/*" : "physics"})
+
+    assert affected()==[]
+    # Through the dependency of a on lib
+    assert affected("lib.cpp")==["test_a"]
+    # Through the depfile of b
+    assert affected("include/b.h")==["test_b"]
+    assert affected("input.txt")==["test_data"]
+    assert affected("phys/foo.cpp","a.cpp")==["test_a", "test_phys"]
+    # Cannot tell
+    assert affected("lib.cpp","CMakeLists.txt") is None
+    assert affected("cmake/foo.cmake") is None
+    assert get_affected_tests(tmp_path / "other",root_dir,set(),tests) is None
+
+def test_write_file_api_query(tmp_path):
+    write_file_api_query(tmp_path)
+    assert (tmp_path / ".cmake" / "api" / "v1" / "query" / "codemodel-v2").exists()
+
+def test_get_changed_files(tmp_path, repo, git_commit):
+    (repo / "a.txt").write_text("a")
+    git_commit(repo,"a")
+    (repo / "b.txt").write_text("b")
+    git_commit(repo,"b")
+    (repo / "a.txt").write_text("modified")
+    (repo / "c.txt").write_text("untracked")
+
+    assert get_changed_files(repo / ".","HEAD~1")=={(repo / f).resolve() for f in ["a.txt", "b.txt", "c.txt"]}
+    assert get_changed_files(repo,"HEAD")=={(repo / f).resolve() for f in ["a.txt", "c.txt"]}
@@ -0,0 +1,47 @@
+import subprocess
+
+import pytest
+
+CONFIG = """
+project:
+    name: Foo
+machines:
+    default:
+        num_bld_res: 1
+        num_run_res: 1
+    foo:
+        env_setup: ["export A=1"]
+configurations:
+    default:
+        uses_baselines: False
+        on_by_default: True
+    dbg:
+        cmake_args:
+            CMAKE_BUILD_TYPE: Debug
+"""
+
+def commit_all(repo, msg):
+    for cmd in ["git add .", f"git -c user.name=a -c user.email=a@b commit -q -m '{msg}'"]:
+        subprocess.run(cmd,shell=True,cwd=repo,check=True)
+
+@pytest.fixture
+def git_commit():
+    """
+    A function to commit all the changes in a repo
+    """
+    return commit_all
+
+@pytest.fixture
+def repo(tmp_path):
+    """
+    A git repo with a cacts config (machine 'foo', build type 'dbg'). The work dir
+    is tmp_path/work
+    """
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "cacts.yaml").write_text(CONFIG)
+    (repo / "CMakeLists.txt").write_text("cmake_minimum_required(VERSION 3.9)\n")
+    subprocess.run("git init -q",shell=True,cwd=repo,check=True)
+    commit_all(repo,"init")
+    return repo
@@ -0,0 +1,64 @@
+# Parsing and merging of the coverage data of gcov/llvm-cov
+
+import json
+
+from cacts.coverage import parse_gcov_output, merge_coverage, summarize_coverage, diff_coverage, write_lcov
+
+GCOV_JSON = [
+    {"current_working_directory" : "/src/build", "files" : [
+        {"file" : "../foo.cpp",
+         "lines" : [{"line_number" : 1, "count" : 2}, {"line_number" : 2, "count" : 0},
+                    {"line_number" : 1, "count" : 1}],
+         "functions" : [{"name" : "_Z3foov", "demangled_name" : "foo()", "start_line" : 1, "execution_count" : 2}]},
+        {"file" : "/usr/include/c++/vector",
+         "lines" : [{"line_number" : 10, "count" : 5}]},
+    ]},
+    {"current_working_directory" : "/src/build", "files" : [
+        {"file" : "/src/bar.cpp", "lines" : [{"line_number" : 3, "count" : 1}]},
+    ]},
+]
+
+LLVM_COV = """
+file:/src/foo.cpp
+function:1,3,foo()
+lcount:1,3
+lcount:2,1
+lcount:4,0
+"""
+
+def test_parse_gcov_output():
+    data = parse_gcov_output("\n".join(json.dumps(d) for d in GCOV_JSON))
+    assert sorted(data)==["/src/bar.cpp", "/src/foo.cpp", "/usr/include/c++/vector"]
+    assert data["/src/foo.cpp"]=={"lines" : {"1" : 3, "2" : 0}, "functions" : {"foo()" : [1,2]}}
+
+    data = parse_gcov_output(LLVM_COV)
+    assert data=={"/src/foo.cpp" : {"lines" : {"1" : 3, "2" : 1, "4" : 0}, "functions" : {"foo()" : [1,3]}}}
+
+def test_merge_coverage():
+    total = {}
+    merge_coverage(total,parse_gcov_output("\n".join(json.dumps(d) for d in GCOV_JSON)),"/src")
+    merge_coverage(total,parse_gcov_output(LLVM_COV),"/src/")
+    # Files outside the root dir are dropped, and the counts are summed
+    assert sorted(total)==["/src/bar.cpp", "/src/foo.cpp"]
+    assert total["/src/foo.cpp"]=={"lines" : {"1" : 6, "2" : 1, "4" : 0}, "functions" : {"foo()" : [1,5]}}
+
+    summary = summarize_coverage(total,"/src")
+    assert (summary["covered"], summary["total"])==(3, 4)
+    assert summary["files"]=={"bar.cpp" : [1,1], "foo.cpp" : [2,3]}
+
+def test_write_lcov(tmp_path):
+    write_lcov(parse_gcov_output(LLVM_COV),tmp_path / "lcov.info")
+    assert (tmp_path / "lcov.info").read_text().splitlines()==[
+        "SF:/src/foo.cpp", "FN:1,foo()", "FNDA:3,foo()", "FNF:1", "FNH:1",
+        "DA:1,3", "DA:2,1", "DA:4,0", "LF:3", "LH:2", "end_of_record"]
+
+def test_diff_coverage():
+    old = {"date" : "yesterday", "covered" : 3, "total" : 4,
+           "files" : {"foo.cpp" : [2,3], "bar.cpp" : [1,1], "old.cpp" : [0,0]}}
+    new = {"date" : "today", "covered" : 4, "total" : 5,
+           "files" : {"foo.cpp" : [3,3], "bar.cpp" : [1,1], "new.cpp" : [0,1]}}
+    assert diff_coverage(old,new).splitlines()==[
+        "Line coverage: 75.00% (yesterday) -> 80.00%",
+        "  + foo.cpp: 66.7% -> 100.0% (+1 covered lines)",
+        "  + new.cpp: 0.0% (new)",
+        "  - old.cpp: no longer covered"]
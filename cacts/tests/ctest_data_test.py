@@ -0,0 +1,69 @@
+# Reading and combining the Test.xml files written by ctest
+
+import cacts
+from cacts import ctest_data
+from cacts.ctest_data import iter_test_results, get_test_results, merge_test_xml, replace_test_results
+
+def make_test_xml(path, results):
+    tests = "".join(
+        f'<Test Status="{status}"><Name>{name}</Name><FullName>./{name}</FullName><Results>'
+        f'<NamedMeasurement type="numeric/double" name="Execution Time"><Value>{time}</Value></NamedMeasurement>'
+        '</Results></Test>'
+        for name, status, time in results)
+    names = "".join(f"<Test>./{name}</Test>" for name, _, _ in results)
+    path.parent.mkdir(parents=True,exist_ok=True)
+    path.write_text('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    f'<Site><Testing><StartDateTime>now</StartDateTime><TestList>{names}</TestList>'
+                    f'{tests}<EndDateTime>later</EndDateTime></Testing></Site>')
+    return path
+
+def make_build_dir(tmp_path, results, tag="20240101-0000"):
+    (tmp_path / "Testing").mkdir(parents=True,exist_ok=True)
+    (tmp_path / "Testing" / "TAG").write_text(f"{tag}\nExperimental\n")
+    return make_test_xml(tmp_path / "Testing" / tag / "Test.xml",results)
+
+def test_iter_test_results(tmp_path):
+    assert list(iter_test_results(tmp_path))==[]
+    make_build_dir(tmp_path,[("a","passed",1.5),("b","failed",2)])
+    assert list(iter_test_results(tmp_path))==[{"name" : "a", "status" : "passed", "time" : 1.5},
+                                               {"name" : "b", "status" : "failed", "time" : 2.0}]
+
+def test_replace_test_results(tmp_path):
+    test_xml = make_build_dir(tmp_path,[("a","failed",1),("b","passed",2),("c","failed",3)])
+    retry_xml = make_test_xml(tmp_path / "retry.xml",[("c","passed",4),("a","failed",5)])
+
+    replace_test_results(test_xml,retry_xml)
+    # Same order, and the tests that were not re-run keep their results
+    assert list(iter_test_results(tmp_path))==[{"name" : "a", "status" : "failed", "time" : 5.0},
+                                               {"name" : "b", "status" : "passed", "time" : 2.0},
+                                               {"name" : "c", "status" : "passed", "time" : 4.0}]
+
+def test_merge_test_xml(tmp_path):
+    shard1 = make_test_xml(tmp_path / "1.xml",[("a","passed",1)])
+    shard2 = make_test_xml(tmp_path / "2.xml",[("b","failed",2),("c","notrun",0)])
+    merge_test_xml([shard1,shard2],make_build_dir(tmp_path / "build",[]))
+    assert get_test_results(tmp_path / "build")=={"a" : "passed", "b" : "failed", "c" : "notrun"}
+
+def test_tests_regex():
+    assert ctest_data.tests_regex(["b","a.c"])==r"^(a\.c|b)$"
+
+def test_retry_keeps_all_results(tmp_path, repo, git_commit):
+    # A flaky test fails at the first run, and passes when retried
+    (repo / "CMakeLists.txt").write_text(
+        "cmake_minimum_required(VERSION 3.9)\n"
+        "project(Foo NONE)\n"
+        "enable_testing()\n"
+        "add_test(NAME ok COMMAND true)\n"
+        f"add_test(NAME flaky COMMAND sh -c \"test -e {tmp_path}/ran || (touch {tmp_path}/ran; false)\")\n")
+    git_commit(repo,"tests")
+
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work")
+    history = driver.get_test_history(driver._builds[0])
+    for status in ["passed","failed","passed","failed","passed"]:
+        history.add("flaky",status)
+    history.save()
+
+    result = driver.run()
+    assert result
+    build_dir = driver.get_build_dir(driver._builds[0])
+    assert sorted((r["name"],r["status"]) for r in iter_test_results(build_dir))==[("flaky","passed"),("ok","passed")]
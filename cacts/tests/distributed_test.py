@@ -0,0 +1,77 @@
+# Farming out build types to workers, and collecting their results
+
+import shlex
+import pathlib
+
+import pytest
+
+import cacts
+from cacts import distributed
+from cacts.distributed import get_worker_cmd, run_workers
+
+CONFIG = """
+project:
+    name: Foo
+machines:
+    default:
+        num_bld_res: 1
+        num_run_res: 1
+    foo:
+        env_setup: ["export A=1"]
+configurations:
+    default:
+        uses_baselines: False
+        on_by_default: True
+    dbg:
+        cmake_args:
+            CMAKE_BUILD_TYPE: Debug
+    bad:
+        cmake_args:
+            FAIL: ON
+"""
+
+def test_get_worker_cmd():
+    cmd = get_worker_cmd("/w/dbg.pkl","local")
+    assert "run_worker(\"/w/dbg.pkl\")" in cmd
+    assert get_worker_cmd("/w/dbg.pkl","srun")==f"srun --nodes=1 --ntasks=1 --exclusive sh -c {shlex.quote(cmd)}"
+    assert get_worker_cmd("/w/dbg.pkl","ssh","node1")==f"ssh node1 {shlex.quote(cmd)}"
+    with pytest.raises(RuntimeError,match="requires a host name"):
+        get_worker_cmd("/w/dbg.pkl","ssh")
+    with pytest.raises(RuntimeError,match="Unsupported worker launcher"):
+        get_worker_cmd("/w/dbg.pkl","mpirun")
+
+def test_hosts_assignment(tmp_path, monkeypatch):
+    # Each host runs one worker at a time: a worker fails if its host is busy.
+    # Worker b4 exits without reporting a result.
+    def fake_worker_cmd(state_file, launcher, host=None):
+        if state_file.name=="b4.pkl":
+            return "false"
+        lock = tmp_path / f"{host}.lock"
+        result = pathlib.Path(state_file).with_suffix(".result.json")
+        return f"mkdir {lock} && echo running on {host} && sleep 0.2 && rmdir {lock} && " \
+               f"echo '{{\"success\" : true}}' > {result}"
+    monkeypatch.setattr(distributed,"get_worker_cmd",fake_worker_cmd)
+
+    state_files = {f"b{i}" : tmp_path / f"b{i}.pkl" for i in range(5)}
+    # Results of previous runs are ignored
+    (tmp_path / "b4.result.json").write_text('{"success" : true}')
+
+    results = run_workers(state_files,"ssh",["n1","n2"])
+    assert results=={"b0" : True, "b1" : True, "b2" : True, "b3" : True, "b4" : False}
+    hosts = [(tmp_path / f"b{i}.log").read_text().split()[-1] for i in range(4)]
+    assert set(hosts)=={"n1","n2"}
+
+def test_local_workers(tmp_path, repo, git_commit):
+    (repo / "cacts.yaml").write_text(CONFIG)
+    (repo / "CMakeLists.txt").write_text("cmake_minimum_required(VERSION 3.9)\nproject(Foo NONE)\n"
+                                         "if (FAIL)\n  message(FATAL_ERROR \"failed on purpose\")\nendif()\n"
+                                         "enable_testing()\nadd_test(NAME t COMMAND true)\n")
+    git_commit(repo,"workers")
+
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work",launcher="local")
+    result = driver.run()
+    assert {n : b.status for n,b in result.builds.items()}=={"dbg" : "passed", "bad" : "failed"}
+    assert result.builds["bad"].failed_phase=="configure"
+    # Each worker processed its own build type
+    log = (tmp_path / "work" / ".cacts" / "workers" / "dbg.log").read_text()
+    assert "Processing build dbg" in log and "Processing build bad" not in log
@@ -0,0 +1,35 @@
+# Running shell commands, with and without an event loop
+
+import asyncio
+
+from cacts.utils import run_cmd, run_cmd_no_fail
+from cacts.engine import TIMEOUT_STATUS, run_cmds_concurrently
+
+def test_run_cmd():
+    assert run_cmd("echo foo; echo bar >&2; exit 3") == (3, "foo", "bar")
+    assert run_cmd("echo foo; echo bar >&2",combine_output=True) == (0, "foo\nbar", None)
+    assert run_cmd_no_fail("printf 'no newline'") == "no newline"
+
+def test_run_cmd_echo_and_log(tmp_path, capsys):
+    log = tmp_path / "log.txt"
+    stat, out, err = run_cmd("echo foo; echo bar >&2",arg_stdout=None,prefix="[x] ",log_file=log)
+    assert (stat, out, err) == (0, None, "bar")
+    assert capsys.readouterr().out == "[x] foo\n"
+    assert sorted(log.read_text().splitlines()) == ["bar", "foo"]
+
+def test_run_cmd_timeout():
+    stat, _, err = run_cmd("sleep 10 | cat",timeout=0.5)
+    assert stat == TIMEOUT_STATUS
+    assert "timed out" in err
+
+def test_run_cmd_in_event_loop():
+    class Monitor(object):
+        async def watch(self, pid, last_output_time):
+            await asyncio.sleep(100)
+
+    async def main():
+        return (run_cmd("echo foo"),
+                run_cmd("echo bar",monitors=[Monitor()]),
+                run_cmds_concurrently(["echo a", "echo b"]))
+
+    assert asyncio.run(main()) == ((0, "foo", ""), (0, "bar", ""), [(0, "a", ""), (0, "b", "")])
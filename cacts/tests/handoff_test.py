@@ -0,0 +1,44 @@
+# Handoff between a --build-only run and 'cacts test-stage', possibly elsewhere
+
+import json
+import shutil
+
+import pytest
+
+import cacts
+# Not imported by name, or pytest would try to collect test_stage_main
+from cacts import handoff
+from cacts.handoff import MANIFEST_FILE
+from cacts.ctest_data import iter_test_results
+
+CMAKELISTS = """
+cmake_minimum_required(VERSION 3.9)
+project(Foo NONE)
+enable_testing()
+file(WRITE ${CMAKE_BINARY_DIR}/check.sh "test -e CMakeCache.txt")
+add_test(NAME t COMMAND sh ${CMAKE_BINARY_DIR}/check.sh)
+"""
+
+def test_relocated_test_stage(tmp_path, repo, git_commit):
+    (repo / "CMakeLists.txt").write_text(CMAKELISTS)
+    git_commit(repo,"handoff")
+
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work",build_only=True)
+    assert driver.run()
+    build_dir = driver.get_build_dir(driver._builds[0])
+    manifest = json.loads((build_dir / MANIFEST_FILE).read_text())
+    assert manifest["files"].keys()=={"check.sh"}
+    assert list(iter_test_results(build_dir))==[]
+
+    # E.g., copied to the scratch file system of the compute nodes
+    new_dir = tmp_path / "elsewhere" / build_dir.name
+    shutil.move(str(build_dir),str(new_dir))
+    assert handoff.run_test_stage(new_dir)
+    assert [(r["name"],r["status"]) for r in iter_test_results(new_dir)]==[("t","passed")]
+    assert str(build_dir) not in (new_dir / "CTestTestfile.cmake").read_text()
+    assert json.loads((new_dir / MANIFEST_FILE).read_text())["location"]==str(new_dir)
+
+    # The test files must be the ones that were built
+    (new_dir / "check.sh").write_text("true")
+    with pytest.raises(RuntimeError,match="differ from the ones listed in the manifest"):
+        handoff.run_test_stage(new_dir)
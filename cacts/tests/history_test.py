@@ -0,0 +1,46 @@
+# Flaky tests detection and quarantine
+
+# Not imported by name, or pytest would try to collect TestHistory
+from cacts import history as cacts_history
+
+def make_history(tmp_path, outcomes):
+    history = cacts_history.TestHistory(tmp_path / "history.json")
+    for name, statuses in outcomes.items():
+        for s in statuses:
+            history.add(name,{"P" : "passed", "F" : "failed", "N" : "notrun"}[s],1.0)
+    return history
+
+def test_flakiness(tmp_path):
+    history = make_history(tmp_path,{
+        "stable"     : "PPPPPP",
+        "regression" : "PPPPPF",
+        "fixed"      : "FFFPPP",
+        "flaky"      : "PPPFPF",
+        "notrun"     : "PNNNP",
+    })
+
+    assert history.flakiness("stable")==0
+    assert history.flakiness("notrun")==0
+    assert history.flakiness("unknown")==0
+    # A single flip is a regression (or a fix), not flakiness
+    assert not history.is_suspected_flaky("regression")
+    assert not history.is_suspected_flaky("fixed")
+    assert history.flakiness("flaky")==0.6
+    assert history.is_suspected_flaky("flaky")
+
+def test_quarantine(tmp_path):
+    history = make_history(tmp_path,{"short" : "FPF", "long" : "FPFPF", "rare" : "PPPPPPPPPFPPPPPPPPPF"})
+    # Not enough runs to quarantine
+    assert history.is_suspected_flaky("short") and not history.is_quarantined("short")
+    assert history.is_quarantined("long")
+    # Rarely flaky tests are suspected, not quarantined
+    assert history.is_suspected_flaky("rare") and not history.is_quarantined("rare")
+
+def test_history_is_saved(tmp_path):
+    history = make_history(tmp_path,{"a" : "P"*30})
+    history.save()
+    history = cacts_history.TestHistory(tmp_path / "history.json")
+    assert history.tests()==["a"]
+    assert len(history._outcomes["a"])==cacts_history.TestHistory.window
+    assert history.average_time("a")==1.0
+    assert history.average_time("b") is None
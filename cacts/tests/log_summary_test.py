@@ -0,0 +1,123 @@
+# Extraction of the relevant parts of the ctest logs
+
+import gzip
+
+from cacts.log_summary import iter_build_errors, iter_failed_tests, iter_cmake_errors, summarize_log
+
+BUILD_LOG = """\
+[ 10%] Building CXX object CMakeFiles/a.dir/a.cpp.o
+/src/a.cpp: In function 'int main()':
+/src/a.cpp:3:5: error: 'foo' was not declared in this scope
+    3 |     foo();
+      |     ^~~
+/src/a.cpp:4:5: error: 'bar' was not declared in this scope
+    4 |     bar();
+make[2]: *** [CMakeFiles/a.dir/build.make:76: CMakeFiles/a.dir/a.cpp.o] Error 1
+[ 20%] Linking CXX executable b
+/usr/bin/ld: b.cpp.o: undefined reference to `baz()'
+collect2: error: ld returned 1 exit status
+make: *** [Makefile:91: all] Error 2
+"""
+
+TEST_LOG = """\
+Start testing: Jan 01 00:00 UTC
+----------------------------------------------------------
+1/3 Testing: test_a
+1/3 Test: test_a
+Command: "/build/a"
+Output:
+----------------------------------------------------------
+all good
+<end of output>
+Test time =   0.01 sec
+----------------------------------------------------------
+Test Passed.
+"test_a" end time: Jan 01 00:00 UTC
+
+2/3 Testing: test_b
+2/3 Test: test_b
+Command: "/build/b"
+Output:
+----------------------------------------------------------
+line 1
+Test failed: expected 1, got 2
+<end of output>
+Test time =   0.02 sec
+----------------------------------------------------------
+Test Failed.
+"test_b" end time: Jan 01 00:00 UTC
+
+3/3 Test: test_c
+Output:
+----------------------------------------------------------
+<end of output>
+Test time =  10.00 sec
+----------------------------------------------------------
+Test Fail Reason:
+TIMEOUT
+"""
+
+CONFIGURE_LOG = """\
+-- The CXX compiler identification is GNU
+CMake Error at CMakeLists.txt:5 (find_package):
+  Could not find a package configuration file provided by "Foo"
+
+  Add the installation prefix of "Foo" to CMAKE_PREFIX_PATH.
+
+
+-- Configuring incomplete, errors occurred!
+CMake Error: the source directory does not exist
+"""
+
+def test_build_errors():
+    errors = list(iter_build_errors(BUILD_LOG.splitlines(True),before=2,after=2))
+    assert [t for t,_ in errors]==["/src/a.cpp:3:5: error: 'foo' was not declared in this scope",
+                                   "/src/a.cpp:4:5: error: 'bar' was not declared in this scope",
+                                   "/usr/bin/ld: b.cpp.o: undefined reference to `baz()'",
+                                   "collect2: error: ld returned 1 exit status"]
+    assert errors[0][1]==BUILD_LOG.splitlines()[0:5]
+    # The lines after an error are not repeated as the context of the next one
+    assert errors[1][1]==BUILD_LOG.splitlines()[5:8]
+    assert errors[2][1]==BUILD_LOG.splitlines()[8:10]
+    # An error right after another one ends its context
+    assert errors[3][1]==BUILD_LOG.splitlines()[10:12]
+
+def test_failed_tests():
+    failed = list(iter_failed_tests(TEST_LOG.splitlines(True)))
+    assert failed==[("test_b", ["Test Failed.", "line 1", "Test failed: expected 1, got 2"]),
+                    ("test_c", ["Test Fail Reason:"])]
+
+def test_cmake_errors():
+    errors = list(iter_cmake_errors(CONFIGURE_LOG.splitlines(True)))
+    assert [t for t,_ in errors]==["CMake Error at CMakeLists.txt:5 (find_package):",
+                                   "CMake Error: the source directory does not exist"]
+    assert errors[0][1][-1]=='  Add the installation prefix of "Foo" to CMAKE_PREFIX_PATH.'
+
+def test_summarize_log(tmp_path):
+    log_file = tmp_path / "LastBuild.log.gz"
+    with gzip.open(log_file,"wt") as fd:
+        fd.write(BUILD_LOG)
+
+    summary = summarize_log(log_file,"Build",tmp_path / "extract.txt",max_items=2,max_lines=3)
+    assert summary.startswith(f"Found 4 compiler/linker errors in {log_file} (showing the first 2):")
+    assert "'bar' was not declared" in summary and "baz" not in summary
+    assert "more lines" in summary
+    assert "undefined reference to `baz()'" in (tmp_path / "extract.txt").read_text()
+
+    # Without anything recognizable, or an extractor, show the end of the log
+    log_file = tmp_path / "LastSubmit.log"
+    log_file.write_text("\n".join(f"line {i}" for i in range(100)))
+    for phase in ["Submit", "Test"]:
+        summary = summarize_log(log_file,phase,tmp_path / "extract.txt")
+        assert "line 99" in summary and "line 50" not in summary
+
+def test_summarize_archived_log(tmp_path):
+    log_file = tmp_path / "archive" / "LastBuild.log.gz"
+    log_file.parent.mkdir()
+    with gzip.open(log_file,"wt") as fd:
+        fd.write(BUILD_LOG)
+
+    # The build dir was removed
+    summary = summarize_log(log_file,"Build",tmp_path / "build" / "extract.txt")
+    assert summary.endswith(f"Full extract in {log_file.parent / 'extract.txt'}")
+    assert not (tmp_path / "build").exists()
@@ -0,0 +1,99 @@
+# Matrix configurations, and build types with identical configurations
+
+import pytest
+
+import cacts
+from cacts.parse_config import expand_matrix, expand_configurations
+
+def test_expand_matrix():
+    entry = {
+        "uses_baselines" : False,
+        "cmake_args" : {"A" : "1"},
+        "matrix" : {
+            "compiler" : ["gcc", "clang"],
+            "prec" : {"sp" : {"cmake_args" : {"PREC" : "SINGLE"}}, "dp" : {"cmake_args" : {"PREC" : "DOUBLE"}}},
+        },
+        "exclude" : [{"compiler" : "clang", "prec" : "sp"}],
+        "include" : [{"compiler" : "gcc", "prec" : "dp", "cmake_args" : {"B" : "2"}},
+                     {"compiler" : "intel", "prec" : "dp", "on_by_default" : False}],
+    }
+    specs = expand_matrix("m",entry)
+
+    assert list(specs)==["m_gcc_sp", "m_gcc_dp", "m_clang_dp", "m_intel_dp"]
+    assert specs["m_gcc_sp"]=={"uses_baselines" : False, "compiler" : "gcc", "prec" : "sp",
+                               "cmake_args" : {"A" : "1", "PREC" : "SINGLE"}}
+    # Include rules matching a combination add settings to it
+    assert specs["m_gcc_dp"]["cmake_args"]=={"A" : "1", "PREC" : "DOUBLE", "B" : "2"}
+    assert specs["m_clang_dp"]["cmake_args"]=={"A" : "1", "PREC" : "DOUBLE"}
+    # Other include rules add a combination
+    assert specs["m_intel_dp"]["on_by_default"] is False
+    # The entry is not modified
+    assert entry["cmake_args"]=={"A" : "1"}
+
+@pytest.mark.parametrize("entry,error",[
+    ({"matrix" : {}}, "Invalid matrix"),
+    ({"matrix" : {"a" : []}}, "Invalid values for axis 'a'"),
+    ({"matrix" : {"a" : [1]}, "exclude" : [{"b" : 1}]}, "Invalid exclude rule"),
+    ({"matrix" : {"a" : [1], "b" : [2]}, "include" : [{"a" : 1}]}, "Invalid include rule"),
+    ({"matrix" : {"a" : {"x" : {"cmake_args" : ["-DFOO=1"]}}}}, "Invalid value for cmake_args"),
+])
+def test_invalid_matrix(entry, error):
+    with pytest.raises(RuntimeError,match=error):
+        expand_matrix("m",entry)
+
+def test_expand_configurations():
+    specs, groups = expand_configurations({"default" : {}, "m" : {"matrix" : {"a" : [1,2]}}, "opt" : {}})
+    assert list(specs)==["default", "m_1", "m_2", "opt"]
+    assert groups=={"m" : ["m_1", "m_2"]}
+
+    with pytest.raises(RuntimeError,match="'m_1' is defined more than once"):
+        expand_configurations({"m_1" : {}, "m" : {"matrix" : {"a" : [1]}}})
+    with pytest.raises(RuntimeError,match="'default' configuration cannot have a matrix"):
+        expand_configurations({"default" : {"matrix" : {"a" : [1]}}})
+
+CONFIG = """
+project:
+    name: Foo
+machines:
+    default:
+        num_bld_res: 1
+        num_run_res: 1
+    foo:
+        env_setup: ["export A=1"]
+configurations:
+    default:
+        uses_baselines: False
+        on_by_default: True
+    sweep:
+        cmake_args:
+            OPT: ${build.opt}
+        matrix:
+            opt: [O0, O2]
+            debug:
+                dbg:
+                    cmake_args:
+                        CMAKE_BUILD_TYPE: Debug
+                debug:
+                    cmake_args:
+                        CMAKE_BUILD_TYPE: Debug
+"""
+
+def test_duplicate_builds(tmp_path, repo):
+    (repo / "cacts.yaml").write_text(CONFIG)
+    get_builds = lambda **kwargs: [b.longname for b in cacts.Driver(machine_name="foo",root_dir=repo,
+                                                                    work_dir=tmp_path / "work",**kwargs)._builds]
+
+    assert get_builds()==["sweep_O0_dbg", "sweep_O2_dbg"]
+    assert get_builds(keep_duplicates=True)==["sweep_O0_dbg", "sweep_O0_debug", "sweep_O2_dbg", "sweep_O2_debug"]
+    # The name of the matrix selects all its build types
+    assert get_builds(build_types=["sweep"],keep_duplicates=True)==get_builds(keep_duplicates=True)
+    assert get_builds(build_types=["sweep_O2_debug"])==["sweep_O2_debug"]
+
+def test_plan_with_matrix_name(tmp_path, repo):
+    (repo / "cacts.yaml").write_text(CONFIG)
+    plan_file = tmp_path / "plan.json"
+    cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work",
+                 build_types=["sweep"],plan=plan_file).run()
+
+    driver = cacts.Driver.from_plan(plan_file)
+    assert [b.longname for b in driver._builds]==["sweep_O0_dbg", "sweep_O2_dbg"]
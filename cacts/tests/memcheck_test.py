@@ -0,0 +1,94 @@
+# Parsing and deduplication of the valgrind errors found by ctest_memcheck
+
+import zlib
+import base64
+
+import cacts
+from cacts.memcheck import iter_valgrind_errors, defect_key, aggregate_defects, format_defect_report, \
+                           iter_memcheck_results
+
+LOG = """\
+==123== Memcheck, a memory error detector
+==123== Copyright (C) 2002-2022, and GNU GPL'd, by Julian Seward et al.
+==123== Command: ./foo
+==123==
+<b>UMR</b> ==123== Invalid read of size 4
+==123==    at 0x4005F4: read(int*) (foo.cpp:10)
+==123==    by 0x400610: main (foo.cpp:20)
+==123==  Address 0x5204040 is 0 bytes after a block of size 0 alloc'd
+==123==
+==123== HEAP SUMMARY:
+==123==     in use at exit: 80 bytes in 2 blocks
+==123==
+<b>MLK</b> ==123== 40 bytes in 1 blocks are definitely lost in loss record 1 of 2
+==123==    at 0x4C2DB8F: malloc (vg_replace_malloc.c:299)
+==123==    by 0x400620: leak() (foo.cpp:30)
+==123==
+<b>MLK</b> ==123== 8 bytes in 1 blocks are definitely lost in loss record 2 of 2
+==123==    at 0x4C2DB8F: malloc (vg_replace_malloc.c:299)
+==123==    by 0x400620: leak() (foo.cpp:30)
+==123==
+==123== LEAK SUMMARY:
+==123==    definitely lost: 48 bytes in 2 blocks
+==123==
+==123== ERROR SUMMARY: 3 errors from 3 contexts (suppressed: 0 from 0)
+"""
+
+def test_iter_valgrind_errors():
+    errors = list(iter_valgrind_errors(LOG.splitlines()))
+    assert [k for k,_ in errors]==["Invalid read of size 4",
+                                   "40 bytes in 1 blocks are definitely lost in loss record 1 of 2",
+                                   "8 bytes in 1 blocks are definitely lost in loss record 2 of 2"]
+    assert errors[0][1]==["read(int*) (foo.cpp:10)", "main (foo.cpp:20)"]
+
+def test_aggregate_defects():
+    # The two leaks are the same defect, and so are the errors found by different tests
+    assert defect_key(*list(iter_valgrind_errors(LOG.splitlines()))[1])==\
+           ("definitely lost", ("malloc (vg_replace_malloc.c:299)", "leak() (foo.cpp:30)"))
+    defects = aggregate_defects([{"name" : "a", "log" : LOG}, {"name" : "b", "log" : LOG},
+                                 {"name" : "c", "log" : ""}])
+    assert [(k[0], d["count"], sorted(d["tests"])) for k,d in defects.items()]==\
+           [("Invalid read of size 4", 2, ["a","b"]), ("definitely lost", 4, ["a","b"])]
+
+    report = format_defect_report(defects)
+    assert report.startswith("Found 2 distinct memcheck defects\n\n===== definitely lost (4 occurrences, in 2 tests)")
+
+def test_iter_memcheck_results(tmp_path):
+    tag_dir = tmp_path / "Testing" / "20240101-0000"
+    tag_dir.mkdir(parents=True)
+    (tmp_path / "Testing" / "TAG").write_text("20240101-0000\nExperimental\n")
+    log = base64.b64encode(zlib.compress(LOG.encode())).decode()
+    (tag_dir / "DynamicAnalysis.xml").write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n<Site><DynamicAnalysis>'
+        '<TestList><Test>./a</Test><Test>./b</Test></TestList>'
+        '<Test Status="passed"><Name>a</Name><FullName>./a</FullName><Results>'
+        '<Defect type="Memory Leak">2</Defect><Defect type="Invalid Read">1</Defect></Results>'
+        f'<Log compression="gzip" encoding="base64">{log}</Log></Test>'
+        '</DynamicAnalysis></Site>')
+
+    results = list(iter_memcheck_results(tmp_path))
+    assert [(r["name"], r["defects"]) for r in results]==[("a", {"Memory Leak" : 2, "Invalid Read" : 1}), ("b", {})]
+    assert results[0]["log"]==LOG
+
+CONFIG = """
+project:
+    name: Foo
+machines:
+    default:
+        num_bld_res: 1
+        num_run_res: 1
+    foo:
+        valg_supp_file: /path/to/valgrind.supp
+configurations:
+    default:
+        uses_baselines: False
+    mem:
+        memcheck: True
+"""
+
+def test_suppression_file(tmp_path, repo):
+    (repo / "cacts.yaml").write_text(CONFIG)
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work")
+    text = driver.get_ctest_script_text(driver._builds[0],phases=["memcheck"])
+    assert "set(CTEST_MEMORYCHECK_SUPPRESSIONS_FILE /path/to/valgrind.supp)" in text
+    assert "ctest_memcheck(" in text
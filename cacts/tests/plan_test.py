@@ -0,0 +1,63 @@
+# Plans: the resolved config written with --plan, and executed later
+
+import json
+
+import cacts
+from cacts.plan import object_state, restore_object, read_plan
+from cacts.build_type import BuildType
+
+CONFIG = """
+project:
+    name: Foo
+machines:
+    default:
+        num_bld_res: 1
+        num_run_res: 1
+    foo:
+        env_setup: ["export A=$(echo planned)"]
+configurations:
+    default:
+        uses_baselines: False
+        on_by_default: True
+    dbg:
+        cmake_args:
+            CMAKE_BUILD_TYPE: Debug
+            FOO: ${machine.name}
+"""
+
+def write_plan(tmp_path, repo, git_commit, **kwargs):
+    (repo / "cacts.yaml").write_text(CONFIG)
+    (repo / "CMakeLists.txt").write_text("cmake_minimum_required(VERSION 3.9)\nproject(Foo NONE)\n"
+                                         "enable_testing()\nadd_test(NAME t COMMAND true)\n")
+    git_commit(repo,"plan")
+
+    plan_file = tmp_path / "plan.json"
+    driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work",plan=plan_file,**kwargs)
+    assert not driver.run().builds
+    return driver, plan_file
+
+def test_object_state():
+    build = restore_object(BuildType,{"name" : "dbg", "cmake_args" : {"A" : "1"}})
+    assert isinstance(build,BuildType) and build.cmake_args=={"A" : "1"}
+    assert object_state(build)=={"name" : "dbg", "cmake_args" : {"A" : "1"}}
+
+def test_plan_round_trip(tmp_path, repo, git_commit, capsys):
+    driver, plan_file = write_plan(tmp_path,repo,git_commit,test_regex="t")
+    plan = json.loads(plan_file.read_text())
+    assert plan["options"]["test_regex"]=="t"
+    assert plan["machine"]["env_setup"]==["export A=planned"]
+    assert plan["builds"][0]["cmake_args"]["FOO"]=="foo"
+
+    # The config is not evaluated again, even if it changed
+    (repo / "cacts.yaml").write_text(CONFIG.replace("planned","changed"))
+    capsys.readouterr()
+    executor = cacts.Driver.from_plan(plan_file)
+    out = capsys.readouterr().out
+    assert "changed since the plan was generated" in out
+    assert "differs from the plan" not in out
+    assert executor._machine.env_setup==["export A=planned"]
+    assert vars(executor._builds[0])==vars(read_plan(plan_file)["builds"][0])
+    assert executor.get_plan_actions()==driver.get_plan_actions()
+
+    result = executor.run()
+    assert result.builds["dbg"].status=="passed"
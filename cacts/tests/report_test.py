@@ -0,0 +1,75 @@
+# JUnit and json reports of the test results
+
+import json
+import zlib
+import base64
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from cacts.report import write_build_report, write_unified_report, iter_test_details
+
+def make_test(name, status, output="", compress=False, labels=(), env=""):
+    if compress:
+        output = base64.b64encode(zlib.compress(output.encode())).decode()
+    else:
+        output = escape(output)
+    compression = ' encoding="base64" compression="gzip"' if compress else ""
+    labels = "".join(f"<Label>{l}</Label>" for l in labels)
+    return (f'<Test Status="{status}"><Name>{name}</Name><Results>'
+            '<NamedMeasurement type="numeric/double" name="Execution Time"><Value>1.5</Value></NamedMeasurement>'
+            '<NamedMeasurement type="text/string" name="Exit Value"><Value>2</Value></NamedMeasurement>'
+            '<NamedMeasurement type="text/string" name="Completion Status"><Value>Completed</Value></NamedMeasurement>'
+            '<NamedMeasurement type="numeric/double" name="Processors"><Value>4</Value></NamedMeasurement>'
+            f'<NamedMeasurement type="text/string" name="Environment"><Value>{env}</Value></NamedMeasurement>'
+            f'<Measurement><Value{compression}>{output}</Value></Measurement>'
+            f'</Results><Labels>{labels}</Labels></Test>')
+
+def make_build_dir(build_dir, tests):
+    tag_dir = build_dir / "Testing" / "20240101-0000"
+    tag_dir.mkdir(parents=True)
+    (build_dir / "Testing" / "TAG").write_text("20240101-0000\nExperimental\n")
+    (tag_dir / "Test.xml").write_text(f'<?xml version="1.0" encoding="UTF-8"?>\n<Site><Testing>{"".join(tests)}'
+                                      '</Testing></Site>')
+    return build_dir
+
+def test_iter_test_details(tmp_path):
+    build_dir = make_build_dir(tmp_path,[
+        make_test("a","passed",output="not kept",labels=["fast","unit"],
+                  env="FOO=1\nCTEST_RESOURCE_GROUP_0_DEVICES=id:00003,slots:1"),
+        make_test("b","failed",output="<&> x"*10,compress=True),
+    ])
+    a, b = iter_test_details(build_dir,max_chars=12)
+    assert a=={"name" : "a", "status" : "passed", "time" : 1.5, "labels" : ["fast", "unit"], "exit_value" : "2",
+               "completion" : "Completed", "processors" : 4, "resources" : ["group0:devices:id:00003,slots:1"],
+               "output" : None}
+    assert b["output"]=="[... 38 characters truncated ...]\n x<&> x<&> x"
+
+def test_reports(tmp_path):
+    dbg = make_build_dir(tmp_path / "dbg",[make_test("a","passed"), make_test("b","failed",output="oops <&>"),
+                                           make_test("c","notrun")])
+    opt = make_build_dir(tmp_path / "opt",[make_test("a","passed")])
+    (tmp_path / "new").mkdir()
+
+    assert write_build_report(dbg,"dbg")=={"build" : "dbg", "tests" : 3, "failures" : 1, "skipped" : 1, "time" : 4.5}
+    assert write_build_report(opt,"opt",failed_phase="memcheck")["failures"]==1
+    write_build_report(tmp_path / "new","new",failed_phase="configure")
+
+    totals = write_unified_report([dbg, opt, tmp_path / "new", tmp_path / "not_run"],
+                                  tmp_path / "report.xml",tmp_path / "report.json")
+    assert totals=={"tests" : 6, "failures" : 3, "skipped" : 1, "time" : 6.0}
+
+    junit = ET.parse(str(tmp_path / "report.xml")).getroot()
+    assert junit.attrib["tests"]=="6" and junit.attrib["failures"]=="3"
+    assert [s.attrib["name"] for s in junit]==["dbg", "opt", "new"]
+    cases = {(c.attrib["classname"],c.attrib["name"]) : c for c in junit.iter("testcase")}
+    assert cases[("dbg","b")].find("failure").text=="oops <&>"
+    assert cases[("dbg","b")].find("failure").attrib["message"]=="exit value 2 (Completed)"
+    assert cases[("dbg","c")].find("skipped") is not None
+    assert cases[("opt","memcheck")].find("failure").attrib["message"]=="opt failed at memcheck time"
+    assert cases[("new","configure")].find("failure") is not None
+    assert cases[("dbg","a")].find("properties/property").attrib=={"name" : "processors", "value" : "4"}
+
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["totals"]==totals
+    assert [(b["build"],[t["name"] for t in b["tests_details"]]) for b in report["builds"]] == \
+           [("dbg",["a", "b", "c"]), ("opt",["a", "memcheck"]), ("new",["configure"])]
@@ -0,0 +1,36 @@
+# Building in scratch, and syncing the results back to the work dir
+
+import json
+
+from cacts.scratch import setup_scratch_build_dir, sync_back, sync_in_background, wait_for_syncs, \
+                          has_room, is_stub, STUB_FILE
+
+def test_sync_back(tmp_path):
+    build_dir = tmp_path / "work" / "dbg"
+    scratch_build_dir = tmp_path / "scratch" / "dbg"
+    build_dir.parent.mkdir()
+    build_dir.mkdir()
+    (build_dir / "old.txt").write_text("old")
+
+    setup_scratch_build_dir(build_dir,scratch_build_dir,tmp_path / "trash")
+    assert build_dir.is_symlink() and not (build_dir / "old.txt").exists()
+
+    for f in ["CMakeCache.txt", "Testing/TAG", "Testing/123-456/Test.xml", "cacts_output.log",
+              "ctest_script.cmake", "src/foo.o", "summary.txt"]:
+        (build_dir / f).parent.mkdir(parents=True,exist_ok=True)
+        (build_dir / f).write_text(f)
+    assert not is_stub(build_dir)
+
+    sync_in_background(sync_back,build_dir,["summary.txt"])
+    wait_for_syncs()
+
+    assert not build_dir.is_symlink()
+    assert sorted(str(f.relative_to(build_dir)) for f in build_dir.rglob("*") if f.is_file()) == \
+           sorted(["Testing/TAG", "Testing/123-456/Test.xml", "cacts_output.log", "ctest_script.cmake",
+                   "summary.txt", STUB_FILE])
+    assert is_stub(build_dir)
+    assert json.loads((build_dir / STUB_FILE).read_text())["build_dir"]==str(scratch_build_dir)
+
+def test_has_room(tmp_path):
+    assert has_room(tmp_path / "scratch",0)[0]
+    assert not has_room(tmp_path / "scratch",2**70)[0]
@@ -0,0 +1,64 @@
+# Splitting the tests of a build type across shards
+
+import pytest
+
+import cacts
+from cacts.history import partition_by_cost
+from cacts.ctest_data import iter_test_results
+
+def test_partition_by_cost():
+    costs = {"a" : 10, "b" : 1, "c" : 1, "d" : 1, "e" : 7, "f" : 3}
+    parts = partition_by_cost(list(costs),costs,3)
+    assert sorted(sum(parts,[]))==sorted(costs)
+    assert [sum(costs[n] for n in p) for p in parts]==[10, 7, 6]
+    # The partition does not depend on the order of the names
+    assert partition_by_cost(sorted(costs,reverse=True),costs,3)==parts
+    # More parts than names
+    assert partition_by_cost(["a"],costs,3)==[["a"],[],[]]
+
+def get_driver(tmp_path, repo, shard):
+    return cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work",shard=shard)
+
+def test_shard_tests(tmp_path, repo):
+    tests = [f"t{i}" for i in range(10)]
+
+    # With a history, shards are balanced by cost. Tests without history cost as much as the average one.
+    driver = get_driver(tmp_path,repo,"1/3")
+    history = driver.get_test_history(driver._builds[0])
+    for i, name in enumerate(tests[:8]):
+        history.add(name,"passed",2.0 if i else 20.0)
+    history.save()
+
+    shards = [get_driver(tmp_path,repo,f"{i}/3").get_shard_tests(driver._builds[0],tests) for i in [1,2,3]]
+    assert sorted(sum(shards,[]))==tests
+    assert shards[0]==["t0"]
+    assert sorted(len(s) for s in shards[1:])==[4, 5]
+
+@pytest.mark.parametrize("shard",["0/2", "3/2", "1"])
+def test_invalid_shard(tmp_path, repo, shard):
+    with pytest.raises((RuntimeError,ValueError)):
+        get_driver(tmp_path,repo,shard)
+
+CMAKELISTS = """
+cmake_minimum_required(VERSION 3.9)
+project(Foo NONE)
+enable_testing()
+foreach (name IN ITEMS fast1 fast2 slow1 slow2)
+  add_test(NAME ${name} COMMAND true)
+endforeach()
+set_tests_properties(fast1 fast2 PROPERTIES LABELS "fast")
+set_tests_properties(slow1 slow2 PROPERTIES LABELS "slow;long")
+"""
+
+def test_shard_labels(tmp_path, repo, git_commit):
+    # Only the tests with the selected labels are split among the shards
+    (repo / "CMakeLists.txt").write_text(CMAKELISTS)
+    git_commit(repo,"labels")
+
+    ran = []
+    for i in [1,2]:
+        driver = cacts.Driver(machine_name="foo",root_dir=repo,work_dir=tmp_path / "work",
+                              shard=f"{i}/2",test_labels=["fast"])
+        assert driver.run()
+        ran.append([r["name"] for r in iter_test_results(driver.get_build_dir(driver._builds[0]))])
+    assert sorted(ran)==[["fast1"],["fast2"]]
@@ -0,0 +1,62 @@
+# Guard the startup time of get-mach-env, which runs in shell profiles and job scripts
+
+import os
+import sys
+import pathlib
+import subprocess
+
+CONFIG = """
+project:
+    name: Foo
+machines:
+    default:
+        num_bld_res: 1
+    foo:
+        env_setup: ["export B=${machine.name}", "export D=${machine.mach_file}"]
+        mach_file: /does/not/need/to/exist
+"""
+
+# Modules that get-mach-env must not import when the env setup is cached
+HEAVY_MODULES = ["yaml", "psutil", "asyncio", "cacts.cacts", "cacts.parse_config", "cacts.machine"]
+
+def get_mach_env(tmp_path):
+    cmd = [sys.executable, "-X", "importtime", "-c",
+           "import sys; sys.argv=['get-mach-env','foo']; import cacts; cacts.get_mach_env()"]
+    env = dict(os.environ,
+               PYTHONPATH=str(pathlib.Path(__file__).parents[2]),
+               XDG_CACHE_HOME=str(tmp_path / "cache"))
+    result = subprocess.run(cmd,cwd=tmp_path,env=env,capture_output=True,text=True,check=True)
+
+    # Lines are 'import time: self [us] | cumulative | module'
+    imports = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                imports[module.strip()] = int(cumulative)
+    return result.stdout.strip(), imports
+
+def test_import_is_lazy(tmp_path):
+    result = subprocess.run([sys.executable, "-c", "import sys, cacts; print('cacts.cacts' in sys.modules)"],
+                            env=dict(os.environ,PYTHONPATH=str(pathlib.Path(__file__).parents[2])),
+                            capture_output=True,text=True,check=True)
+    assert result.stdout.strip()=="False"
+
+def test_cached_mach_env(tmp_path):
+    (tmp_path / "cacts.yaml").write_text(CONFIG)
+
+    out, imports = get_mach_env(tmp_path)
+    assert out=="export B=foo && export D=/does/not/need/to/exist"
+    assert "cacts.parse_config" in imports
+
+    out, imports = get_mach_env(tmp_path)
+    assert out=="export B=foo && export D=/does/not/need/to/exist"
+    for m in HEAVY_MODULES:
+        assert m not in imports, f"{m} imported with a cached env setup"
+    # Generous bound, to catch regressions (a few tens of ms are expected)
+    assert imports["cacts.get_mach_env"] < 250000
+
+    # A change in the config invalidates the cache
+    (tmp_path / "cacts.yaml").write_text(CONFIG.replace("B=","C="))
+    out, imports = get_mach_env(tmp_path)
+    assert out=="export C=foo && export D=/does/not/need/to/exist"
@@ -0,0 +1,94 @@
+# Expansion of ${obj.attr...} expressions in the config
+
+import pytest
+
+from cacts.template import Resolver, expand_variables, compile_template
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def uses_gpu(self):
+        return self.gpu_arch is not None
+
+def expand(text, **attrs):
+    machine = Obj(name="mach", num=4, gpu_arch=None, tags=["a","b"], env={"CC" : "gcc"}, _secret="x")
+    build = Obj(name="dbg", **attrs)
+    return Resolver({"machine" : machine, "build" : build}).expand(text)
+
+def test_literals():
+    assert expand("no expressions")=="no expressions"
+    assert expand("${machine.name}-${build.name}")=="mach-dbg"
+    assert expand("$machine.name {machine.name}")=="$machine.name {machine.name}"
+    # Only ${obj.attr...} is an expression
+    assert expand("${__import__('os')}")=="${__import__('os')}"
+
+def test_operators():
+    assert expand("${machine.num + 2*3}")=="10"
+    assert expand("${machine.num * (2 + 3)}")=="20"
+    assert expand("${machine.num - 2 - 1}")=="1"
+    assert expand("${machine.num // 3 % 2}")=="1"
+    assert expand("${machine.num * -1 + 1}")=="-3"
+    assert expand("${machine.num > 1 < 4 <= machine.num}")=="True"
+    assert expand("${machine.num > 1 and machine.name or 'none'}")=="mach"
+    assert expand("${machine.gpu_arch or not machine.num or 'x'}")=="x"
+    assert expand("${machine.name if machine.uses_gpu() else 'no'}")=="no"
+    assert expand("${machine.name not in machine.tags}")=="True"
+    assert expand("${machine.gpu_arch is None}${machine.name is not None}")=="TrueTrue"
+    assert expand("${machine.tags[-1]}${machine.name[1:3]}${machine.env['CC']}")=="bacgcc"
+    assert expand("${machine.name.upper()}")=="MACH"
+    assert expand("${machine.num + len(machine.tags) + max(1,machine.num)}")=="10"
+    assert expand("${machine.tags + [str(machine.num)]}")=="['a', 'b', '4']"
+
+def test_dependencies():
+    # Attributes can reference each other, in any order
+    build = Obj(c="${build.b}-c", b="${build.a}-b", a="${machine.name}")
+    machine = Obj(name="mach")
+    expand_variables(build,{"machine" : machine, "build" : build})
+    assert (build.a, build.b, build.c)==("mach", "mach-b", "mach-b-c")
+
+    # Nested structures are expanded too
+    build = Obj(args={"X" : ["${build.name}"]}, name="${machine.name}")
+    expand_variables(build,{"machine" : machine, "build" : build})
+    assert build.args=={"X" : ["mach"]}
+
+def test_cycles():
+    build = Obj(a="${build.b}", b="${build.c}", c="x${build.a}")
+    with pytest.raises(RuntimeError,match=r"Circular reference in the config: build.a -> build.b -> build.c -> build.a"):
+        expand_variables(build,{"build" : build})
+
+    build = Obj(a="${build.a}")
+    with pytest.raises(RuntimeError,match="Circular reference"):
+        expand_variables(build,{"build" : build})
+
+@pytest.mark.parametrize("expr,error",[
+    ("machine._secret", "private attributes are not allowed"),
+    ("machine.name.__class__", "private attributes are not allowed"),
+    ("machine.name and __import__('os')", "only calls to"),
+    ("machine.name and open('/etc/passwd')", "only calls to"),
+    ("machine.name.encode()", "only calls to"),
+    ("machine.uses_gpu(1)", "only calls to"),
+    ("machine.name.format(machine)", "only calls to"),
+    ("machine.name.replace(old='a',new='b')", "keyword arguments are not allowed"),
+    ("machine.tags and [x for x in machine.tags]", "ListComp is not allowed"),
+    ("machine.num and (lambda: 1)", "Lambda is not allowed"),
+    ("machine.num ** 2", "Pow is not allowed"),
+    ("machine.name +", "Invalid expression"),
+])
+def test_rejected(expr, error):
+    with pytest.raises(RuntimeError,match=error):
+        expand("${" + expr + "}")
+
+def test_errors():
+    with pytest.raises(RuntimeError,match="has no attribute 'foo'"):
+        expand("${machine.foo}")
+    with pytest.raises(RuntimeError,match="Invalid configuration"):
+        expand("${project.name}")
+    with pytest.raises(RuntimeError,match="ZeroDivisionError"):
+        expand("${machine.num / 0}")
+    with pytest.raises(RuntimeError,match="Invalid name 'x'"):
+        expand("${machine.tags[x]}")
+
+def test_templates_are_parsed_once():
+    assert compile_template("${machine.name}") is compile_template("${machine.name}")
+    assert compile_template("${machine.name}-${build.name}").refs=={("machine","name"), ("build","name")}
@@ -0,0 +1,44 @@
+# Deleting build trees in the background, and garbage collection of the work dir
+
+import os
+import time
+
+from cacts.trash import move_to_trash, empty_trash_in_background, get_trash_entries, collect_garbage
+from cacts.utils import get_tree_size
+
+def make_tree(path, size=0):
+    (path / "sub" / "dir").mkdir(parents=True)
+    (path / "sub" / "dir" / "file").write_bytes(b"x"*size)
+    (path / "link").symlink_to(path / "sub",target_is_directory=True)
+    (path / "cacts_output.log").write_text("")
+    return path
+
+def test_empty_trash_in_background(tmp_path):
+    tree = make_tree(tmp_path / "tree")
+    trash_dir = tmp_path / "trash"
+    assert move_to_trash(tree,trash_dir).parent==trash_dir
+    assert move_to_trash(tree,trash_dir) is None
+    assert not tree.exists()
+
+    start = time.monotonic()
+    empty_trash_in_background(trash_dir)
+    while get_trash_entries(trash_dir) and time.monotonic()-start<30:
+        time.sleep(0.1)
+    assert get_trash_entries(trash_dir)==[]
+    # The deleter log stays
+    assert (trash_dir / ".deleter.log").exists()
+
+def test_collect_garbage(tmp_path):
+    work_dir = tmp_path / "work"
+    old = make_tree(work_dir / "old",2**20)
+    big = make_tree(work_dir / "big",2**21)
+    make_tree(work_dir / "small",2**20)
+    keep = make_tree(work_dir / "keep",2**20)
+    (work_dir / "not_a_build").mkdir()
+    os.utime(old,(0,0))
+    os.utime(big,(time.time()-100,)*2)
+    assert get_tree_size(big)>=2**21
+
+    collected = collect_garbage(work_dir,tmp_path / "trash",keep=[keep],max_age=1,max_size=2.5/1024)
+    assert collected==[old,big]
+    assert sorted(d.name for d in work_dir.iterdir())==["keep", "not_a_build", "small"]
@@ -0,0 +1,56 @@
+# The watchdog kills tests that run much longer than usual
+
+import time
+
+from cacts.utils import run_cmd
+from cacts import watchdog as watchdog_module
+from cacts.watchdog import Watchdog
+
+def test_slow_test_is_killed(tmp_path):
+    def get_tests():
+        # Like get_ctest_tests, this runs a command while the event loop is running
+        stat, out, _ = run_cmd("echo sleep 30")
+        assert stat==0
+        return [{"name" : "slow", "command" : out.split()}, {"name" : "other", "command" : ["/bin/false"]}]
+
+    watchdog = Watchdog("foo",tmp_path / "traces",test_timeout_factor=2,
+                        test_costs={"slow" : 0.1},get_tests=get_tests,min_test_time=0)
+    watchdog.poll_interval = 0.2
+    watchdog.max_traces = 0
+
+    start = time.monotonic()
+    stat, _, _ = run_cmd("sleep 30; echo done",monitors=[watchdog])
+    assert time.monotonic()-start < 20
+    assert [e["test"] for e in watchdog.events] == ["slow"]
+    assert "more than 2 times its average" in watchdog.events[0]["reason"]
+
+def test_tests_not_known_yet(tmp_path):
+    calls = []
+    def get_tests():
+        calls.append(1)
+        if len(calls)==1:
+            raise RuntimeError("ERROR: no tests yet")
+        return []
+
+    watchdog = Watchdog("foo",tmp_path,test_timeout_factor=2,test_costs={"t" : 1},get_tests=get_tests)
+    watchdog.poll_interval = 0.1
+    stat, out, _ = run_cmd("sleep 1; echo ok",monitors=[watchdog])
+    assert (stat, out) == (0, "ok")
+    # An empty list is not cached: the tests may not be configured yet
+    assert len(calls)>2
+    assert not watchdog.events
+
+def test_test_killed_once(tmp_path, monkeypatch):
+    # A killed test can stay around for a while (e.g., until its parent reaps
+    # it): it must not be killed (and reported) again
+    killed = []
+    monkeypatch.setattr(watchdog_module,"kill_process_tree",killed.append)
+
+    watchdog = Watchdog("foo",tmp_path,test_timeout_factor=2,test_costs={"slow" : 0.1},
+                        get_tests=lambda: [{"name" : "slow", "command" : ["sleep", "1.5"]}],min_test_time=0)
+    watchdog.poll_interval = 0.1
+    watchdog.max_traces = 0
+    stat, _, _ = run_cmd("sleep 1.5; echo done",monitors=[watchdog])
+    assert stat==0
+    assert len(killed)==1
+    assert [e["test"] for e in watchdog.events]==["slow"]
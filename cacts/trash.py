@@ -0,0 +1,172 @@
+"""
+Utilities to get rid of (possibly huge) build trees without waiting for them.
+Trees are atomically renamed into a trash folder on the same file system,
+and deleted by a detached process, with several threads unlinking files
+concurrently (which pays off on parallel file systems, like Lustre).
+If the deletion is interrupted, the next run resumes it.
+
+This module only uses the standard library, since it is also run as a script
+(the background deleter), without importing the cacts package.
+"""
+
+import os
+import sys
+import time
+import pathlib
+import subprocess
+import concurrent.futures
+
+###############################################################################
+def move_to_trash(path, trash_dir):
+###############################################################################
+    """
+    Rename path into trash_dir, and return its new location (or None if there
+    was nothing to move). Symlinks are just removed. trash_dir must be on the
+    same file system as path.
+    """
+
+    path = pathlib.Path(path)
+    if path.is_symlink():
+        path.unlink()
+        return None
+    if not path.exists():
+        return None
+
+    trash_dir = pathlib.Path(trash_dir)
+    trash_dir.mkdir(parents=True,exist_ok=True)
+    dst = trash_dir / f"{path.name}.{time.strftime('%Y%m%d-%H%M%S')}.{os.getpid()}"
+    try:
+        path.rename(dst)
+    except OSError:
+        # Not on the same file system: no way around deleting it now
+        delete_tree(path)
+        return None
+    return dst
+
+###############################################################################
+def unlink_all(root, names):
+###############################################################################
+    for name in names:
+        try:
+            os.unlink(os.path.join(root,name))
+        except FileNotFoundError:
+            # Another deleter got there first
+            pass
+
+###############################################################################
+def delete_tree(path, max_workers=8):
+###############################################################################
+    """
+    Delete a folder (or file). The files of each folder are unlinked by a pool
+    of threads, then the (empty) folders are removed, deepest first.
+    """
+
+    path = str(path)
+    if os.path.islink(path) or not os.path.isdir(path):
+        unlink_all(os.path.dirname(path),[os.path.basename(path)])
+        return
+
+    dirs = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for root, subdirs, files in os.walk(path):
+            dirs.append(root)
+            # Symlinks to folders are listed in subdirs, but walk does not follow them
+            links = [d for d in subdirs if os.path.islink(os.path.join(root,d))]
+            if files or links:
+                futures.append(executor.submit(unlink_all,root,files+links))
+        for f in futures:
+            f.result()
+
+    for d in reversed(dirs):
+        try:
+            os.rmdir(d)
+        except OSError:
+            # Already removed, or another deleter is still emptying it
+            pass
+
+###############################################################################
+def empty_trash(trash_dir, max_workers=8):
+###############################################################################
+    """
+    Delete everything in trash_dir (except hidden files, like the deleter
+    log). Several deleters can run at the same time.
+    """
+
+    for entry in get_trash_entries(trash_dir):
+        delete_tree(entry,max_workers)
+
+###############################################################################
+def get_trash_entries(trash_dir):
+###############################################################################
+    trash_dir = pathlib.Path(trash_dir)
+    if not trash_dir.exists():
+        return []
+    return sorted(e for e in trash_dir.iterdir() if not e.name.startswith("."))
+
+###############################################################################
+def empty_trash_in_background(trash_dir, max_workers=8):
+###############################################################################
+    """
+    Start a detached process emptying trash_dir, which keeps going after
+    this process exits. Its output goes to trash_dir/.deleter.log
+    The process we start forks the deleter and exits right away, so that
+    we can reap it without waiting for the deletion.
+    """
+
+    trash_dir = pathlib.Path(trash_dir)
+    if not get_trash_entries(trash_dir):
+        return
+
+    with open(trash_dir / ".deleter.log","a") as log:
+        subprocess.run([sys.executable,__file__,str(trash_dir),str(max_workers)],
+                       stdin=subprocess.DEVNULL,stdout=log,stderr=subprocess.STDOUT,
+                       start_new_session=True)
+
+###############################################################################
+def collect_garbage(work_dir, trash_dir, keep, max_age=None, max_size=None):
+###############################################################################
+    """
+    Move to trash_dir the build dirs in work_dir that were not used for more
+    than max_age days, and then the least recently used ones, until the rest
+    take at most max_size GB. Build dirs in keep are never collected.
+    Returns the list of collected build dirs.
+    """
+
+    # Not at the top, since this file also runs as a script
+    from .utils import get_tree_size
+
+    keep = set(pathlib.Path(k).name for k in keep)
+    candidates = []
+    for d in pathlib.Path(work_dir).iterdir():
+        if d.name.startswith(".") or d.name in keep or not d.is_dir() or d.is_symlink():
+            continue
+        # Only touch folders that cacts created
+        if (d / "CMakeCache.txt").exists() or (d / "Testing").exists() or any(d.glob("cacts_*")):
+            candidates.append((d.stat().st_mtime,d))
+
+    # Least recently used first
+    candidates.sort()
+    now = time.time()
+    collected = []
+    if max_age is not None:
+        while candidates and now-candidates[0][0]>max_age*86400:
+            collected.append(candidates.pop(0)[1])
+
+    if max_size is not None:
+        sizes = [get_tree_size(d) for _, d in candidates]
+        total = sum(sizes) + sum(get_tree_size(pathlib.Path(work_dir) / k) for k in keep)
+        while candidates and total>max_size*2**30:
+            total -= sizes.pop(0)
+            collected.append(candidates.pop(0)[1])
+
+    for d in collected:
+        move_to_trash(d,trash_dir)
+
+    return collected
+
+if __name__ == "__main__":
+    # Let the parent reap us, and go on in the background (see empty_trash_in_background)
+    if os.fork()>0:
+        os._exit(0)
+    empty_trash(sys.argv[1],int(sys.argv[2]) if len(sys.argv)>2 else 8)
@@ -5,10 +5,13 @@ Utilities
 import os
 import sys
 import re
+import hashlib
 import subprocess
-import psutil
 import argparse
 
+# NOTE: asyncio (via engine.py) and psutil are imported where needed, since they
+#       take a large part of the startup time of short commands (e.g., get-mach-env)
+
 ###############################################################################
 def expect(condition, error_msg, exc_type=RuntimeError, error_prefix="ERROR:"):
 ###############################################################################
@@ -29,11 +32,17 @@ def expect(condition, error_msg, exc_type=RuntimeError, error_prefix="ERROR:"):
 ###############################################################################
 def run_cmd(cmd, from_dir=None, verbose=None, dry_run=False, env_setup=None,
             arg_stdout=subprocess.PIPE, arg_stderr=subprocess.PIPE,
-            combine_output=False):
+            combine_output=False, timeout=None, prefix="", log_file=None, monitors=None):
 ###############################################################################
     """
     Wrapper around subprocess to make it much more convenient to run shell commands
 
+    Streams with arg_stdout/arg_stderr set to None are printed line by line as the
+    command runs (with the given prefix), and are not returned. If log_file is set,
+    both streams are appended to it. If timeout is set, the command is killed after
+    that many seconds, and the return code is 124. Monitors (see watchdog.py)
+    watch the command while it runs, and can kill it.
+
     >>> run_cmd('ls file_i_hope_doesnt_exist')[0] != 0
     True
     """
@@ -43,32 +52,28 @@ def run_cmd(cmd, from_dir=None, verbose=None, dry_run=False, env_setup=None,
     if env_setup:
         cmd = f"{env_setup} && {cmd}"
 
-    arg_stderr = subprocess.STDOUT if combine_output else arg_stderr
-
     from_dir = str(from_dir) if from_dir else from_dir
 
     if verbose:
-        print(f"RUN: {cmd}\nFROM: {os.getcwd() if from_dir is None else from_dir}")
+        print(f"{prefix}RUN: {cmd}\n{prefix}FROM: {os.getcwd() if from_dir is None else from_dir}",flush=True)
 
     if dry_run:
         return 0, "", ""
 
-    proc = subprocess.Popen(cmd,
-                            shell=True,
-                            stdout=arg_stdout,
-                            stderr=arg_stderr,
-                            stdin=None,
-                            text=True, # automatically decode output bytes to string
-                            cwd=from_dir)
+    from .engine import run_cmd_sync, run_cmd_async, run_coroutine
 
-    output, errput = proc.communicate(None)
-    if output is not None:
-        output = output.strip()
-    if errput is not None:
-        errput = errput.strip()
-    proc.wait()
+    kwargs = dict(from_dir=from_dir,
+                  echo_stdout=arg_stdout is None,
+                  echo_stderr=arg_stderr is None,
+                  combine_output=combine_output or arg_stderr==subprocess.STDOUT,
+                  prefix=prefix,log_file=log_file,timeout=timeout)
 
-    return proc.returncode, output, errput
+    # Monitors are coroutines, which need an event loop. Other commands run
+    # without one, so that run_cmd works from async code too
+    if monitors:
+        return run_coroutine(run_cmd_async(cmd,monitors=monitors,**kwargs))
+
+    return run_cmd_sync(cmd,**kwargs)
 
 ###############################################################################
 def run_cmd_no_fail(cmd, from_dir=None, verbose=None, dry_run=False,env_setup=None,
@@ -122,6 +127,7 @@ class GoodFormatter(
 ###############################################################################
 def logical_cores_per_physical_core():
 ###############################################################################
+    import psutil
     return psutil.cpu_count() // psutil.cpu_count(logical=False)
 
 ###############################################################################
@@ -149,6 +155,23 @@ def get_cpu_ids_from_slurm_env_var():
 
     return cpu_ids
 
+###############################################################################
+def get_available_cpu_ids():
+###############################################################################
+    """
+    Get the sorted list of ids of the CPUs available to this process and its children
+    """
+    if 'SLURM_CPU_BIND_LIST' in os.environ:
+        cpu_ids = get_cpu_ids_from_slurm_env_var()
+    else:
+        if hasattr(os,"sched_getaffinity"):
+            cpu_ids = list(os.sched_getaffinity(0))
+        else:
+            import psutil
+            cpu_ids = list(psutil.Process().cpu_affinity())
+
+    return sorted(cpu_ids)
+
 ###############################################################################
 def get_available_cpu_count(logical=True):
 ###############################################################################
@@ -156,10 +179,7 @@ def get_available_cpu_count(logical=True):
     Get number of CPUs available to this process and its children. logical=True
     will include hyperthreads, logical=False will return only physical cores
     """
-    if 'SLURM_CPU_BIND_LIST' in os.environ:
-        cpu_count = len(get_cpu_ids_from_slurm_env_var())
-    else:
-        cpu_count = len(psutil.Process().cpu_affinity())
+    cpu_count = len(get_available_cpu_ids())
 
     if not logical:
         hyperthread_ratio = logical_cores_per_physical_core()
@@ -185,107 +205,117 @@ class SharedArea(object):
         os.umask(self._orig_umask)
 
 ###############################################################################
-def expand_variables(tgt_obj, src_obj_dict):
+def find_commands(tgt_obj,found):
 ###############################################################################
+    """
+    Fill the dict found with cmd->string for each bash command of the form $(...)
+    appearing in the strings of tgt_obj (the string is used for error messages)
+    """
 
     # Only user-defined types have the __dict__ attribute
     if hasattr(tgt_obj,'__dict__'):
-        for name,val in vars(tgt_obj).items():
-            setattr(tgt_obj,name,expand_variables(val,src_obj_dict))
+        for val in vars(tgt_obj).values():
+            find_commands(val,found)
 
     elif isinstance(tgt_obj,dict):
-        for name,val in tgt_obj.items():
-            tgt_obj[name] = expand_variables(val,src_obj_dict)
+        for val in tgt_obj.values():
+            find_commands(val,found)
 
     elif isinstance(tgt_obj,list):
-        for i,val in enumerate(tgt_obj):
-            tgt_obj[i] = expand_variables(val,src_obj_dict)
+        for val in tgt_obj:
+            find_commands(val,found)
 
     elif isinstance(tgt_obj,str):
-        pattern = r'\$\{(\w+)\.(\w+)(.*?)\}'
-
-        matches = re.findall(pattern,tgt_obj)
-        for obj_name, att_name, expression in matches:
-            expect (obj_name in src_obj_dict.keys(),
-                    f"Invalid configuration ${{{obj_name}.{att_name}}}. Must be ${{obj.attr}}, with obj in {src_obj_dict.keys()}")
-            obj = src_obj_dict[obj_name]
-            expect (hasattr(obj,att_name),
-                    f"{obj_name} has no attribute '{att_name}'\n"
-                    f"  - existing attributes: {dir(obj)}\n")
-
-            eval_str = f"obj.{att_name}{expression}"
-            expect (safe_expression(expression),
-                    f"Cannot evaluate expression '{obj_name}.{att_name}{expression}'. A dangerous pattern was detected in the expression")
-            try:
-                result = eval(eval_str)
-                tgt_obj = tgt_obj.replace(f"${{{obj_name}.{att_name}{expression}}}",str(result))
-            except AttributeError:
-                print (f"Could not evaluate expression {tgt_obj}.\n")
-                raise
-
-        expect (not re.findall(pattern,tgt_obj),
-                f"Something went wrong while replacing ${{..}} patterns in string '{tgt_obj}'\n")
-
-    return tgt_obj
+        for cmd in re.findall(r'\$\((.*?)\)',tgt_obj):
+            found.setdefault(cmd,tgt_obj)
 
-#########################################################
-def safe_expression(expression):
-#########################################################
-
-    # List of dangerous patterns
-    dangerous_patterns = [
-        r'\bimport\b',           # Import statements
-        r'\bexec\b',             # Exec statements
-        r'\beval\b',             # Eval statements
-        r'\bos\.system\b',       # OS system calls
-        r'\bsubprocess\.run\b',  # Subprocess calls
-        r'\bglobals\b',          # Globals access
-        r'\blocals\b',           # Locals access
-        r';',                    # Multiple statements
-        r'\bopen\b',             # File access
-        r'\bos\.getenv\b',       # Environment variable access
-        r'\b__\w+__\b'           # Catch all for any double underscore attributes
-    ]
-
-    # Check for any dangerous patterns
-    for pattern in dangerous_patterns:
-        if re.search(pattern, expression):
-            return False  # Unsafe expression
-    
-    return True  # Safe expression
+    return found
 
 ###############################################################################
-def evaluate_commands(tgt_obj,env_setup=None):
+def replace_commands(tgt_obj,results):
 ###############################################################################
 
     # Only user-defined types have the __dict__ attribute
     if hasattr(tgt_obj,'__dict__'):
         for name,val in vars(tgt_obj).items():
-            setattr(tgt_obj,name,evaluate_commands(val,env_setup))
+            setattr(tgt_obj,name,replace_commands(val,results))
 
     elif isinstance(tgt_obj,dict):
         for name,val in tgt_obj.items():
-            tgt_obj[name] = evaluate_commands(val,env_setup)
+            tgt_obj[name] = replace_commands(val,results)
 
     elif isinstance(tgt_obj,list):
         for i,val in enumerate(tgt_obj):
-            tgt_obj[i] = evaluate_commands(val,env_setup)
+            tgt_obj[i] = replace_commands(val,results)
 
     elif isinstance(tgt_obj,str):
-        pattern = r'\$\((.*?)\)'
+        for cmd in re.findall(r'\$\((.*?)\)',tgt_obj):
+            tgt_obj = tgt_obj.replace(f"$({cmd})",results[cmd])
 
-        matches = re.findall(pattern,tgt_obj)
-        for cmd in matches:
-            stat,out,err = run_cmd(cmd,env_setup=env_setup)
-            expect (stat==0,
-                    "Could not evaluate the command.\n"
-                    f"  - original string: {tgt_obj}\n"
-                    f"  - command: {cmd}\n"
-                    f"  - error: {err}\n")
+    return tgt_obj
 
-            tgt_obj = tgt_obj.replace(f"$({cmd})",out)
+###############################################################################
+def evaluate_commands(tgt_obj,env_setup=None,fields=None):
+###############################################################################
+    """
+    Replace bash commands of the form $(...) in the strings of tgt_obj (or only
+    in the given attributes of tgt_obj) with their output. All the commands are
+    run concurrently, each one only once.
+    """
 
-    return tgt_obj
+    if fields is not None:
+        values = evaluate_commands({f : getattr(tgt_obj,f) for f in fields},env_setup)
+        for f, value in values.items():
+            setattr(tgt_obj,f,value)
+        return tgt_obj
+
+    found = find_commands(tgt_obj,{})
+    cmds = list(found.keys())
+    if not cmds:
+        return tgt_obj
+
+    from .engine import run_cmds_concurrently
+
+    results = {}
+    for cmd, (stat,out,err) in zip(cmds,run_cmds_concurrently(cmds,env_setup=env_setup)):
+        expect (stat==0,
+                "Could not evaluate the command.\n"
+                f"  - original string: {found[cmd]}\n"
+                f"  - command: {cmd}\n"
+                f"  - error: {err}\n")
+        results[cmd] = out
+
+    return replace_commands(tgt_obj,results)
+
+###############################################################################
+def get_tree_size(path):
+###############################################################################
+    """
+    Return the disk usage (in bytes) of a folder
+    """
+
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root,name)).st_blocks*512
+            except FileNotFoundError:
+                pass
+    return size
+
+###############################################################################
+def sha256_file(path):
+###############################################################################
+    """
+    Return the sha256 hex digest of the file content, read in chunks
+    """
+
+    h = hashlib.sha256()
+    with open(path,"rb") as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
 
 ###############################################################################
 def str_to_bool(s, var_name):
@@ -330,3 +360,48 @@ def get_current_sha(short=False,repo=None):
     """
 
     return run_cmd_no_fail(f"git rev-parse {'--short' if short else ''} HEAD",from_dir=repo)
+
+###############################################################################
+def is_clean_tree(repo=None, exclude=None):
+###############################################################################
+    """
+    Check that the whole repo (even if repo is one of its subfolders) has no
+    local modification, including untracked files, consistently with get_tree_hash.
+    Paths in the exclude list (e.g., a work dir inside the repo) are ignored.
+    """
+
+    cmd = "git status --porcelain"
+    if exclude:
+        cmd += " -- :/ " + " ".join(f"':(exclude){e}'" for e in exclude)
+
+    return run_cmd_no_fail(cmd,from_dir=repo)==""
+
+###############################################################################
+def get_tree_hash(repo=None):
+###############################################################################
+    """
+    Return the hash of the git tree of the current HEAD commit (of the whole
+    repo, even if repo is one of its subfolders)
+    """
+
+    return run_cmd_no_fail("git rev-parse HEAD^{tree}",from_dir=repo)
+
+###############################################################################
+def get_env_snapshot(env_setup=None):
+###############################################################################
+    """
+    Return a dict with the environment obtained after running env_setup.
+    Variables that change from one shell/job to the next and do not affect
+    builds or tests (e.g., job ids or terminal settings) are left out.
+    """
+
+    volatile = re.compile(r'^(_|PWD|OLDPWD|SHLVL|HOSTNAME|TERM\w*|DISPLAY|LS_COLORS|PS\d|'
+                          r'RANDOM|TMPDIR|SSH_\w+|XDG_\w+|SLURM_\w+|PBS_\w+|LSB_\w+|\w+_PID)$')
+
+    env = {}
+    for line in run_cmd_no_fail("env -0",env_setup=env_setup).split("\0"):
+        name, sep, value = line.partition("=")
+        if sep and not volatile.match(name):
+            env[name] = value
+
+    return env
@@ -0,0 +1,250 @@
+"""
+Monitors for the process tree of a ctest run (see run_cmd_async).
+
+The Watchdog detects runs that make no progress (no cpu time and no output),
+and tests that run much longer than usual. Stuck processes get their stack
+traces captured (with gdb or py-spy, if available), and are then killed, so
+that their resources are freed.
+
+The CancelMonitor terminates the run when a cancel file appears, e.g.,
+when another build type failed and --fail-fast was used.
+"""
+
+import time
+import json
+import shutil
+import asyncio
+import pathlib
+import datetime
+
+import psutil
+
+from .engine import run_cmd_async, kill_process_tree, terminate_process_tree
+
+###############################################################################
+class Watchdog(object):
+###############################################################################
+    """
+    Monitor the process tree of a command. Events (what was killed and why)
+    are stored in self.events.
+
+      - stall_timeout: if the whole tree accumulates no cpu time, spawns/reaps
+        no process, and writes no output for this many seconds, it is killed
+      - test_timeout_factor: a test running longer than this many times its
+        average time (and at least min_test_time seconds) is killed
+      - test_costs: dict test_name->average time (in seconds)
+      - get_tests: callable returning the ctest tests (see get_ctest_tests),
+        used to recognize test processes by their command line. It is called
+        in a worker thread, so it can block (e.g., run ctest).
+    """
+
+    # Do not trace too many processes per event
+    max_traces = 5
+
+    def __init__(self, name, trace_dir, stall_timeout=None, test_timeout_factor=None,
+                 test_costs=None, get_tests=None, min_test_time=60):
+        self.name                = name
+        self.trace_dir           = pathlib.Path(trace_dir)
+        self.stall_timeout       = stall_timeout
+        self.test_timeout_factor = test_timeout_factor
+        self.test_costs          = test_costs or {}
+        self.get_tests           = get_tests
+        self.min_test_time       = min_test_time
+        self.events              = []
+
+        self._commands = None
+        # (pid,create_time) of the tests killed, which can still be around
+        # for a while (e.g., until their parent reaps them)
+        self._killed = set()
+        self.poll_interval = max(1,min(30,stall_timeout/5)) if stall_timeout else 10
+
+    ###########################################################################
+    async def watch(self, pid, last_output_time):
+    ###########################################################################
+        """
+        Monitor the tree rooted at pid until cancelled. last_output_time is a
+        callable returning the (time.monotonic) time of the last output line.
+        """
+
+        last_progress = time.monotonic()
+        last_cpu  = 0.0
+        last_pids = set()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+
+            procs = self.get_tree(pid)
+            now = time.monotonic()
+
+            cpu = 0.0
+            for p in procs:
+                try:
+                    t = p.cpu_times()
+                    cpu += t.user + t.system
+                except psutil.Error:
+                    pass
+            pids = set(p.pid for p in procs)
+
+            if cpu>last_cpu+0.01 or pids!=last_pids or last_output_time()>last_progress:
+                last_progress = now
+            last_cpu, last_pids = cpu, pids
+
+            if self.stall_timeout is not None and now-last_progress>self.stall_timeout:
+                await self.kill(pid,procs,f"no cpu or output progress for {int(now-last_progress)} seconds")
+                return
+
+            if self.test_timeout_factor is not None:
+                for test, proc in await self.find_tests(pid,procs):
+                    key = (proc.pid,proc.create_time())
+                    if key in self._killed:
+                        continue
+                    elapsed = time.time() - proc.create_time()
+                    limit = max(self.test_timeout_factor*self.test_costs[test],self.min_test_time)
+                    if elapsed>limit:
+                        self._killed.add(key)
+                        await self.kill(proc.pid,self.get_tree(proc.pid),
+                                        f"test {test} ran for {int(elapsed)} seconds, more than "
+                                        f"{self.test_timeout_factor} times its average of "
+                                        f"{self.test_costs[test]:.1f} seconds",test=test)
+
+    ###########################################################################
+    def get_tree(self, pid):
+    ###########################################################################
+        try:
+            root = psutil.Process(pid)
+            return [root] + root.children(recursive=True)
+        except psutil.Error:
+            return []
+
+    ###########################################################################
+    async def find_tests(self, pid, procs):
+    ###########################################################################
+        """
+        Return (test_name,process) for the running tests with a known cost.
+        Tests are the processes whose command line is the command of a test.
+        """
+
+        if self._commands is None:
+            if self.get_tests is None:
+                return []
+            try:
+                tests = await asyncio.get_running_loop().run_in_executor(None,self.get_tests)
+            except RuntimeError:
+                # ctest cannot list the tests yet (e.g., still configuring). Try later.
+                return []
+            if not tests:
+                return []
+            self._commands = {tuple(t["command"]) : t["name"] for t in tests if t["name"] in self.test_costs}
+
+        found = []
+        for p in procs:
+            try:
+                test = self._commands.get(tuple(p.cmdline()),None)
+            except psutil.Error:
+                continue
+            if test is not None and p.pid!=pid:
+                found.append((test,p))
+
+        return found
+
+    ###########################################################################
+    async def kill(self, pid, procs, reason, test=None):
+    ###########################################################################
+        print(f"[{self.name}] WATCHDOG: {reason}. Capturing stack traces and killing process {pid}.",flush=True)
+
+        traces = []
+        # The leaves of the tree are where the work (or the waiting) happens
+        parents = set()
+        for p in procs:
+            try:
+                parents.add(p.ppid())
+            except psutil.Error:
+                pass
+        leaves = [p for p in procs if p.pid not in parents]
+        for p in leaves[:self.max_traces]:
+            trace = await self.capture_trace(p)
+            if trace is not None:
+                traces.append(str(trace))
+
+        try:
+            cmd = " ".join(psutil.Process(pid).cmdline())
+        except psutil.Error:
+            cmd = None
+        kill_process_tree(pid)
+
+        self.events.append({
+            "time"   : datetime.datetime.now().isoformat(timespec="seconds"),
+            "build"  : self.name,
+            "test"   : test,
+            "reason" : reason,
+            "pid"    : pid,
+            "cmd"    : cmd,
+            "traces" : traces,
+        })
+
+    ###########################################################################
+    async def capture_trace(self, proc):
+    ###########################################################################
+        """
+        Dump the stack traces of a process to a file in trace_dir, using py-spy
+        for python processes and gdb for anything else. Returns the file, or
+        None if no tool was available or the tool failed.
+        """
+
+        try:
+            is_python = "python" in proc.name()
+        except psutil.Error:
+            return None
+
+        if is_python and shutil.which("py-spy"):
+            cmd = f"py-spy dump --pid {proc.pid}"
+        elif shutil.which("gdb"):
+            cmd = f"gdb -batch -p {proc.pid} -ex 'thread apply all bt'"
+        else:
+            return None
+
+        stat, out, err = await run_cmd_async(cmd,timeout=120)
+        if stat!=0 and not out:
+            return None
+
+        self.trace_dir.mkdir(parents=True,exist_ok=True)
+        trace_file = self.trace_dir / f"trace_{proc.pid}.txt"
+        trace_file.write_text(f"# {cmd}\n{out}\n{err or ''}\n")
+        return trace_file
+
+###############################################################################
+class CancelMonitor(object):
+###############################################################################
+    """
+    Terminate the process tree of a command (gracefully, see terminate_process_tree)
+    as soon as cancel_file exists. The file can be written by any process
+    sharing the file system, so this works across workers and nodes.
+    """
+
+    poll_interval = 1
+
+    def __init__(self, name, cancel_file):
+        self.name        = name
+        self.cancel_file = pathlib.Path(cancel_file)
+        self.cancelled   = False
+
+    async def watch(self, pid, last_output_time):
+        while not self.cancel_file.exists():
+            await asyncio.sleep(self.poll_interval)
+
+        print(f"[{self.name}] CANCELLED: {self.cancel_file.read_text().strip()}. Terminating process {pid}.",
+              flush=True)
+        self.cancelled = True
+        await asyncio.get_running_loop().run_in_executor(None,terminate_process_tree,pid)
+
+###############################################################################
+def save_events(events_file, events):
+###############################################################################
+    events_file = pathlib.Path(events_file)
+    old = json.loads(events_file.read_text()) if events_file.exists() else []
+    events_file.write_text(json.dumps(old+events,indent=2))
+
+###############################################################################
+def load_events(events_file):
+###############################################################################
+    events_file = pathlib.Path(events_file)
+    return json.loads(events_file.read_text()) if events_file.exists() else []